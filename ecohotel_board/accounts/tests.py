@@ -1,3 +1,26 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import Client, TestCase
 
-# Create your tests here.
+from benchmarks.stubs import stubbed_services
+
+
+class LoginTest(TestCase):
+
+    def setUp(self):
+        self.services = stubbed_services()
+        self.services.__enter__()
+        self.addCleanup(self.services.__exit__, None, None, None)
+        User.objects.create_user(username='admin', password='password', is_staff=True)
+
+    def _login(self, ip_address):
+        return Client(REMOTE_ADDR=ip_address).post(
+            '/accounts/login/', {'username': 'admin', 'password': 'password'}, follow=True)
+
+    def test_login_redirects_to_home(self):
+        response = self._login('10.0.0.1')
+        self.assertRedirects(response, '/')
+        self.assertNotContains(response, 'WARNING IP DIFFERENT')
+
+    def test_login_from_different_ip_warns(self):
+        self._login('10.0.0.1')
+        self.assertContains(self._login('10.0.0.2'), 'WARNING IP DIFFERENT')
@@ -0,0 +1,276 @@
+"""
+End-to-end load benchmarks for the EcoHotelMonitor application.
+
+The benchmarks drive the main user flows through the Django test client, so they measure
+the whole request cycle (URL routing, middlewares, ORM queries and template rendering).
+
+Classes:
+    - BenchmarkRunner: Runs the scenarios and collects their metrics.
+
+Functions:
+    - calibrate: Measures the speed of the machine.
+    - percentile: Nearest-rank percentile of a list of samples.
+    - compare_with_baseline: Finds the metrics that regressed past a stored baseline.
+    - load_baseline: Loads a stored baseline.
+    - save_baseline: Stores a baseline.
+
+Global Variables:
+    - SCENARIOS: The names of the available scenarios.
+    - BASELINE_PATH: The default path of the stored baseline.
+"""
+
+import hashlib
+import itertools
+import json
+import math
+import time
+import tracemalloc
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+SCENARIOS = ('homepage', 'dashboard', 'create_report', 'login')
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'res' / 'baseline.json'
+
+_USERNAME = 'benchmark'
+_PASSWORD = 'benchmark-password'
+
+
+def percentile(samples, rank):
+    """
+    Compute the nearest-rank percentile of a list of samples.
+
+    Args:
+        samples (list): The samples.
+        rank (float): The percentile to compute, between 0 and 100.
+
+    Returns:
+        float: The percentile, 0 if there are no samples.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, math.ceil(rank / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def calibrate(rounds=5):
+    """
+    Measure the speed of the machine with a fixed CPU-bound workload.
+
+    The latencies are compared with the baseline in proportion to this measure, so a baseline
+    recorded on a faster or slower machine stays comparable.
+
+    Args:
+        rounds (int): The times the workload is run; the fastest run is kept.
+
+    Returns:
+        float: The duration of the workload, in milliseconds.
+    """
+    timings = []
+    for _ in range(rounds):
+        begin = time.perf_counter()
+        digest = b''
+        for index in range(20000):
+            digest = hashlib.sha256(digest + json.dumps({'index': index}).encode()).digest()
+        timings.append((time.perf_counter() - begin) * 1000)
+    return round(min(timings), 3)
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Find the metrics that regressed past a stored baseline.
+
+    Latency and memory may grow by `tolerance` before being reported, while the number of
+    queries is deterministic and must never grow. The latency is scaled by the ratio of the
+    calibrations of the two runs, when both have one.
+
+    Args:
+        results (dict): The metrics of each scenario.
+        baseline (dict): The stored metrics of each scenario.
+        tolerance (float): The allowed relative growth of latency and memory.
+
+    Returns:
+        list: A description of every regression.
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        expected = baseline.get(scenario)
+        if not expected:
+            continue
+        if metrics['queries'] > expected['queries']:
+            regressions.append(
+                f"{scenario}: {metrics['queries']} queries per request "
+                f"(baseline {expected['queries']})")
+        speed = 1.0
+        if metrics.get('calibration_ms') and expected.get('calibration_ms'):
+            speed = metrics['calibration_ms'] / expected['calibration_ms']
+        for metric, scale in (('p95_ms', speed), ('peak_memory_kb', 1.0)):
+            limit = expected[metric] * scale * (1 + tolerance)
+            if metrics[metric] > limit:
+                regressions.append(
+                    f"{scenario}: {metric} {metrics[metric]:.1f} "
+                    f"(baseline {expected[metric]:.1f}, limit {limit:.1f})")
+    return regressions
+
+
+class BenchmarkRunner:
+    """
+    Runs the benchmark scenarios and collects their metrics.
+
+    The database must already contain the dataset, and Redis and the blockchain must be
+    stubbed by the caller.
+
+    Attributes:
+        iterations (int): The measured requests of each scenario.
+        warmup (int): The unmeasured requests made before each scenario.
+        staff_client (Client): A client logged in as a staff user.
+    """
+
+    def __init__(self, iterations=20, warmup=2) -> None:
+        """
+        Initialize the BenchmarkRunner.
+
+        Args:
+            iterations (int): The measured requests of each scenario.
+            warmup (int): The unmeasured requests made before each scenario.
+        """
+        self.iterations = iterations
+        self.warmup = warmup
+        self._readings = itertools.count(1)
+        if not User.objects.filter(username=_USERNAME).exists():
+            User.objects.create_user(
+                username=_USERNAME, password=_PASSWORD, is_staff=True)
+        self.staff_client = Client()
+        self.staff_client.login(username=_USERNAME, password=_PASSWORD)
+
+    def run(self, scenarios=SCENARIOS):
+        """
+        Run the given scenarios.
+
+        Args:
+            scenarios (Iterable[str]): The names of the scenarios to run.
+
+        Returns:
+            dict: The metrics of each scenario, with the calibration of the machine.
+        """
+        calibration = calibrate()
+        return {scenario: {**self.run_scenario(scenario), 'calibration_ms': calibration}
+                for scenario in scenarios}
+
+    def run_scenario(self, scenario):
+        """
+        Run a single scenario.
+
+        The latency is measured without tracing, then one extra request is traced to measure
+        the number of queries, on every configured database, and the peak of allocated memory.
+
+        Args:
+            scenario (str): The name of the scenario.
+
+        Returns:
+            dict: The throughput, the latency percentiles, the queries and the memory peak.
+        """
+        request = getattr(self, f"_{scenario}")
+        for _ in range(self.warmup):
+            request()
+
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(self.iterations):
+            begin = time.perf_counter()
+            request()
+            latencies.append((time.perf_counter() - begin) * 1000)
+        elapsed = time.perf_counter() - started
+
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias]))
+                        for alias in connections]
+            tracemalloc.start()
+            try:
+                request()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+        return {
+            'requests': self.iterations,
+            'throughput_rps': round(self.iterations / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries': sum(len(queries) for queries in captured),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    @staticmethod
+    def _check(response, status, scenario):
+        """
+        Ensure that a scenario request succeeded.
+
+        Args:
+            response (HttpResponse): The response.
+            status (int): The expected status code.
+            scenario (str): The name of the scenario.
+
+        Raises:
+            RuntimeError: If the status code is not the expected one.
+        """
+        if response.status_code != status:
+            raise RuntimeError(
+                f"{scenario}: expected status {status}, got {response.status_code}")
+
+    def _homepage(self):
+        """Request the homepage as a staff user."""
+        self._check(self.staff_client.get('/'), 200, 'homepage')
+
+    def _dashboard(self):
+        """Request the dashboard as a staff user."""
+        self._check(self.staff_client.get('/dashboard/'), 200, 'dashboard')
+
+    def _create_report(self):
+        """Submit a new report as a staff user."""
+        response = self.staff_client.post('/create/', {
+            'name': 0, 'energy_produced': 1200 + next(self._readings), 'energy_consumed': 800})
+        self._check(response, 302, 'create_report')
+
+    def _login(self):
+        """Log in with a fresh client."""
+        response = Client().post('/accounts/login/', {
+            'username': _USERNAME, 'password': _PASSWORD})
+        self._check(response, 302, 'login')
+
+
+def load_baseline(path=BASELINE_PATH):
+    """
+    Load a stored baseline.
+
+    Args:
+        path (Path): The path of the baseline.
+
+    Returns:
+        dict or None: The baseline, None if it does not exist.
+    """
+    try:
+        with open(path, encoding='utf-8', mode='r') as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(baseline, path=BASELINE_PATH):
+    """
+    Store a baseline.
+
+    Args:
+        baseline (dict): The scale of the dataset and the metrics of each scenario.
+        path (Path): The path of the baseline.
+    """
+    with open(path, encoding='utf-8', mode='w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
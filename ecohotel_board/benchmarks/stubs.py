@@ -0,0 +1,766 @@
+"""
+Local stand-ins for the external services used by the application.
+
+The benchmarks and the tests must not depend on a running Redis server or on a blockchain
+endpoint, so this module provides in-memory replacements that can be patched in place of
+the real clients.
+
+Classes:
+    - FakeRedis: In-memory replacement of `redis.Redis`.
+    - FakePubSub: In-memory replacement of `redis.client.PubSub`.
+    - FakePipeline: In-memory replacement of `redis.client.Pipeline`.
+    - FakeBlockchainWriter: Replacement of `BlockchainWriter` that never leaves the process.
+
+Functions:
+    - stubbed_services: Context manager that patches Redis and the blockchain writer.
+"""
+
+import hashlib
+import itertools
+import queue
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+
+class FakeRedis:
+    """
+    In-memory replacement of `redis.Redis`.
+
+    The data is shared by all the instances, like the data of a real server is shared by all
+    its connections. Values are stored and returned as bytes, as the real client does.
+
+    Attributes:
+        _data (dict): The shared key space.
+        _channels (dict): The queues of the subscribers of each pub/sub channel.
+        _expiries (dict): The expiry, in seconds, requested for each key. Keys never expire.
+        _lock (Lock): Lock that serializes the commands.
+    """
+
+    _data = {}
+    _channels = {}
+    _expiries = {}
+    _lock = threading.RLock()
+
+    def __init__(self, *args, **kwargs) -> None:
+        """
+        Initialize the FakeRedis instance.
+
+        The connection arguments are accepted and ignored.
+
+        """
+
+    @staticmethod
+    def _encode(value):
+        """
+        Encode a value the way the real client does.
+
+        Args:
+            value (Any): The value to encode.
+
+        Returns:
+            bytes: The encoded value.
+        """
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    @classmethod
+    def flushall(cls):
+        """
+        Delete every key.
+
+        Returns:
+            bool: Always True.
+        """
+        with cls._lock:
+            cls._data.clear()
+            cls._channels.clear()
+            cls._expiries.clear()
+        return True
+
+    def get(self, key):
+        """
+        Get the value of a key.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            bytes or None: The value, None if the key does not exist.
+        """
+        return self._data.get(key)
+
+    def mget(self, keys, *args):
+        """
+        Get the values of several keys.
+
+        Args:
+            keys (str or list): The first key, or a list of keys.
+            *args (str): The other keys.
+
+        Returns:
+            list: The values, None for the keys that do not exist.
+        """
+        keys = [keys] if isinstance(keys, (str, bytes)) else list(keys)
+        return [self._data.get(key) for key in keys + list(args)]
+
+    def set(self, key, value, ex=None):
+        """
+        Set the value of a key.
+
+        Args:
+            key (str): The key.
+            value (Any): The value.
+            ex (int): Seconds before the key expires, accepted and ignored.
+
+        Returns:
+            bool: Always True.
+        """
+        with self._lock:
+            self._data[key] = self._encode(value)
+        return True
+
+    def delete(self, *keys):
+        """
+        Delete keys.
+
+        Args:
+            *keys (str): The keys to delete.
+
+        Returns:
+            int: The number of deleted keys.
+        """
+        with self._lock:
+            for key in keys:
+                self._expiries.pop(key, None)
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def incr(self, key, amount=1):
+        """
+        Increment the integer value of a key.
+
+        Args:
+            key (str): The key.
+            amount (int): The increment.
+
+        Returns:
+            int: The value after the increment.
+        """
+        with self._lock:
+            value = int(self._data.get(key, b'0')) + amount
+            self._data[key] = self._encode(value)
+            return value
+
+    def sadd(self, key, *members):
+        """
+        Add members to a set.
+
+        Args:
+            key (str): The key of the set.
+            *members (Any): The members to add.
+
+        Returns:
+            int: The number of added members.
+        """
+        with self._lock:
+            values = self._data.setdefault(key, set())
+            before = len(values)
+            values.update(self._encode(member) for member in members)
+            return len(values) - before
+
+    def srem(self, key, *members):
+        """
+        Remove members from a set.
+
+        Args:
+            key (str): The key of the set.
+            *members (Any): The members to remove.
+
+        Returns:
+            int: The number of removed members.
+        """
+        with self._lock:
+            values = self._data.get(key, set())
+            removed = {self._encode(member) for member in members} & values
+            values -= removed
+            return len(removed)
+
+    def expire(self, key, seconds):
+        """
+        Set the expiry of a key. The expiry is recorded but the key is kept.
+
+        Args:
+            key (str): The key.
+            seconds (int): Seconds before the key expires.
+
+        Returns:
+            bool: True if the key exists.
+        """
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._expiries[key] = seconds
+            return True
+
+    def ttl(self, key):
+        """
+        Get the expiry of a key.
+
+        Args:
+            key (str): The key.
+
+        Returns:
+            int: The recorded expiry in seconds, -1 if the key has none, -2 if it is missing.
+        """
+        with self._lock:
+            if key not in self._data:
+                return -2
+            return self._expiries.get(key, -1)
+
+    def sismember(self, key, member):
+        """
+        Check if a value is a member of a set.
+
+        Args:
+            key (str): The key of the set.
+            member (Any): The value.
+
+        Returns:
+            bool: True if the value is a member of the set.
+        """
+        return self._encode(member) in self._data.get(key, ())
+
+    def spop(self, key, count=None):
+        """
+        Remove and return random members of a set.
+
+        Args:
+            key (str): The key of the set.
+            count (int): The number of members, a single member by default.
+
+        Returns:
+            list or bytes or None: The removed members, or the member if no count is given.
+        """
+        with self._lock:
+            values = self._data.get(key, set())
+            popped = [values.pop() for _ in range(min(len(values), count or 1))]
+        if count is None:
+            return popped[0] if popped else None
+        return popped
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        """
+        Set fields of a hash.
+
+        Args:
+            key (str): The key of the hash.
+            field (str): A field to set.
+            value (Any): The value of the field.
+            mapping (dict): Other fields to set, with their values.
+
+        Returns:
+            int: The number of added fields.
+        """
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        with self._lock:
+            values = self._data.setdefault(key, {})
+            added = sum(self._encode(name) not in values for name in items)
+            values.update((self._encode(name), self._encode(item)) for name, item in items.items())
+            return added
+
+    def hget(self, key, field):
+        """
+        Get the value of a field of a hash.
+
+        Args:
+            key (str): The key of the hash.
+            field (str): The field.
+
+        Returns:
+            bytes or None: The value, None if the field does not exist.
+        """
+        return self._data.get(key, {}).get(self._encode(field))
+
+    def hmget(self, key, *fields):
+        """
+        Get the values of several fields of a hash.
+
+        Args:
+            key (str): The key of the hash.
+            *fields (str): The fields.
+
+        Returns:
+            list: The values, None for the fields that do not exist.
+        """
+        values = self._data.get(key, {})
+        return [values.get(self._encode(field)) for field in fields]
+
+    def hincrby(self, key, field, amount=1):
+        """
+        Increment the integer value of a field of a hash.
+
+        Args:
+            key (str): The key of the hash.
+            field (str): The field.
+            amount (int): The increment.
+
+        Returns:
+            int: The value after the increment.
+        """
+        with self._lock:
+            values = self._data.setdefault(key, {})
+            value = int(values.get(self._encode(field), b'0')) + amount
+            values[self._encode(field)] = self._encode(value)
+            return value
+
+    def hdel(self, key, *fields):
+        """
+        Delete fields of a hash.
+
+        Args:
+            key (str): The key of the hash.
+            *fields (str): The fields to delete.
+
+        Returns:
+            int: The number of deleted fields.
+        """
+        with self._lock:
+            values = self._data.get(key, {})
+            return sum(values.pop(self._encode(field), None) is not None for field in fields)
+
+    def zadd(self, key, mapping, gt=False, ch=False):
+        """
+        Set the scores of members of a sorted set.
+
+        Args:
+            key (str): The key of the sorted set.
+            mapping (dict): The score of each member.
+            gt (bool): True to only update a score that grows.
+            ch (bool): True to count the changed members instead of the added ones.
+
+        Returns:
+            int: The number of added, or changed, members.
+        """
+        added = changed = 0
+        with self._lock:
+            scores = self._data.setdefault(key, {})
+            for member, score in mapping.items():
+                member = self._encode(member)
+                previous = scores.get(member)
+                if previous is not None and gt and score <= previous:
+                    continue
+                added += previous is None
+                changed += previous != float(score)
+                scores[member] = float(score)
+        return changed if ch else added
+
+    def zincrby(self, key, amount, member):
+        """
+        Increment the score of a member of a sorted set.
+
+        Args:
+            key (str): The key of the sorted set.
+            amount (float): The increment.
+            member (Any): The member.
+
+        Returns:
+            float: The score after the increment.
+        """
+        with self._lock:
+            scores = self._data.setdefault(key, {})
+            member = self._encode(member)
+            scores[member] = scores.get(member, 0.0) + amount
+            return scores[member]
+
+    def zrem(self, key, *members):
+        """
+        Remove members of a sorted set.
+
+        Args:
+            key (str): The key of the sorted set.
+            *members (Any): The members to remove.
+
+        Returns:
+            int: The number of removed members.
+        """
+        with self._lock:
+            scores = self._data.get(key, {})
+            return sum(scores.pop(self._encode(member), None) is not None for member in members)
+
+    def zscore(self, key, member):
+        """
+        Get the score of a member of a sorted set.
+
+        Args:
+            key (str): The key of the sorted set.
+            member (Any): The member.
+
+        Returns:
+            float or None: The score, None if the member does not exist.
+        """
+        return self._data.get(key, {}).get(self._encode(member))
+
+    def zcard(self, key):
+        """
+        Count the members of a sorted set.
+
+        Args:
+            key (str): The key of the sorted set.
+
+        Returns:
+            int: The number of members.
+        """
+        return len(self._data.get(key, {}))
+
+    def _descending(self, key):
+        """
+        Sort the members of a sorted set from the highest score, as Redis does.
+
+        Args:
+            key (str): The key of the sorted set.
+
+        Returns:
+            list: The (member, score) pairs.
+        """
+        with self._lock:
+            items = list(self._data.get(key, {}).items())
+        return sorted(items, key=lambda item: (item[1], item[0]), reverse=True)
+
+    def zrevrange(self, key, start, end, withscores=False):
+        """
+        Get a range of members of a sorted set, from the highest score.
+
+        Args:
+            key (str): The key of the sorted set.
+            start (int): The 0-based rank of the first member.
+            end (int): The 0-based rank of the last member, included.
+            withscores (bool): True to return the scores as well.
+
+        Returns:
+            list: The members, or the (member, score) pairs.
+        """
+        items = self._descending(key)[start:end + 1 if end != -1 else None]
+        return items if withscores else [member for member, _ in items]
+
+    def zrevrank(self, key, member):
+        """
+        Get the rank of a member of a sorted set, from the highest score.
+
+        Args:
+            key (str): The key of the sorted set.
+            member (Any): The member.
+
+        Returns:
+            int or None: The 0-based rank, None if the member does not exist.
+        """
+        members = [item for item, _ in self._descending(key)]
+        member = self._encode(member)
+        return members.index(member) if member in members else None
+
+    def pipeline(self, transaction=True):
+        """
+        Create a pipeline of commands.
+
+        Args:
+            transaction (bool): Accepted and ignored, the commands always run atomically.
+
+        Returns:
+            FakePipeline: The pipeline.
+        """
+        return FakePipeline(self)
+
+    def publish(self, channel, message):
+        """
+        Publish a message on a channel.
+
+        Args:
+            channel (str): The channel.
+            message (Any): The message.
+
+        Returns:
+            int: The number of subscribers that received the message.
+        """
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.put({'type': 'message', 'channel': channel.encode('utf-8'),
+                            'data': self._encode(message)})
+        return len(subscribers)
+
+    def pubsub(self, **kwargs):
+        """
+        Create a pub/sub subscription.
+
+        Args:
+            **kwargs: The options of the subscription, accepted and ignored.
+
+        Returns:
+            FakePubSub: The subscription.
+        """
+        return FakePubSub(self._channels, self._lock)
+
+
+class FakePubSub:
+    """
+    In-memory replacement of `redis.client.PubSub`.
+
+    Attributes:
+        _channels (dict): The queues of the subscribers of each channel.
+        _lock (Lock): Lock that serializes the subscriptions.
+        _queue (Queue): The messages received by this subscription.
+    """
+
+    def __init__(self, channels, lock) -> None:
+        """
+        Initialize the FakePubSub instance.
+
+        Args:
+            channels (dict): The queues of the subscribers of each channel.
+            lock (Lock): Lock that serializes the subscriptions.
+        """
+        self._channels = channels
+        self._lock = lock
+        self._queue = queue.Queue()
+
+    def subscribe(self, *channels):
+        """
+        Subscribe to channels.
+
+        Args:
+            *channels (str): The channels.
+        """
+        with self._lock:
+            for channel in channels:
+                self._channels.setdefault(channel, []).append(self._queue)
+
+    def get_message(self, timeout=0.0, **kwargs):
+        """
+        Get the next message.
+
+        Args:
+            timeout (float): Seconds to wait for a message.
+            **kwargs: Other options, accepted and ignored.
+
+        Returns:
+            dict or None: The message, None if no message arrived in time.
+        """
+        try:
+            return self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """
+        Unsubscribe from every channel.
+        """
+        with self._lock:
+            for subscribers in self._channels.values():
+                if self._queue in subscribers:
+                    subscribers.remove(self._queue)
+
+
+class FakePipeline:
+    """
+    In-memory replacement of `redis.client.Pipeline`.
+
+    The commands are buffered and run together, under the lock of the client, by `execute`.
+
+    Attributes:
+        _client (FakeRedis): The client that runs the commands.
+        _commands (list): The buffered commands and their arguments.
+    """
+
+    def __init__(self, client) -> None:
+        """
+        Initialize the FakePipeline instance.
+
+        Args:
+            client (FakeRedis): The client that runs the commands.
+        """
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        """
+        Buffer a command of the client.
+
+        Args:
+            name (str): The name of the command.
+
+        Returns:
+            callable: A function that buffers the command and returns the pipeline.
+        """
+        command = getattr(self._client, name)
+
+        def buffer(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return buffer
+
+    def execute(self):
+        """
+        Run the buffered commands.
+
+        Returns:
+            list: The result of each command.
+        """
+        with self._client._lock:
+            results = [command(*args, **kwargs) for command, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+class FakeBlockchainWriter:
+    """
+    Replacement of `BlockchainWriter` that never leaves the process.
+
+    Transactions are really built and signed, only sending them is simulated.
+
+    Attributes:
+        latency (float): Seconds to wait for each transaction, to simulate the RPC round trip.
+        privateKey (str): A fixed private key, never used on a real network.
+        _counter (itertools.count): Shared counter that makes every transaction ID unique.
+    """
+
+    latency = 0.0
+    privateKey = '0x' + '11' * 32
+    _counter = itertools.count()
+
+    def __init__(self, *args, **kwargs) -> None:
+        """
+        Initialize the FakeBlockchainWriter instance.
+
+        The arguments are accepted and ignored.
+
+        """
+        self.address = '0x' + '0' * 40
+        self._nonce = 0
+        self._nonce_lock = threading.Lock()
+
+    def next_nonce(self):
+        """
+        Reserve the nonce of the next transaction.
+
+        Returns:
+            int: The reserved nonce.
+        """
+        return self.reserve_nonces(1)[0]
+
+    def reserve_nonces(self, count):
+        """
+        Reserve the nonces of a block of consecutive transactions.
+
+        Args:
+            count (int): The number of transactions.
+
+        Returns:
+            range: The reserved nonces.
+        """
+        with self._nonce_lock:
+            nonces = range(self._nonce, self._nonce + count)
+            self._nonce += count
+            return nonces
+
+    def consume_nonces(self, nonces):
+        """
+        Settle the nonces of sent transactions, nothing to do without a network.
+
+        Args:
+            nonces (list): The nonces.
+        """
+
+    def release_nonces(self, nonces):
+        """
+        Settle the nonces of failed transactions, nothing to do without a network.
+
+        Args:
+            nonces (list): The nonces.
+        """
+
+    @staticmethod
+    def get_gas_price():
+        """
+        Get a fixed gas price.
+
+        Returns:
+            int: The gas price in wei.
+        """
+        return 1
+
+    @staticmethod
+    def build_transaction(nonce, gas_price, message):
+        """
+        Build an unsigned transaction that carries a message.
+
+        Args:
+            nonce (int): The nonce of the transaction.
+            gas_price (int): The gas price in wei.
+            message (str): The message to be included in the transaction.
+
+        Returns:
+            dict: The unsigned transaction.
+        """
+        return dict(nonce=nonce, gasPrice=gas_price, gas=200000,
+                    to='0x0000000000000000000000000000000000000000', value=0,
+                    data=message.encode('utf-8'))
+
+    def send_raw_transaction(self, raw_transaction):
+        """
+        Pretend to send a signed transaction.
+
+        Args:
+            raw_transaction (bytes): The signed transaction.
+
+        Returns:
+            str: The fake transaction ID.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        return '0x' + hashlib.sha256(raw_transaction).hexdigest()
+
+    def send_transaction(self, message):
+        """
+        Pretend to send a transaction.
+
+        Args:
+            message (str): The message to be included in the transaction.
+
+        Returns:
+            str: A unique fake transaction ID.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        payload = f"{message}:{next(self._counter)}".encode('utf-8')
+        return '0x' + hashlib.sha256(payload).hexdigest()
+
+
+# Modules that hold a reference to BlockchainWriter and must see the stub.
+_WRITER_TARGETS = (
+    'blockchain.blockchain_writer.BlockchainWriter',
+    'energy_tracker.models.BlockchainWriter',
+    'energy_tracker.management.commands.backfill_anchors.BlockchainWriter',
+)
+
+
+@contextmanager
+def stubbed_services(chain_latency=0.0):
+    """
+    Patch Redis and the blockchain writer with the local stand-ins.
+
+    Args:
+        chain_latency (float): Seconds that every fake transaction takes.
+
+    Yields:
+        None
+    """
+    FakeRedis.flushall()
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch('redis.Redis', FakeRedis))
+        stack.enter_context(mock.patch.object(FakeBlockchainWriter, 'latency', chain_latency))
+        for target in _WRITER_TARGETS:
+            stack.enter_context(mock.patch(target, FakeBlockchainWriter))
+        yield
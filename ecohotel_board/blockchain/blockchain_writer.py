@@ -4,10 +4,14 @@ This module provides classes and functions related to blockchain interaction and
 Modules:
     - LoadConfiguration: Singleton class to load configuration options from a YAML file.
     - BlockchainWriter: Class for interacting with a blockchain network and sending transactions.
+    - RateLimiter: Thread-safe token bucket that limits the rate of the requests to the network.
 """
 
+import heapq
 from pathlib import Path
 import sys
+import threading
+import time
 from web3 import Web3
 import yaml
 
@@ -106,6 +110,13 @@ class BlockchainWriter:
         address (str): The address of the Ethereum account.
 
     Methods:
+        next_nonce(): Reserves the nonce of the next transaction.
+        reserve_nonces(count): Reserves the nonces of a block of transactions.
+        consume_nonces(nonces): Settles the reserved nonces of sent transactions.
+        release_nonces(nonces): Settles the reserved nonces of failed transactions, for reuse.
+        get_gas_price(): Reads the current gas price from the network.
+        build_transaction(nonce, gas_price, message): Builds an unsigned transaction.
+        send_raw_transaction(raw_transaction): Sends a signed transaction to the blockchain network.
         send_transaction(message): Sends a transaction to the blockchain network.
 
     """
@@ -122,31 +133,210 @@ class BlockchainWriter:
         self.account = self.w3.eth.account.create()
         self.privateKey = self.account.key.hex()
         self.address = self.account.address
+        self._nonce = None
+        # The reserved nonces not settled yet, and the released ones waiting to be reused.
+        self._outstanding = 0
+        self._released = []
+        self._nonce_lock = threading.Lock()
 
-    def send_transaction(self, message):
+    def next_nonce(self):
         """
-        Send a transaction to the blockchain network.
+        Reserve the nonce of the next transaction.
 
-        This method sends a transaction to the blockchain network with the provided message.
+        The nonce is read from the network only once and then incremented locally, so the
+        same writer can send transactions from several threads without reusing a nonce. A
+        nonce released by a failed transaction is reserved again first, filling the gap.
+
+        Returns:
+            int: The reserved nonce.
+
+        """
+        return self.reserve_nonces(1)[0]
+
+    def reserve_nonces(self, count):
+        """
+        Reserve the nonces of a block of consecutive transactions.
+
+        Every reserved nonce must then be settled with `consume_nonces` or `release_nonces`.
+
+        Args:
+            count (int): The number of transactions.
+
+        Returns:
+            range: The reserved nonces.
+
+        """
+        with self._nonce_lock:
+            self._outstanding += count
+            if count == 1 and self._released:
+                nonce = heapq.heappop(self._released)
+                return range(nonce, nonce + 1)
+            if self._nonce is None:
+                self._nonce = self.w3.eth.get_transaction_count(self.address, 'pending')
+            nonces = range(self._nonce, self._nonce + count)
+            self._nonce += count
+            return nonces
+
+    def consume_nonces(self, nonces):
+        """
+        Settle the reserved nonces of transactions that were sent.
+
+        Args:
+            nonces (list): The nonces.
+
+        """
+        self._settle(nonces, released=False)
+
+    def release_nonces(self, nonces):
+        """
+        Settle the reserved nonces of transactions that were not sent, so they are reused.
+
+        The other threads may still hold reserved nonces, so the local counter is kept: the
+        released nonces are handed out again by the next reservations.
+
+        Args:
+            nonces (list): The nonces.
+
+        """
+        self._settle(nonces, released=True)
+
+    def _settle(self, nonces, released):
+        """
+        Settle reserved nonces.
+
+        Once no reserved nonce is outstanding, the nonces still waiting to be reused are
+        dropped and the next reservation reads the nonce again from the network, which knows
+        whether the failed transactions reached it after all.
+
+        Args:
+            nonces (list): The nonces.
+            released (bool): True if their transactions were not sent.
+
+        """
+        with self._nonce_lock:
+            self._outstanding -= len(nonces)
+            if released:
+                for nonce in nonces:
+                    heapq.heappush(self._released, nonce)
+            if self._outstanding == 0 and self._released:
+                self._released = []
+                self._nonce = None
+
+    def get_gas_price(self):
+        """
+        Read the current gas price from the network.
+
+        Returns:
+            int: The gas price in wei.
+
+        """
+        return self.w3.eth.gas_price
+
+    @staticmethod
+    def build_transaction(nonce, gas_price, message):
+        """
+        Build an unsigned transaction that carries a message.
 
         Args:
+            nonce (int): The nonce of the transaction.
+            gas_price (int): The gas price in wei.
             message (str): The message to be included in the transaction.
 
         Returns:
-            str: The transaction ID.
+            dict: The unsigned transaction.
 
         """
-        nonce = self.w3.eth.get_transaction_count(self.address)
-        gasPrice = self.w3.eth.gas_price
-        value = self.w3.to_wei(0, 'ether')
-        signedTx = self.w3.eth.account.sign_transaction(dict(
+        return dict(
             nonce=nonce,
-            gasPrice=gasPrice,
+            gasPrice=gas_price,
             gas=200000,
             to='0x0000000000000000000000000000000000000000',
-            value=value,
+            value=Web3.to_wei(0, 'ether'),
             data=message.encode('utf-8')
-        ), self.privateKey)
-        tx = self.w3.eth.send_raw_transaction(signedTx.rawTransaction)
-        txId = self.w3.to_hex(tx)
-        return txId
+        )
+
+    def send_raw_transaction(self, raw_transaction):
+        """
+        Send a signed transaction to the blockchain network.
+
+        Args:
+            raw_transaction (bytes): The signed transaction.
+
+        Returns:
+            str: The transaction ID.
+
+        """
+        tx = self.w3.eth.send_raw_transaction(raw_transaction)
+        return self.w3.to_hex(tx)
+
+    def send_transaction(self, message):
+        """
+        Send a transaction to the blockchain network.
+
+        This method sends a transaction to the blockchain network with the provided message.
+
+        Args:
+            message (str): The message to be included in the transaction.
+
+        Returns:
+            str: The transaction ID.
+
+        """
+        nonce = self.next_nonce()
+        try:
+            signedTx = self.w3.eth.account.sign_transaction(
+                self.build_transaction(nonce, self.get_gas_price(), message), self.privateKey)
+            tx_id = self.send_raw_transaction(signedTx.rawTransaction)
+        except Exception:
+            self.release_nonces([nonce])
+            raise
+        self.consume_nonces([nonce])
+        return tx_id
+
+
+class RateLimiter:
+    """
+    RateLimiter class.
+
+    Thread-safe token bucket that limits the rate of the requests sent to the blockchain network.
+
+    Attributes:
+        rate (float): The allowed requests per second.
+        capacity (float): The maximum burst of requests.
+
+    Methods:
+        acquire(): Waits until a request is allowed.
+
+    """
+
+    def __init__(self, rate, capacity=None) -> None:
+        """
+        Initialize the RateLimiter.
+
+        Args:
+            rate (float): The allowed requests per second.
+            capacity (float): The maximum burst of requests, `rate` by default.
+
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a request is allowed by the rate limit.
+
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
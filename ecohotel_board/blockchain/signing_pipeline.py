@@ -0,0 +1,190 @@
+"""
+This module provides a multi-core pipeline that signs and sends blocks of transactions.
+
+Signing a transaction (secp256k1 signature and RLP encoding) is CPU-bound and holds the GIL,
+so signing thousands of transactions inline with `BlockchainWriter.send_transaction` is the
+bottleneck of a bulk anchoring. The pipeline reserves a block of nonces, signs the
+transactions in a pool of processes and streams the signed transactions to a sender thread,
+which sends them in nonce order while the next chunks are still being signed.
+
+Classes:
+    - SigningPipeline: Pipeline that signs transactions on every core and sends them.
+
+Functions:
+    - sign_transactions: Signs a chunk of transactions, in a worker process.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from eth_account import Account
+
+
+def sign_transactions(private_key, transactions):
+    """
+    Sign a chunk of transactions.
+
+    This function runs in the worker processes of the pipeline.
+
+    Args:
+        private_key (str): The private key of the account that signs the transactions.
+        transactions (list): The unsigned transactions.
+
+    Returns:
+        list: The signed raw transactions, as bytes.
+    """
+    return [bytes(Account.sign_transaction(transaction, private_key).rawTransaction)
+            for transaction in transactions]
+
+
+class SigningPipeline:
+    """
+    SigningPipeline class.
+
+    Pipeline with three stages: nonce allocation, signing in a pool of processes and sending
+    from a dedicated thread. A failed transaction leaves a gap in the nonces that would block
+    every following transaction, so the rest of the block is not sent and its nonces are
+    released to the writer, which reuses them.
+
+    Attributes:
+        writer (BlockchainWriter): The writer that provides nonces and sends the transactions.
+        chunk_size (int): The transactions signed together by a worker process.
+        limiter (RateLimiter): The rate limiter of the sender stage, None for no limit.
+        stats (dict): The processed items and busy seconds of each stage.
+
+    Methods:
+        run(messages): Signs and sends a transaction for each message.
+        throughput(): Computes the throughput of each stage.
+        close(): Shuts down the worker processes.
+    """
+
+    STAGES = ('nonces', 'signing', 'sending')
+
+    def __init__(self, writer, processes=None, chunk_size=32, limiter=None) -> None:
+        """
+        Initialize the SigningPipeline.
+
+        Args:
+            writer (BlockchainWriter): The writer that provides nonces and sends the transactions.
+            processes (int): The signing processes, the number of cores by default.
+            chunk_size (int): The transactions signed together by a worker process.
+            limiter (RateLimiter): The rate limiter of the sender stage, None for no limit.
+        """
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.limiter = limiter
+        self.stats = {stage: {'items': 0, 'seconds': 0.0} for stage in self.STAGES}
+        self._pool = ProcessPoolExecutor(max_workers=processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Shut down the worker processes.
+        """
+        self._pool.shutdown()
+
+    def run(self, messages):
+        """
+        Sign and send a transaction for each message.
+
+        Args:
+            messages (list): The messages to be included in the transactions.
+
+        Returns:
+            list: For each message, the transaction ID or the exception that prevented sending it.
+        """
+        results = [None] * len(messages)
+        if not messages:
+            return results
+
+        started = time.perf_counter()
+        nonces = self.writer.reserve_nonces(len(messages))
+        gas_price = self.writer.get_gas_price()
+        transactions = [self.writer.build_transaction(nonce, gas_price, message)
+                        for nonce, message in zip(nonces, messages)]
+        self._record('nonces', len(messages), started)
+
+        signed = queue.Queue()
+        sender = threading.Thread(target=self._send, args=(signed, results))
+        sender.start()
+
+        started = time.perf_counter()
+        position = 0
+        try:
+            chunks = [transactions[index:index + self.chunk_size]
+                      for index in range(0, len(transactions), self.chunk_size)]
+            sign = partial(sign_transactions, self.writer.privateKey)
+            for raw_transactions in self._pool.map(sign, chunks):
+                for raw_transaction in raw_transactions:
+                    signed.put((position, raw_transaction))
+                    position += 1
+        except Exception as exc:  # pylint: disable=broad-except
+            for index in range(position, len(messages)):
+                results[index] = exc
+        finally:
+            self._record('signing', position, started)
+            signed.put(None)
+            sender.join()
+            self.writer.consume_nonces([nonce for nonce, result in zip(nonces, results)
+                                        if not isinstance(result, Exception)])
+            self.writer.release_nonces([nonce for nonce, result in zip(nonces, results)
+                                        if isinstance(result, Exception)])
+        return results
+
+    def _send(self, signed, results):
+        """
+        Send the signed transactions, in nonce order, until the end of the block.
+
+        Args:
+            signed (Queue): The positions and the signed transactions, None at the end.
+            results (list): The transaction IDs or the exceptions, filled in place.
+        """
+        started = time.perf_counter()
+        sent = 0
+        failure = None
+        while True:
+            item = signed.get()
+            if item is None:
+                break
+            position, raw_transaction = item
+            if failure is not None:
+                results[position] = failure
+                continue
+            if self.limiter:
+                self.limiter.acquire()
+            try:
+                results[position] = self.writer.send_raw_transaction(raw_transaction)
+                sent += 1
+            except Exception as exc:  # pylint: disable=broad-except
+                failure = results[position] = exc
+        self._record('sending', sent, started)
+
+    def _record(self, stage, items, started):
+        """
+        Record the work of a stage.
+
+        Args:
+            stage (str): The name of the stage.
+            items (int): The processed items.
+            started (float): The `time.perf_counter()` at the start of the work.
+        """
+        self.stats[stage]['items'] += items
+        self.stats[stage]['seconds'] += time.perf_counter() - started
+
+    def throughput(self):
+        """
+        Compute the throughput of each stage.
+
+        Returns:
+            dict: The items per second of each stage.
+        """
+        return {stage: (stats['items'] / stats['seconds'] if stats['seconds'] else 0.0)
+                for stage, stats in self.stats.items()}
@@ -0,0 +1,444 @@
+"""
+Database routing for the ecohotel_board project.
+
+The heavy read views (homepage, dashboard, analytics) can read the energy data from a
+read-only replica, so their aggregations do not compete with the report inserts on the
+primary database. Everything else, and every write, goes to the primary database.
+
+After a write of the energy data, the client reads from the primary for
+`REPLICA_STICKY_SECONDS`, so it always sees its own writes even if the replica lags behind.
+The writes of the sessions and of the last login do not pin the client.
+
+The reports can also be partitioned by hotel across the databases of `REPORT_SHARDS`. The
+shard of a hotel is chosen by rendezvous hashing of its id, so every process agrees on it
+without a lookup, and adding a shard only moves the hotels that now prefer the new one. The
+hotels themselves are written to the primary and copied to every shard.
+
+Classes:
+    - ShardRouter: Database router that sends the reports of each hotel to its shard.
+    - ReplicaRouter: Database router that sends the marked reads to the replica.
+    - ReplicaPinningMiddleware: Middleware that pins a client to the primary after a write.
+    - ReplicaReadMixin: View mixin that marks the reads of a view for the replica.
+
+Functions:
+    - shard_aliases: Lists the shards of the reports.
+    - shard_for_hotel: Chooses the shard of a hotel.
+    - current_shard: Gets the shard selected by `use_shard`.
+    - use_shard: Context manager that sends the queries of the reports to a shard.
+    - read_from_replica: Context manager that marks the reads for the replica.
+    - reads_from_replica: Tells whether the reads of the energy data go to the replica.
+"""
+
+import hashlib
+import time
+from contextlib import contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Per-request routing state: `replica` while reads may go to the replica, `pinned` when the
+# client (or the current request) wrote recently, `shard` inside `use_shard()`.
+_state = Local()
+
+PIN_COOKIE = 'pin_primary'
+
+
+def _replica_alias():
+    """
+    Get the alias of the replica.
+
+    Returns:
+        str or None: The alias, None if no replica is configured.
+    """
+    alias = getattr(settings, 'REPLICA_DATABASE', None)
+    return alias if alias in settings.DATABASES else None
+
+
+def shard_aliases():
+    """
+    List the shards of the reports.
+
+    Returns:
+        list: The aliases of the shards, empty if the reports are not partitioned.
+    """
+    return [alias for alias in getattr(settings, 'REPORT_SHARDS', [])
+            if alias in settings.DATABASES]
+
+
+def shard_for_hotel(ecohotel_id, aliases=None):
+    """
+    Choose the shard of a hotel, the one with the highest hash of the hotel and its alias.
+
+    Args:
+        ecohotel_id (int): The id of the hotel.
+        aliases (list): The shards to choose from, `shard_aliases()` by default.
+
+    Returns:
+        str: The alias of the shard, the primary if the reports are not partitioned.
+    """
+    aliases = shard_aliases() if aliases is None else aliases
+    if not aliases:
+        return DEFAULT_DB_ALIAS
+    return max(aliases, key=lambda alias: hashlib.sha1(
+        f"{alias}:{ecohotel_id}".encode('utf-8')).digest())
+
+
+def current_shard():
+    """
+    Get the shard selected by `use_shard`.
+
+    Returns:
+        str or None: The alias of the shard, None outside `use_shard()`.
+    """
+    return getattr(_state, 'shard', None)
+
+
+@contextmanager
+def use_shard(alias):
+    """
+    Send the queries of the reports made in the block, in the current thread, to a shard.
+
+    The copies of the hotels are read from the same shard, so the joins between hotels and
+    reports run there.
+
+    Args:
+        alias (str): The alias of the shard, None to route by hotel again.
+    """
+    previous = current_shard()
+    _state.shard = alias
+    try:
+        yield
+    finally:
+        _state.shard = previous
+
+
+def _pin_after_write(model):
+    """
+    Pin the current request to the primary if it writes the energy data.
+
+    Args:
+        model (Model): The model that is written.
+    """
+    if model._meta.app_label in ReplicaRouter.replica_apps:
+        _state.pinned = True
+        _state.wrote = True
+
+
+def _hotel_of(instance):
+    """
+    Get the hotel that an instance of the energy data belongs to.
+
+    Args:
+        instance (Model): A hotel, or a report or segment of a hotel.
+
+    Returns:
+        int or None: The id of the hotel, None if it is not known.
+    """
+    if instance is None:
+        return None
+    if instance._meta.model_name == 'ecohotel':
+        return instance.pk
+    return getattr(instance, 'ecohotel_id', None)
+
+
+class ShardRouter:
+    """
+    ShardRouter class.
+
+    Database router that sends the reports and the archived segments of each hotel to the
+    shard of the hotel, found from the `instance` hint of the query. The queries without a
+    hotel, such as the aggregations over the fleet, must run inside `use_shard()` once per
+    shard (see `energy_tracker.sharding.fan_out`); outside of it the reads raise instead of
+    silently reading the primary, which holds none of the reports. The router does nothing
+    when `REPORT_SHARDS` is empty.
+
+    Attributes:
+        app_label (str): The application of the energy data.
+        sharded_models (set): The models partitioned by hotel.
+        mirrored_models (set): The models copied to every shard.
+    """
+
+    app_label = 'energy_tracker'
+    sharded_models = {'report', 'reportsegment'}
+    mirrored_models = {'ecohotel'}
+
+    def db_for_read(self, model, **hints):
+        """
+        Choose the database of a read.
+
+        Args:
+            model (Model): The model that is read.
+            **hints: The routing hints.
+
+        Returns:
+            str or None: The shard alias, or None to let the next router choose.
+
+        Raises:
+            RuntimeError: If a partitioned model is read without a hotel outside of
+                `use_shard()`.
+        """
+        if model._meta.app_label != self.app_label or not shard_aliases():
+            return None
+        name = model._meta.model_name
+        if current_shard() and name in self.sharded_models | self.mirrored_models:
+            return current_shard()
+        home = self._home(name, hints)
+        if home is None and name in self.sharded_models:
+            raise RuntimeError(
+                f"The {model.__name__} rows are sharded by hotel: read them with an instance "
+                f"hint, inside use_shard(), or through energy_tracker.sharding.fan_out().")
+        return home
+
+    def db_for_write(self, model, **hints):
+        """
+        Choose the database of a write. The hotels are written to the primary.
+
+        The write pins the request to the primary, as `ReplicaRouter` would, since the
+        reports written to a shard never reach it.
+
+        Args:
+            model (Model): The model that is written.
+            **hints: The routing hints.
+
+        Returns:
+            str or None: The shard alias, or None to let the next router choose.
+        """
+        if model._meta.app_label != self.app_label or not shard_aliases():
+            return None
+        _pin_after_write(model)
+        name = model._meta.model_name
+        if current_shard() and name in self.sharded_models:
+            return current_shard()
+        return self._home(name, hints)
+
+    def _home(self, name, hints):
+        """
+        Find the shard of the hotel of a query on a partitioned model.
+
+        Args:
+            name (str): The name of the model.
+            hints (dict): The routing hints.
+
+        Returns:
+            str or None: The shard alias, None if the model is not partitioned or the hotel
+                is not known.
+        """
+        if name not in self.sharded_models:
+            return None
+        ecohotel_id = _hotel_of(hints.get('instance'))
+        return shard_for_hotel(ecohotel_id) if ecohotel_id is not None else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """
+        Allow the relations between objects of the primary and of the shards.
+
+        Args:
+            obj1 (Model): The first object.
+            obj2 (Model): The second object.
+            **hints: The routing hints.
+
+        Returns:
+            bool or None: True if both objects belong to the primary or to a shard.
+        """
+        aliases = set(shard_aliases())
+        if aliases and {obj1._state.db, obj2._state.db} <= aliases | {DEFAULT_DB_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """
+        Create on the shards only the tables of the hotels, the reports and the segments.
+
+        Args:
+            db (str): The alias of the database.
+            app_label (str): The application of the migration.
+            model_name (str): The model of the migration.
+            **hints: The routing hints.
+
+        Returns:
+            bool or None: Whether the migration runs on a shard, None for the other databases.
+        """
+        if db not in shard_aliases():
+            return None
+        return app_label == self.app_label and (
+            model_name is None or model_name in self.sharded_models | self.mirrored_models)
+
+
+@contextmanager
+def read_from_replica():
+    """
+    Mark the reads of the energy data made in the block for the replica.
+
+    """
+    previous = getattr(_state, 'replica', False)
+    _state.replica = True
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def reads_from_replica():
+    """
+    Tell whether the reads of the energy data made now go to the replica.
+
+    Returns:
+        bool: True inside `read_from_replica()`, when a replica is configured and the client
+            is not pinned to the primary.
+    """
+    return bool(_replica_alias() and getattr(_state, 'replica', False)
+                and not getattr(_state, 'pinned', False))
+
+
+class ReplicaRouter:
+    """
+    ReplicaRouter class.
+
+    Database router that sends the reads of the energy data to the replica, but only inside
+    `read_from_replica()` and while the client is not pinned to the primary. Authentication
+    and sessions always use the primary.
+
+    Attributes:
+        replica_apps (set): The applications whose reads may go to the replica.
+    """
+
+    replica_apps = {'energy_tracker'}
+
+    def db_for_read(self, model, **hints):
+        """
+        Choose the database of a read.
+
+        Args:
+            model (Model): The model that is read.
+            **hints: The routing hints.
+
+        Returns:
+            str or None: The replica alias, or None to use the primary.
+        """
+        if model._meta.app_label in self.replica_apps and reads_from_replica():
+            return _replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        """
+        Choose the database of a write, pinning the current request to the primary when it
+        writes the energy data.
+
+        Args:
+            model (Model): The model that is written.
+            **hints: The routing hints.
+
+        Returns:
+            str: The primary alias.
+        """
+        _pin_after_write(model)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """
+        Allow the relations between objects of the primary and of the replica.
+
+        Args:
+            obj1 (Model): The first object.
+            obj2 (Model): The second object.
+            **hints: The routing hints.
+
+        Returns:
+            bool or None: True if both objects belong to the primary or to the replica.
+        """
+        aliases = {DEFAULT_DB_ALIAS, _replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """
+        Forbid the migrations on the replica, which copies the primary.
+
+        Args:
+            db (str): The alias of the database.
+            app_label (str): The application of the migration.
+            model_name (str): The model of the migration.
+            **hints: The routing hints.
+
+        Returns:
+            bool or None: False for the replica, None otherwise.
+        """
+        if db == _replica_alias():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    ReplicaPinningMiddleware class.
+
+    Middleware that pins a client to the primary for `REPLICA_STICKY_SECONDS` after a request
+    that wrote the energy data, through a short-lived cookie.
+
+    Attributes:
+        get_response (callable): The next middleware or view.
+    """
+
+    def __init__(self, get_response) -> None:
+        """
+        Initialize the ReplicaPinningMiddleware.
+
+        Args:
+            get_response (callable): The next middleware or view.
+        """
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """
+        Handle a request.
+
+        Args:
+            request (HttpRequest): The HttpRequest object of the request.
+
+        Returns:
+            HttpResponse: The response.
+        """
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        _state.pinned = pinned_until > time.time()
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            if _state.wrote:
+                sticky = settings.REPLICA_STICKY_SECONDS
+                response.set_cookie(PIN_COOKIE, str(time.time() + sticky), max_age=sticky,
+                                    httponly=True, samesite='Lax')
+            return response
+        finally:
+            _state.pinned = _state.wrote = False
+
+
+class ReplicaReadMixin:
+    """
+    ReplicaReadMixin class.
+
+    View mixin that marks the reads of the energy data made by the view, including the lazy
+    ones made while rendering its template, for the replica.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        """
+        Dispatch the request, reading the energy data from the replica.
+
+        Args:
+            request (HttpRequest): The HttpRequest object of the request.
+            *args: Additional positional arguments.
+            **kwargs: Additional keyword arguments.
+
+        Returns:
+            HttpResponse: The rendered response.
+        """
+        with read_from_replica():
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            return response
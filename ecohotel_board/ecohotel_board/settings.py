@@ -51,6 +51,7 @@ CRISPY_TEMPLATE_PACK = "bootstrap5" # template pack da usare con django_crispy_f
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'ecohotel_board.db_routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,6 +95,45 @@ DATABASES = {
     }
 }
 
+# Optional read-only replica for the heavy read views (see ecohotel_board/db_routers.py).
+# Set ECOHOTEL_REPLICA_DB to the path of a copy of db.sqlite3 to try it locally.
+REPLICA_DATABASE = 'replica'
+if os.environ.get('ECOHOTEL_REPLICA_DB'):
+    DATABASES[REPLICA_DATABASE] = {
+        'ENGINE': os.environ.get('ECOHOTEL_REPLICA_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': os.environ['ECOHOTEL_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Optional partitioning of the reports by hotel across several databases (see
+# ecohotel_board/db_routers.py). Set ECOHOTEL_SHARD_DBS to a comma-separated list of SQLite
+# paths to try it locally; a new shard is appended at the end of the list, then
+# `manage.py rebalance_shards` moves the hotels that now belong to it.
+REPORT_SHARDS = []
+for index, name in enumerate(filter(None, os.environ.get('ECOHOTEL_SHARD_DBS', '').split(','))):
+    REPORT_SHARDS.append(f'shard_{index}')
+    DATABASES[REPORT_SHARDS[-1]] = {
+        'ENGINE': os.environ.get('ECOHOTEL_SHARD_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': name.strip(),
+    }
+
+# Ids of the reports reserved at once by a process when the reports are partitioned.
+SHARD_ID_BLOCK_SIZE = 1000
+
+DATABASE_ROUTERS = [
+    'ecohotel_board.db_routers.ShardRouter',
+    'ecohotel_board.db_routers.ReplicaRouter',
+]
+
+# Seconds during which a client reads from the primary after a write.
+REPLICA_STICKY_SECONDS = 5
+
+# Age, in days, after which the reports are moved into the archived monthly segments.
+REPORT_ARCHIVE_HORIZON_DAYS = 365
+
+# Grid region of the emission factors used for the hotels whose region has no factors.
+CARBON_DEFAULT_REGION = 'IT'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -135,6 +175,14 @@ STATICFILES_DIRS = [BASE_DIR / 'static-storage']
 
 STATIC_URL = '/static/'
 
+# collectstatic fingerprints the files and writes their gzip and brotli variants here.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STATICFILES_STORAGE = 'ecohotel_board.static_files.CompressedManifestStaticFilesStorage'
+
+# Serve STATIC_ROOT from the application; disable it when a web server or a CDN serves it.
+SERVE_STATIC = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
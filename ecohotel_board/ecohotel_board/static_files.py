@@ -0,0 +1,219 @@
+"""
+Static files of the ecohotel_board project.
+
+`collectstatic` stores every static file under a name fingerprinted with the hash of its
+content (e.g. `css/style.4b1e9f0c2a7d.css`) and next to it a gzip and a brotli variant of
+the text files. The serving view answers from `STATIC_ROOT` with the smallest variant the
+client accepts; the fingerprinted files never change, so they are cached for a year without
+revalidation.
+
+Classes:
+    - CompressedManifestStaticFilesStorage: Storage that fingerprints and precompresses the files.
+
+Functions:
+    - accepted_encodings: Parses the encodings accepted by a client.
+    - serve_static: Serves a collected static file.
+
+Global Variables:
+    - COMPRESSED_EXTENSIONS: The extensions of the files worth compressing.
+    - ENCODINGS: The precompressed variants, from the preferred one.
+    - IMMUTABLE_CACHE_CONTROL: The Cache-Control header of the fingerprinted files.
+"""
+
+import gzip
+import mimetypes
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional, gzip is always produced.
+    brotli = None
+
+COMPRESSED_EXTENSIONS = {'.css', '.js', '.svg', '.html', '.txt', '.json', '.map', '.xml'}
+
+# (Content-Encoding, file suffix) of the variants, from the preferred one.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# A fingerprinted file never changes: one year without revalidation.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _compress(content, encoding):
+    """
+    Compress the content of a file.
+
+    Args:
+        content (bytes): The content.
+        encoding (str): 'br' or 'gzip'.
+
+    Returns:
+        bytes or None: The compressed content, None if the encoding is not available.
+    """
+    if encoding == 'br':
+        return brotli.compress(content, quality=11) if brotli else None
+    # A fixed mtime keeps the output reproducible across runs.
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    CompressedManifestStaticFilesStorage class.
+
+    Manifest storage that also writes a `.gz` and a `.br` variant of the collected text files,
+    when the variant is smaller. Until `collectstatic` has written the manifest, the URLs fall
+    back to the plain file names, so a checkout without collected files still renders.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        """
+        Fingerprint the collected files, then precompress them.
+
+        Args:
+            paths (dict): The collected files.
+            dry_run (bool): True to skip the processing.
+            **options: The options of collectstatic.
+
+        Yields:
+            tuple: The original name, the stored name and whether the file was processed.
+        """
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # Only the final names: the intermediate passes of the CSS files are not served.
+        for name in paths:
+            hashed_name = self.hashed_files.get(self.hash_key(self.clean_name(name)))
+            for stored in {name, hashed_name}:
+                if stored and Path(stored).suffix in COMPRESSED_EXTENSIONS:
+                    self._write_compressed(stored)
+
+    def _write_compressed(self, name):
+        """
+        Write the compressed variants of a stored file.
+
+        Args:
+            name (str): The stored name of the file.
+        """
+        with self.open(name) as original:
+            content = original.read()
+        for encoding, suffix in ENCODINGS:
+            compressed = _compress(content, encoding)
+            if compressed is None or len(compressed) >= len(content):
+                continue
+            with open(self.path(name) + suffix, 'wb') as variant:
+                variant.write(compressed)
+
+    @cached_property
+    def fingerprinted_names(self):
+        """
+        Get the stored names of the fingerprinted files, computed once per manifest.
+
+        Returns:
+            frozenset: The names listed in the manifest.
+        """
+        return frozenset(self.hashed_files.values())
+
+    def save_manifest(self):
+        """
+        Write the manifest of the collected files, and forget the names of the previous one.
+        """
+        super().save_manifest()
+        self.__dict__.pop('fingerprinted_names', None)
+
+    def stored_name(self, name):
+        """
+        Get the fingerprinted name of a file, the plain name before the first collectstatic.
+
+        Args:
+            name (str): The name of the file.
+
+        Returns:
+            str: The stored name.
+
+        Raises:
+            ValueError: If the manifest exists but does not list the file.
+        """
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            if self.hashed_files:
+                raise
+            return name
+
+
+def accepted_encodings(header):
+    """
+    Parse the encodings accepted by a client.
+
+    Args:
+        header (str): The Accept-Encoding header.
+
+    Returns:
+        set: The accepted encodings, without the ones refused with q=0.
+    """
+    encodings = set()
+    for item in header.split(','):
+        encoding, _, params = item.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if encoding:
+            encodings.add(encoding.strip().lower())
+    return encodings
+
+
+@require_safe
+def serve_static(request, path):
+    """
+    Serve a collected static file, precompressed when the client accepts it.
+
+    Args:
+        request (HttpRequest): The HttpRequest object of the request.
+        path (str): The path of the file under STATIC_ROOT.
+
+    Returns:
+        FileResponse: The file, or HttpResponseNotModified for a revalidated plain file.
+
+    Raises:
+        Http404: If the file was not collected.
+    """
+    # safe_join raises SuspiciousFileOperation, answered with 400, for a path out of STATIC_ROOT.
+    full_path = safe_join(settings.STATIC_ROOT, path)
+    if not os.path.isfile(full_path):
+        raise Http404("Static file not found.")
+
+    fingerprinted = path in staticfiles_storage.fingerprinted_names
+    stat = os.stat(full_path)
+    if not fingerprinted and not was_modified_since(
+            request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    served_path, content_encoding = full_path, None
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted and os.path.isfile(full_path + suffix):
+            served_path, content_encoding = full_path + suffix, encoding
+            break
+
+    response = FileResponse(open(served_path, 'rb'), content_type=content_type,
+                            filename=os.path.basename(full_path))
+    if content_encoding:
+        response['Content-Encoding'] = content_encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if fingerprinted else 'public, no-cache'
+    return response
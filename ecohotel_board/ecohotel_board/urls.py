@@ -2,11 +2,17 @@
 
 This module configures the URL patterns for the ecohotel_board application.
 The `urlpatterns` list routes URLs to views, including paths for the admin interface,
-Jet admin dashboard, energy_tracker app, and authentication-related URLs.
+Jet admin dashboard, energy_tracker app, authentication-related URLs and, with
+`SERVE_STATIC`, the collected static files.
 
 """
+import re
+
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from .static_files import serve_static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -14,3 +20,7 @@ urlpatterns = [
     path('accounts/', include('accounts.urls')),
     path('accounts/', include('django.contrib.auth.urls')),
 ]
+
+if settings.SERVE_STATIC and settings.STATIC_URL.startswith('/'):
+    urlpatterns.append(re_path(
+        r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), serve_static))
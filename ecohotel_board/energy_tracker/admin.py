@@ -1,3 +1,56 @@
+"""
+Admin site of the energy report application.
+
+Classes:
+    - EcoHotelAdminForm: Form of the EcoHotels, with the grid regions as choices.
+    - EcoHotelAdmin: Admin of the EcoHotels.
+"""
+
+from django import forms
 from django.contrib import admin
 
-# Register your models here.
+from .carbon import EmissionFactors
+from .models import EcoHotel
+
+
+def region_choices():
+    """
+    Build the choices for the grid region of a hotel, the regions of the emission factors.
+
+    Returns:
+        list: A list of (region, region) tuples.
+    """
+    return [(region, region) for region in EmissionFactors.load().regions()]
+
+
+class EcoHotelAdminForm(forms.ModelForm):
+    """
+    Form of the EcoHotels in the admin site.
+
+    The region is chosen among the regions of the emission factors, so the carbon footprint
+    of the hotel is not silently computed with the factors of the default region.
+
+    Attributes:
+        region (ChoiceField): The grid region of the EcoHotel.
+    """
+
+    region = forms.ChoiceField(choices=region_choices)
+
+    class Meta:
+        model = EcoHotel
+        fields = ['name', 'region']
+
+
+@admin.register(EcoHotel)
+class EcoHotelAdmin(admin.ModelAdmin):
+    """
+    Admin of the EcoHotels.
+
+    A saved hotel is copied to the shards, and its cached footprint dropped, by the signal
+    receivers, like any other save.
+    """
+
+    form = EcoHotelAdminForm
+    list_display = ('name', 'region')
+    list_filter = ('region',)
+    search_fields = ('name',)
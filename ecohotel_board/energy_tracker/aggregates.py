@@ -0,0 +1,391 @@
+"""
+Aggregations of the energy data.
+
+The statistics are computed with a few grouped queries over the whole fleet, merging the
+hot reports with the rollups of the archived monthly segments. When the reports are
+partitioned, the queries run on every shard in parallel and the partial results are merged.
+
+Functions:
+    - period_start: Finds the period of a granularity that contains a day.
+    - period_starts: Lists the periods of a granularity in a date range.
+    - energy_series: Computes the energy produced and consumed in each period of a range.
+    - comparison_range: Computes the range a date range is compared with.
+    - compare_periods: Compares the energy series of a range with another range.
+    - empty_statistics: Builds the statistics of a hotel without reports.
+    - hotel_statistics: Computes the dashboard statistics of every hotel.
+    - rebuild_leaderboards: Recomputes every leaderboard from the database.
+    - refresh_dirty_leaderboards: Recomputes the hotels marked as dirty in the leaderboards.
+"""
+
+import datetime
+
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from .models import EcoHotel, Report, ReportSegment
+from .sharding import fan_out
+from .utils import HotelLeaderboard
+
+# The grouping function of the reports for each granularity of the series.
+GRANULARITIES = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}
+
+
+def empty_statistics():
+    """
+    Build the statistics of a hotel without reports.
+
+    Returns:
+        dict: The statistics, with zero totals and no best or worst day.
+    """
+    return {
+        'total_consumed': 0,
+        'total_produced': 0,
+        'max_energy_prod_day': None,
+        'max_energy_prod': None,
+        'max_energy_cons_day': None,
+        'max_energy_cons': None,
+    }
+
+
+def _merge_day(statistics, day, produced, consumed):
+    """
+    Merge the totals of a day into the best and worst day of a hotel.
+
+    Args:
+        statistics (dict): The statistics of the hotel, updated in place.
+        day (date): The day.
+        produced (int): The energy produced in the day.
+        consumed (int): The energy consumed in the day.
+    """
+    if produced is not None and (statistics['max_energy_prod'] is None
+                                 or produced > statistics['max_energy_prod']):
+        statistics['max_energy_prod_day'], statistics['max_energy_prod'] = day, produced
+    if consumed is not None and (statistics['max_energy_cons'] is None
+                                 or consumed < statistics['max_energy_cons']):
+        statistics['max_energy_cons_day'], statistics['max_energy_cons'] = day, consumed
+
+
+def _daily_subquery(field, ordering, value):
+    """
+    Build the subquery that selects the best or worst day of the outer hotel.
+
+    Args:
+        field (str): The energy field summed in each day.
+        ordering (str): The ordering of the days, the first one is selected.
+        value (str): 'date' for the day, 'total' for its energy.
+
+    Returns:
+        Subquery: The subquery.
+    """
+    days = (Report.objects.filter(ecohotel=OuterRef('pk')).order_by()
+            .values('date').annotate(total=Sum(field)).order_by(ordering, 'date'))
+    return Subquery(days.values(value)[:1])
+
+
+def hotel_statistics(ecohotel_ids=None):
+    """
+    Compute the dashboard statistics of every hotel.
+
+    For each hotel: the total energy produced and consumed, the day with the highest
+    production and the day with the lowest consumption. A hotel lives on a single shard, so
+    the statistics of the shards are disjoint.
+
+    Args:
+        ecohotel_ids (list): The ids of the hotels to compute, every hotel by default.
+
+    Returns:
+        dict: The statistics of each hotel id, for the hotels with at least one report.
+    """
+    statistics = {}
+    for shard_statistics in fan_out(_shard_statistics, ecohotel_ids):
+        statistics.update(shard_statistics)
+    return statistics
+
+
+def _shard_statistics(ecohotel_ids):
+    """
+    Compute the dashboard statistics of the hotels of a database.
+
+    Args:
+        ecohotel_ids (list): The ids of the hotels to compute, every hotel if None.
+
+    Returns:
+        dict: The statistics of each hotel id, for the hotels with at least one report.
+    """
+    statistics = {}
+
+    hot = (EcoHotel.objects.filter(report__isnull=False)
+           .annotate(produced=Sum('report__energy_produced'),
+                     consumed=Sum('report__energy_consumed'))
+           .annotate(best_day=_daily_subquery('energy_produced', '-total', 'date'),
+                     best_day_produced=_daily_subquery('energy_produced', '-total', 'total'),
+                     lowest_day=_daily_subquery('energy_consumed', 'total', 'date'),
+                     lowest_day_consumed=_daily_subquery('energy_consumed', 'total', 'total'))
+           .values_list('pk', 'produced', 'consumed', 'best_day', 'best_day_produced',
+                        'lowest_day', 'lowest_day_consumed'))
+    segments = ReportSegment.objects.values_list(
+        'ecohotel_id', 'total_produced', 'total_consumed', 'best_day', 'best_day_produced',
+        'lowest_day', 'lowest_day_consumed')
+    if ecohotel_ids is not None:
+        hot = hot.filter(pk__in=ecohotel_ids)
+        segments = segments.filter(ecohotel_id__in=ecohotel_ids)
+
+    for rows in (hot, segments):
+        for hotel_id, produced, consumed, best_day, best, lowest_day, lowest in rows:
+            hotel = statistics.setdefault(hotel_id, empty_statistics())
+            hotel['total_produced'] += produced
+            hotel['total_consumed'] += consumed
+            _merge_day(hotel, best_day, best, None)
+            _merge_day(hotel, lowest_day, None, lowest)
+
+    return statistics
+
+
+def rebuild_leaderboards():
+    """
+    Recompute every leaderboard from the database.
+
+    Returns:
+        int: The number of ranked hotels.
+    """
+    statistics = hotel_statistics()
+    HotelLeaderboard().set_statistics(statistics, reset=True)
+    return len(statistics)
+
+
+def refresh_dirty_leaderboards():
+    """
+    Recompute the hotels marked as dirty in the leaderboards.
+    """
+    leaderboard = HotelLeaderboard()
+    ecohotel_ids = leaderboard.pop_dirty()
+    while ecohotel_ids:
+        leaderboard.set_statistics(hotel_statistics(ecohotel_ids), ecohotel_ids)
+        ecohotel_ids = leaderboard.pop_dirty()
+
+
+def period_start(day, granularity):
+    """
+    Find the period of a granularity that contains a day.
+
+    Args:
+        day (date): The day.
+        granularity (str): 'day', 'week' (starting on Monday) or 'month'.
+
+    Returns:
+        date: The first day of the period.
+    """
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def period_starts(start, end, granularity):
+    """
+    List the periods of a granularity that overlap a date range.
+
+    Args:
+        start (date): The first day of the range.
+        end (date): The last day of the range.
+        granularity (str): 'day', 'week' or 'month'.
+
+    Returns:
+        list: The first day of each period.
+    """
+    periods = []
+    period = period_start(start, granularity)
+    while period <= end:
+        periods.append(period)
+        if granularity == 'month':
+            period = (period + datetime.timedelta(days=32)).replace(day=1)
+        else:
+            period += datetime.timedelta(days=7 if granularity == 'week' else 1)
+    return periods
+
+
+def energy_series(ecohotel_ids, start, end, granularity):
+    """
+    Compute the energy produced and consumed in each period of a date range.
+
+    The hot reports are grouped by period in the database; the archived months use their
+    rollups when a month is a whole period of the range, their daily totals otherwise.
+
+    Args:
+        ecohotel_ids (list): The ids of the hotels, every hotel if None.
+        start (date): The first day of the range.
+        end (date): The last day of the range.
+        granularity (str): 'day', 'week' or 'month'.
+
+    Returns:
+        list: The period, energy produced and energy consumed of each period of the range,
+            zero for the periods without reports.
+    """
+    totals = {period: [0, 0] for period in period_starts(start, end, granularity)}
+    for shard_totals in fan_out(
+            lambda ids: _period_totals(ids, start, end, granularity), ecohotel_ids):
+        for period, (produced, consumed) in shard_totals.items():
+            totals[period][0] += produced
+            totals[period][1] += consumed
+
+    return [(period, produced, consumed) for period, (produced, consumed) in totals.items()]
+
+
+def _period_totals(ecohotel_ids, start, end, granularity):
+    """
+    Compute the energy produced and consumed in each period of a date range, on a database.
+
+    Args:
+        ecohotel_ids (list): The ids of the hotels, every hotel if None.
+        start (date): The first day of the range.
+        end (date): The last day of the range.
+        granularity (str): 'day', 'week' or 'month'.
+
+    Returns:
+        dict: The [produced, consumed] energy of each period of the range.
+    """
+    totals = {period: [0, 0] for period in period_starts(start, end, granularity)}
+
+    reports = Report.objects.filter(date__gte=start, date__lte=end)
+    segments = ReportSegment.objects.filter(month__gte=start.replace(day=1), month__lte=end)
+    if ecohotel_ids is not None:
+        reports = reports.filter(ecohotel_id__in=ecohotel_ids)
+        segments = segments.filter(ecohotel_id__in=ecohotel_ids)
+
+    grouped = (reports.annotate(period=GRANULARITIES[granularity]('date'))
+               .values('period').order_by()
+               .annotate(produced=Sum('energy_produced'), consumed=Sum('energy_consumed'))
+               .values_list('period', 'produced', 'consumed'))
+    for period, produced, consumed in grouped:
+        totals[period][0] += produced
+        totals[period][1] += consumed
+
+    for segment in segments:
+        month_end = (segment.month + datetime.timedelta(days=32)).replace(day=1) \
+            - datetime.timedelta(days=1)
+        if granularity == 'month' and start <= segment.month and month_end <= end:
+            totals[segment.month][0] += segment.total_produced
+            totals[segment.month][1] += segment.total_consumed
+            continue
+        for day, (produced, consumed) in segment.daily_totals().items():
+            if start <= day <= end:
+                period = totals[period_start(day, granularity)]
+                period[0] += produced
+                period[1] += consumed
+
+    return totals
+
+
+def _shift_months(day, months):
+    """
+    Move a day by a number of months, clamping it to the end of the month.
+
+    Args:
+        day (date): The day.
+        months (int): The number of months, negative to move back.
+
+    Returns:
+        date: The moved day.
+    """
+    index = day.year * 12 + day.month - 1 + months
+    first = datetime.date(index // 12, index % 12 + 1, 1)
+    last = (first + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+    return first.replace(day=min(day.day, last.day))
+
+
+def comparison_range(start, end, compare):
+    """
+    Compute the range a date range is compared with.
+
+    Args:
+        start (date): The first day of the range.
+        end (date): The last day of the range.
+        compare (str): 'previous' for the range just before, of the same length, or 'year' for
+            the same range one year before.
+
+    Returns:
+        tuple: The first and the last day of the compared range.
+    """
+    if compare == 'year':
+        return _shift_months(start, -12), _shift_months(end, -12)
+    if start.day == 1 and (end + datetime.timedelta(days=1)).day == 1:
+        # Whole months are compared with as many whole months: March vs February.
+        months = (end.year - start.year) * 12 + end.month - start.month + 1
+        return _shift_months(start, -months), start - datetime.timedelta(days=1)
+    length = end - start + datetime.timedelta(days=1)
+    return start - length, end - length
+
+
+def _delta(current, previous):
+    """
+    Compute the change between two values.
+
+    Args:
+        current (int): The value of the range.
+        previous (int): The value of the compared range.
+
+    Returns:
+        dict: The absolute change and the percent change, None if the compared value is zero.
+    """
+    return {
+        'absolute': current - previous,
+        'percent': round((current - previous) * 100 / previous, 2) if previous else None,
+    }
+
+
+def compare_periods(ecohotel_ids, start, end, granularity, compare):
+    """
+    Compare the energy series of a date range with the series of another range.
+
+    The periods of the two series are paired by position: the first week of the range with
+    the first week of the compared range, and so on.
+
+    Args:
+        ecohotel_ids (list): The ids of the hotels, every hotel if None.
+        start (date): The first day of the range.
+        end (date): The last day of the range.
+        granularity (str): 'day', 'week' or 'month'.
+        compare (str): 'previous' or 'year', see `comparison_range`.
+
+    Returns:
+        dict: The parameters, the series of both ranges with the change of each period, and
+            the totals of both ranges with their change.
+    """
+    previous_start, previous_end = comparison_range(start, end, compare)
+    current = energy_series(ecohotel_ids, start, end, granularity)
+    previous = energy_series(ecohotel_ids, previous_start, previous_end, granularity)
+
+    series = []
+    for index, (period, produced, consumed) in enumerate(current):
+        point = {'period': period, 'produced': produced, 'consumed': consumed,
+                 'net': produced - consumed}
+        if index < len(previous):
+            previous_period, previous_produced, previous_consumed = previous[index]
+            point['previous_period'] = previous_period
+            point['produced_delta'] = _delta(produced, previous_produced)
+            point['consumed_delta'] = _delta(consumed, previous_consumed)
+        series.append(point)
+
+    totals = {'produced': sum(point[1] for point in current),
+              'consumed': sum(point[2] for point in current)}
+    previous_totals = {'produced': sum(point[1] for point in previous),
+                       'consumed': sum(point[2] for point in previous)}
+    totals['net'] = totals['produced'] - totals['consumed']
+    previous_totals['net'] = previous_totals['produced'] - previous_totals['consumed']
+
+    return {
+        'hotels': ecohotel_ids,
+        'start': start,
+        'end': end,
+        'granularity': granularity,
+        'compare': compare,
+        'previous_start': previous_start,
+        'previous_end': previous_end,
+        'series': series,
+        'previous_series': [{'period': period, 'produced': produced, 'consumed': consumed}
+                            for period, produced, consumed in previous],
+        'totals': totals,
+        'previous_totals': previous_totals,
+        'deltas': {field: _delta(totals[field], previous_totals[field]) for field in totals},
+    }
@@ -23,7 +23,17 @@ class EnergyTrackerConfig(AppConfig):
         default_auto_field (str): The default auto-generated field for model primary keys.
         name (str): The name of the Energy Tracker application.
 
+    Methods:
+        ready(): Connects the signal receivers of the application.
+
     """
 
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'energy_tracker'
+
+    def ready(self):
+        """
+        Connect the signal receivers of the application.
+
+        """
+        from . import signals  # noqa: F401 pylint: disable=import-outside-toplevel,unused-import
@@ -0,0 +1,119 @@
+"""
+Archival of the cold energy reports.
+
+The reports older than the archive horizon are moved out of the Report table into one
+compressed ReportSegment per hotel and month, so the size of the hot table, and with it
+the size of its indexes, stays bounded. The archived reports are read back on demand.
+
+Functions:
+    - archive_cutoff: Computes the first day that is not archived.
+    - archive_reports: Moves the reports before the cutoff into monthly segments.
+    - monthly_reports: Reads the reports of a hotel in a month, archived or not.
+"""
+
+import datetime
+
+from django.db import router, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+from .models import Report, ReportSegment, UNANCHORED, moving_reports
+from .utils import DataVersion
+
+
+def _next_month(month):
+    """
+    Compute the first day of the following month.
+
+    Args:
+        month (date): The first day of a month.
+
+    Returns:
+        date: The first day of the following month.
+    """
+    return (month + datetime.timedelta(days=32)).replace(day=1)
+
+
+def archive_cutoff(horizon_days, today=None):
+    """
+    Compute the first day that is not archived.
+
+    Only complete months are archived, so the cutoff is the first day of the month that
+    contains the horizon.
+
+    Args:
+        horizon_days (int): The age, in days, after which a report is archived.
+        today (date): The current day, today by default.
+
+    Returns:
+        date: The cutoff.
+    """
+    today = today or datetime.date.today()
+    return (today - datetime.timedelta(days=horizon_days)).replace(day=1)
+
+
+def archive_reports(cutoff):
+    """
+    Move the reports before the cutoff into monthly segments.
+
+    The months of a hotel that still contain un-anchored reports are skipped, so the backfill
+    of the anchors can still find them. A month that was already archived is merged with the
+    new reports.
+
+    Args:
+        cutoff (date): The first day that is not archived.
+
+    Returns:
+        dict: The number of written segments, archived reports and skipped months.
+    """
+    months = (Report.objects.filter(date__lt=cutoff)
+              .annotate(month=TruncMonth('date'))
+              .values('ecohotel_id', 'month')
+              .annotate(unanchored=Count('id', filter=UNANCHORED))
+              .order_by('ecohotel_id', 'month'))
+
+    result = {'segments': 0, 'reports': 0, 'skipped': 0}
+    for group in months:
+        if group['unanchored']:
+            result['skipped'] += 1
+            continue
+        month = group['month']
+        with transaction.atomic(using=router.db_for_write(Report)):
+            hot = Report.objects.filter(ecohotel_id=group['ecohotel_id'], date__gte=month,
+                                        date__lt=_next_month(month))
+            reports = list(hot)
+            existing = ReportSegment.objects.select_for_update().filter(
+                ecohotel_id=group['ecohotel_id'], month=month).first()
+            segment = ReportSegment.build(
+                group['ecohotel_id'], month, reports + (existing.reports() if existing else []))
+            if existing:
+                segment.pk = existing.pk
+            segment.save()
+            # The reports are not removed but moved into the segment.
+            with moving_reports():
+                hot.delete()
+        result['segments'] += 1
+        result['reports'] += len(reports)
+
+    if result['reports']:
+        DataVersion().bump()
+    return result
+
+
+def monthly_reports(ecohotel_id, month):
+    """
+    Read the reports of a hotel in a month, from the hot table and from the archive.
+
+    Args:
+        ecohotel_id (int): The id of the hotel.
+        month (date): Any day of the month.
+
+    Returns:
+        list: The reports, ordered by date and id.
+    """
+    month = month.replace(day=1)
+    reports = list(Report.objects.filter(
+        ecohotel_id=ecohotel_id, date__gte=month, date__lt=_next_month(month)))
+    for segment in ReportSegment.objects.filter(ecohotel_id=ecohotel_id, month=month):
+        reports.extend(segment.reports())
+    return sorted(reports, key=lambda report: (report.date, report.pk))
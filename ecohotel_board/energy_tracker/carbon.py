@@ -0,0 +1,298 @@
+"""
+Carbon footprint of the hotels.
+
+The energy of the reports is turned into CO2 with grid emission factors that vary by region
+and over time, loaded from a local table (`res/emission_factors.csv`, one row per region and
+date from which a factor applies). The computation runs on the daily rollups of the whole
+fleet at once, as NumPy arrays, and the per-hotel results are cached in Redis for the
+dashboard.
+
+For each hotel and day:
+    - CO2 emitted: the energy drawn from the grid (consumption not covered by the production
+      of the same day) times the grid factor.
+    - CO2 avoided: the energy produced times the grid factor, since every produced Wh either
+      covers the consumption of the hotel or is fed into the grid in place of grid generation.
+
+Classes:
+    - EmissionFactors: The table of the grid emission factors.
+
+Functions:
+    - daily_rollups: Loads the daily energy of the hotels as arrays.
+    - daily_footprint: Computes the CO2 emitted and avoided in each day.
+    - footprint_change: Computes how a new report changes the CO2 of its day.
+    - hotel_footprints: Computes the total CO2 emitted and avoided by each hotel.
+    - cached_hotel_footprints: Reads the footprints from the cache, computing the missing ones.
+
+Global Variables:
+    - EMISSION_FACTORS_PATH: The path of the table of the emission factors.
+    - EPOCH_ORDINAL: The ordinal of the first day of the NumPy dates.
+"""
+
+import csv
+import datetime
+import hashlib
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import EcoHotel, Report, ReportSegment
+from .sharding import fan_out
+from .utils import CarbonFootprintCache
+
+EMISSION_FACTORS_PATH = Path(__file__).resolve().parent / 'res' / 'emission_factors.csv'
+
+# The proleptic ordinal of 1970-01-01, day 0 of datetime64[D].
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+class EmissionFactors:
+    """
+    EmissionFactors class.
+
+    The grid emission factors of each region, as sorted arrays of the dates from which they
+    apply, so a whole series of days is looked up with one `searchsorted` per region.
+
+    Attributes:
+        version (str): A fingerprint of the table, which changes when a factor changes.
+        default_region (str): The region of the hotels whose region is not in the table.
+
+    Methods:
+        load(path): Loads the table from a CSV file.
+        regions(): Lists the regions of the table.
+        lookup(regions, days): Finds the factor of each region and day.
+    """
+
+    _cache = {}
+
+    def __init__(self, rows, version, default_region=None) -> None:
+        """
+        Initialize the EmissionFactors.
+
+        Args:
+            rows (list): The (region, valid from, g CO2 per kWh) rows of the table.
+            version (str): A fingerprint of the table.
+            default_region (str): The region of the hotels whose region is not in the table,
+                `CARBON_DEFAULT_REGION` by default.
+        """
+        self.version = version
+        self.default_region = default_region or settings.CARBON_DEFAULT_REGION
+        by_region = {}
+        for region, valid_from, factor in rows:
+            by_region.setdefault(region, []).append((valid_from, factor))
+        self._regions = {}
+        for region, entries in by_region.items():
+            entries.sort()
+            self._regions[region] = (
+                np.array([valid_from for valid_from, _ in entries], dtype='datetime64[D]'),
+                np.array([factor for _, factor in entries], dtype=np.float64))
+        if self.default_region not in self._regions:
+            raise ValueError(f"No emission factors for the default region {self.default_region}.")
+
+    @classmethod
+    def load(cls, path=EMISSION_FACTORS_PATH):
+        """
+        Load the table from a CSV file, once per modification of the file.
+
+        Args:
+            path (Path): The CSV file, with the region, valid_from and g_co2_per_kwh columns.
+
+        Returns:
+            EmissionFactors: The table.
+        """
+        path = Path(path)
+        stat = path.stat()
+        modified = (stat.st_mtime_ns, stat.st_size)
+        cached = cls._cache.get(path)
+        if cached is None or cached[0] != modified:
+            content = path.read_bytes()
+            version = hashlib.sha256(content).hexdigest()[:16]
+            reader = csv.DictReader(content.decode('utf-8').splitlines())
+            rows = [(row['region'], row['valid_from'], float(row['g_co2_per_kwh']))
+                    for row in reader]
+            cached = cls._cache[path] = (modified, cls(rows, version))
+        return cached[1]
+
+    def regions(self):
+        """
+        List the regions of the table.
+
+        Returns:
+            list: The regions, sorted.
+        """
+        return sorted(self._regions)
+
+    def lookup(self, regions, days):
+        """
+        Find the factor that applies to each region and day.
+
+        A day before the first entry of its region takes the first factor of the region.
+
+        Args:
+            regions (ndarray): The region of each day.
+            days (ndarray): The days, as datetime64[D].
+
+        Returns:
+            ndarray: The factor of each day, in g CO2 per kWh.
+        """
+        regions = np.where(np.isin(regions, list(self._regions)), regions, self.default_region)
+        factors = np.empty(len(days), dtype=np.float64)
+        for region in np.unique(regions):
+            mask = regions == region
+            valid_from, values = self._regions[region]
+            index = np.searchsorted(valid_from, days[mask], side='right') - 1
+            factors[mask] = values[np.clip(index, 0, None)]
+        return factors
+
+
+def daily_rollups(ecohotel_ids=None):
+    """
+    Load the daily energy of the hotels, archived segments included, as arrays.
+
+    Args:
+        ecohotel_ids (list): The hotels to load, every hotel by default.
+
+    Returns:
+        dict: The 'hotel', 'region', 'day', 'produced' and 'consumed' arrays, one entry per
+            hotel and day.
+    """
+    hotels = EcoHotel.objects.all()
+    if ecohotel_ids is not None:
+        hotels = hotels.filter(pk__in=ecohotel_ids)
+    rows = [row for shard_rows in fan_out(_daily_rows, ecohotel_ids) for row in shard_rows]
+
+    hotel_column = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    # The region is looked up once per hotel, then spread over its days.
+    regions = dict(hotels.values_list('pk', 'region'))
+    hotel_ids, positions = np.unique(hotel_column, return_inverse=True)
+    hotel_regions = np.array([regions.get(int(hotel_id), '') for hotel_id in hotel_ids],
+                             dtype='U16')
+    return {
+        'hotel': hotel_column,
+        'region': hotel_regions[positions],
+        'day': (np.fromiter((row[1].toordinal() for row in rows), dtype=np.int64, count=len(rows))
+                - EPOCH_ORDINAL).astype('datetime64[D]'),
+        'produced': np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows)),
+        'consumed': np.fromiter((row[3] for row in rows), dtype=np.float64, count=len(rows)),
+    }
+
+
+def _daily_rows(ecohotel_ids):
+    """
+    Load the daily energy of the hotels of a database, archived segments included.
+
+    Args:
+        ecohotel_ids (list): The hotels to load, every hotel if None.
+
+    Returns:
+        list: The (hotel id, day, produced, consumed) of each hotel and day.
+    """
+    reports = Report.objects.all()
+    segments = ReportSegment.objects.all()
+    if ecohotel_ids is not None:
+        reports = reports.filter(ecohotel_id__in=ecohotel_ids)
+        segments = segments.filter(ecohotel_id__in=ecohotel_ids)
+
+    rows = list(reports.order_by().values_list('ecohotel_id', 'date').annotate(
+        produced=Sum('energy_produced'), consumed=Sum('energy_consumed')))
+    for segment in segments:
+        rows.extend((segment.ecohotel_id, day, produced, consumed)
+                    for day, (produced, consumed) in segment.daily_totals().items())
+    return rows
+
+
+def daily_footprint(rollups, factors):
+    """
+    Compute the CO2 emitted and avoided in each day.
+
+    The energy of the reports is in Wh, the factors in g CO2 per kWh, so the products are
+    directly in mg; the results are in kg.
+
+    Args:
+        rollups (dict): The daily arrays, see `daily_rollups`.
+        factors (EmissionFactors): The emission factors.
+
+    Returns:
+        tuple: The arrays of the kg of CO2 emitted and avoided in each day.
+    """
+    factor = factors.lookup(rollups['region'], rollups['day']) / 1e6
+    drawn = np.maximum(rollups['consumed'] - rollups['produced'], 0)
+    return drawn * factor, rollups['produced'] * factor
+
+
+def footprint_change(region, day, day_totals, produced, consumed, factors=None):
+    """
+    Compute how a new report changes the CO2 emitted and avoided in its day.
+
+    The CO2 emitted depends on the net energy of the whole day, so the day is computed before
+    and after the report.
+
+    Args:
+        region (str): The region of the hotel.
+        day (date): The day of the report.
+        day_totals (dict): The 'day_produced' and 'day_consumed' Wh of the day, report included.
+        produced (float): The energy produced in the report.
+        consumed (float): The energy consumed in the report.
+        factors (EmissionFactors): The emission factors, the local table by default.
+
+    Returns:
+        dict: The change of the 'co2_emitted' and 'co2_avoided' kg.
+    """
+    factors = factors or EmissionFactors.load()
+    after_produced = day_totals['day_produced'] or 0
+    after_consumed = day_totals['day_consumed'] or 0
+    rollups = {
+        'region': np.array([region or ''] * 2, dtype='U16'),
+        'day': np.array([day, day], dtype='datetime64[D]'),
+        'produced': np.array([after_produced - produced, after_produced], dtype=np.float64),
+        'consumed': np.array([after_consumed - consumed, after_consumed], dtype=np.float64),
+    }
+    emitted, avoided = daily_footprint(rollups, factors)
+    return {'co2_emitted': round(float(emitted[1] - emitted[0]), 3),
+            'co2_avoided': round(float(avoided[1] - avoided[0]), 3)}
+
+
+def hotel_footprints(ecohotel_ids=None, factors=None):
+    """
+    Compute the total CO2 emitted and avoided by each hotel.
+
+    Args:
+        ecohotel_ids (list): The hotels to compute, every hotel by default.
+        factors (EmissionFactors): The emission factors, the local table by default.
+
+    Returns:
+        dict: The 'co2_emitted' and 'co2_avoided' kg of each hotel id with reports.
+    """
+    factors = factors or EmissionFactors.load()
+    rollups = daily_rollups(ecohotel_ids)
+    emitted, avoided = daily_footprint(rollups, factors)
+    hotels, positions = np.unique(rollups['hotel'], return_inverse=True)
+    emitted = np.bincount(positions, weights=emitted, minlength=len(hotels))
+    avoided = np.bincount(positions, weights=avoided, minlength=len(hotels))
+    return {int(hotel): {'co2_emitted': round(float(hotel_emitted), 3),
+                         'co2_avoided': round(float(hotel_avoided), 3)}
+            for hotel, hotel_emitted, hotel_avoided in zip(hotels, emitted, avoided)}
+
+
+def cached_hotel_footprints(ecohotel_ids):
+    """
+    Read the footprints of some hotels from the cache, computing the missing ones together.
+
+    Args:
+        ecohotel_ids (list): The ids of the hotels.
+
+    Returns:
+        dict: The footprint of each hotel id, zero for the hotels without reports.
+    """
+    factors = EmissionFactors.load()
+    cache = CarbonFootprintCache()
+    footprints = cache.get_many(factors.version, ecohotel_ids)
+    missing = [ecohotel_id for ecohotel_id in ecohotel_ids if ecohotel_id not in footprints]
+    if missing:
+        computed = hotel_footprints(missing, factors)
+        computed = {ecohotel_id: computed.get(ecohotel_id, {'co2_emitted': 0.0, 'co2_avoided': 0.0})
+                    for ecohotel_id in missing}
+        cache.set_many(factors.version, computed)
+        footprints.update(computed)
+    return footprints
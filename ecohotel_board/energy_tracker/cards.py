@@ -0,0 +1,129 @@
+"""
+Pre-rendered cards of the energy reports.
+
+A report does not change once it is anchored, so its card on the homepage is rendered once,
+when the report is saved or anchored, and cached by report id and template version. The
+homepage only stitches the cached cards together, rendering the missing ones in one batch.
+
+Functions:
+    - card_template_version: Computes the version of the card template.
+    - render_card: Renders the card of a report.
+    - cache_card: Renders the card of a report and caches it.
+    - drop_cards: Drops the cached cards of some reports.
+    - drop_hotel_cards: Drops the cached cards of the reports of a hotel.
+    - cached_cards: Reads the cards of some reports, rendering the missing ones.
+
+Global Variables:
+    - CARD_TEMPLATE: The template of the cards.
+"""
+
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Report
+from .sharding import fan_out
+from .utils import ReportCardCache
+
+CARD_TEMPLATE = 'report_card.html'
+
+
+def card_template_version():
+    """
+    Compute the version of the card template, from its source.
+
+    It is computed once per process, since the template only changes with a deploy, which
+    restarts the process. With `DEBUG` it changes while the server runs, so it is computed on
+    each call.
+
+    Returns:
+        str: A fingerprint of the template, which changes when the template changes.
+    """
+    if settings.DEBUG:
+        _card_template_version.cache_clear()
+    return _card_template_version()
+
+
+@lru_cache(maxsize=None)
+def _card_template_version():
+    """
+    Fingerprint the source of the card template.
+
+    Returns:
+        str: The fingerprint.
+    """
+    source = get_template(CARD_TEMPLATE).template.source
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()[:12]
+
+
+def render_card(report):
+    """
+    Render the card of a report.
+
+    Args:
+        report (Report): The report, with its EcoHotel.
+
+    Returns:
+        str: The HTML of the card.
+    """
+    return render_to_string(CARD_TEMPLATE, {'report': report})
+
+
+def cache_card(report):
+    """
+    Render the card of a report and cache it.
+
+    Args:
+        report (Report): The report, with its EcoHotel.
+    """
+    ReportCardCache().set_many(card_template_version(), {report.pk: render_card(report)})
+
+
+def drop_cards(report_ids):
+    """
+    Drop the cached cards of some reports.
+
+    Args:
+        report_ids (list): The ids of the reports.
+    """
+    ReportCardCache().delete_many(card_template_version(), report_ids)
+
+
+def drop_hotel_cards(ecohotel_id):
+    """
+    Drop the cached cards of the reports of a hotel, which show the name of the hotel.
+
+    Args:
+        ecohotel_id (int): The id of the hotel.
+    """
+    report_ids, = fan_out(lambda _: list(Report.objects.filter(
+        ecohotel_id=ecohotel_id).values_list('pk', flat=True)), [ecohotel_id])
+    ReportCardCache().delete_many(card_template_version(), report_ids)
+
+
+def cached_cards(report_ids):
+    """
+    Read the cards of some reports, rendering and caching the missing ones in one batch.
+
+    Args:
+        report_ids (list): The ids of the reports, in the order of the page.
+
+    Returns:
+        str: The HTML of the cards, stitched in the order of the ids.
+    """
+    version = card_template_version()
+    cache = ReportCardCache()
+    cards = cache.get_many(version, report_ids)
+    missing = [report_id for report_id in report_ids if report_id not in cards]
+    if missing:
+        # The ids do not tell the shard of a report: every shard is asked.
+        rendered = {report.pk: render_card(report)
+                    for reports in fan_out(lambda _: list(
+                        Report.objects.filter(pk__in=missing).select_related('ecohotel')))
+                    for report in reports}
+        cache.set_many(version, rendered)
+        cards.update(rendered)
+    return mark_safe(''.join(cards[report_id] for report_id in report_ids if report_id in cards))
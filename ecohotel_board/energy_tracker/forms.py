@@ -5,17 +5,30 @@ This module contains form classes related to eco-friendly hotels and energy repo
 
 Classes:
 - ReportForm: Form for collecting data on energy production and consumption in an eco-friendly hotel.
+- ComparisonForm: Form for selecting the hotels, the date range and the granularity of a comparison.
 
-Global Variables:
-- ECOHOTELS_CHOICES: Choices for the eco-friendly hotel names in the report form.
+Functions:
+- ecohotels_choices: Choices for the eco-friendly hotel names in the report form.
 
 """
 
 from django import forms
+from .aggregates import GRANULARITIES, period_starts
 from .models import EcoHotel
 
-ECOHOTELS_CHOICES = [(index, data) for index, data in enumerate(
-    EcoHotel.objects.values_list('name', flat=True))]
+
+def ecohotels_choices():
+    """
+    Build the choices for the eco-friendly hotel names.
+
+    The choices are evaluated lazily, so the database is not queried when the module is imported.
+
+    Returns:
+        list: A list of (index, name) tuples.
+
+    """
+    return [(index, data) for index, data in enumerate(
+        EcoHotel.objects.values_list('name', flat=True))]
 
 
 class ReportForm(forms.Form):
@@ -31,6 +44,54 @@ class ReportForm(forms.Form):
         energy_consumed (IntegerField): Field for entering the energy consumed by the hotel.
 
     """
-    name = forms.ChoiceField(choices=ECOHOTELS_CHOICES)
+    name = forms.ChoiceField(choices=ecohotels_choices)
     energy_produced = forms.IntegerField()
     energy_consumed = forms.IntegerField()
+
+
+class ComparisonForm(forms.Form):
+    """
+    Comparison Form class.
+
+    This class defines the parameters of a period-over-period comparison of the energy data.
+    The number of periods is bounded, so a comparison always runs a bounded number of rows.
+
+    Attributes:
+        hotels (ModelMultipleChoiceField): Field for selecting the hotels, every hotel if empty.
+        start (DateField): Field for entering the first day of the range.
+        end (DateField): Field for entering the last day of the range.
+        granularity (ChoiceField): Field for selecting the length of the periods of the series.
+        compare (ChoiceField): Field for selecting the range the series is compared with.
+        MAX_PERIODS (int): The highest number of periods of a series.
+
+    """
+    MAX_PERIODS = 1100
+
+    hotels = forms.ModelMultipleChoiceField(queryset=EcoHotel.objects.all(), required=False)
+    start = forms.DateField()
+    end = forms.DateField()
+    granularity = forms.ChoiceField(choices=[(value, value) for value in GRANULARITIES],
+                                    initial='day')
+    compare = forms.ChoiceField(choices=[('previous', 'Previous period'),
+                                         ('year', 'Same period last year')],
+                                initial='previous')
+
+    def clean(self):
+        """
+        Check that the range is not reversed and not too long for its granularity.
+
+        Returns:
+            dict: The cleaned data.
+
+        """
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        granularity = cleaned_data.get('granularity')
+        if start and end and granularity:
+            if start > end:
+                raise forms.ValidationError("The start must not be after the end.")
+            if len(period_starts(start, end, granularity)) > self.MAX_PERIODS:
+                raise forms.ValidationError(
+                    f"The range has more than {self.MAX_PERIODS} periods, "
+                    f"use a longer granularity.")
+        return cleaned_data
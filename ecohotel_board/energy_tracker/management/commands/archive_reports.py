@@ -0,0 +1,78 @@
+"""
+Management command that archives the cold energy reports.
+
+The reports older than the archive horizon are moved into one compressed segment per hotel
+and month (see `energy_tracker.archive`), keeping the hot Report table bounded. Meant to be
+run periodically, e.g. daily from cron. When the reports are partitioned, every shard is
+archived in turn.
+
+Classes:
+    - Command: The `archive_reports` management command.
+
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ecohotel_board.db_routers import shard_aliases, use_shard
+from energy_tracker.archive import archive_cutoff, archive_reports
+from energy_tracker.models import Report
+from energy_tracker.sharding import fan_out
+
+
+class Command(BaseCommand):
+    """
+    The `archive_reports` management command.
+
+    Attributes:
+        help (str): The description of the command.
+
+    """
+
+    help = "Move the reports older than the archive horizon into compressed monthly segments."
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The parser of the command.
+
+        """
+        parser.add_argument('--older-than-days', type=int,
+                            default=settings.REPORT_ARCHIVE_HORIZON_DAYS,
+                            help="Archive the complete months older than this number of days.")
+
+    def handle(self, *args, **options):
+        """
+        Archive the reports.
+
+        Args:
+            *args: Additional positional arguments.
+            **options: The parsed command line options.
+
+        """
+        if options['older_than_days'] < 0:
+            raise CommandError("--older-than-days must not be negative.")
+
+        cutoff = archive_cutoff(options['older_than_days'])
+        before = sum(fan_out(lambda _: Report.objects.count()))
+        started = time.perf_counter()
+        result = {'segments': 0, 'reports': 0, 'skipped': 0}
+        for alias in shard_aliases() or [None]:
+            with use_shard(alias):
+                for key, value in archive_reports(cutoff).items():
+                    result[key] += value
+        elapsed = time.perf_counter() - started
+        after = sum(fan_out(lambda _: Report.objects.count()))
+
+        if result['skipped']:
+            self.stdout.write(self.style.WARNING(
+                f"{result['skipped']} months skipped because they have un-anchored reports, "
+                f"run backfill_anchors first."))
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {result['reports']} reports before {cutoff} into "
+            f"{result['segments']} segments in {elapsed:.1f}s "
+            f"(hot table: {before} -> {after} reports)."))
@@ -0,0 +1,272 @@
+"""
+Management command that anchors the reports missing their hash or transaction ID.
+
+When the blockchain endpoint is down, `Report.write_on_chain` raises and the report stays
+without `hash`/`txId`. This command finds those reports through the partial index on the
+un-anchored reports and sends their transactions through a bounded pool of workers,
+respecting a rate limit. For large backfills the CPU-bound signing can be moved to a pool of
+processes with `--sign-processes`. The progress is checkpointed after every batch, so an
+interrupted run can be resumed: the checkpoint stores the last processed id and, apart, the ids
+of the failed reports, which the resumed run tries again. A report that duplicates an anchored
+one is deleted. When the reports are partitioned, each shard is anchored by its own run,
+selected with `--shard`.
+
+Classes:
+    - Command: The `backfill_anchors` management command.
+
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from blockchain.blockchain_writer import BlockchainWriter, RateLimiter
+from blockchain.signing_pipeline import SigningPipeline
+from ecohotel_board.db_routers import shard_aliases, use_shard
+from energy_tracker.models import Report
+
+
+class Command(BaseCommand):
+    """
+    The `backfill_anchors` management command.
+
+    Attributes:
+        help (str): The description of the command.
+
+    """
+
+    help = "Write on the blockchain the reports missing their hash or transaction ID."
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The parser of the command.
+
+        """
+        parser.add_argument('--workers', type=int, default=8,
+                            help="Transactions sent concurrently.")
+        parser.add_argument('--sign-processes', type=int, default=0,
+                            help="Sign the transactions in this number of processes and send "
+                                 "them from a single thread, instead of using --workers.")
+        parser.add_argument('--rate', type=float, default=10.0,
+                            help="Maximum transactions per second.")
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help="Reports loaded and checkpointed together.")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Stop after this number of reports.")
+        parser.add_argument('--max-failures', type=int, default=50,
+                            help="Abort after this number of consecutive failed transactions.")
+        parser.add_argument('--checkpoint', type=Path, default=Path('backfill_anchors.json'),
+                            help="File where the progress is stored.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Skip the reports before the stored checkpoint.")
+        parser.add_argument('--shard', default=None,
+                            help="Anchor the reports of this shard, with a checkpoint per shard.")
+
+    def handle(self, *args, **options):
+        """
+        Anchor the reports.
+
+        Args:
+            *args: Additional positional arguments.
+            **options: The parsed command line options.
+
+        Raises:
+            CommandError: If the options are invalid or too many consecutive transactions
+                failed.
+
+        """
+        if options['workers'] < 1 or options['rate'] <= 0 or options['batch_size'] < 1:
+            raise CommandError("--workers, --rate and --batch-size must be positive.")
+        if options['shard'] is not None and options['shard'] not in shard_aliases():
+            raise CommandError(f"Unknown shard {options['shard']}.")
+        if shard_aliases() and options['shard'] is None:
+            raise CommandError(f"Choose the shard to anchor with --shard: "
+                               f"{', '.join(shard_aliases())}.")
+
+        with use_shard(options['shard']):
+            self._backfill(options)
+
+    def _backfill(self, options):
+        """
+        Anchor the reports of the current database.
+
+        Args:
+            options (dict): The parsed command line options.
+
+        Raises:
+            CommandError: If too many consecutive transactions failed.
+
+        """
+        last_id, retry = (self._load_checkpoint(options['checkpoint']) if options['resume']
+                          else (0, []))
+        pending = Report.objects.unanchored().filter(Q(id__gt=last_id) | Q(id__in=retry))
+        total = pending.count()
+        if options['limit'] is not None:
+            total = min(total, options['limit'])
+        self.stdout.write(f"{total} reports to anchor after id {last_id} "
+                          f"({len(retry)} failed before).")
+
+        writer = BlockchainWriter()
+        limiter = RateLimiter(options['rate'])
+        anchored = failed = duplicates = consecutive_failures = 0
+        # The failed reports are stored apart in the checkpoint, so --resume tries them again.
+        failed_ids = []
+        cursor = 0
+        started = time.perf_counter()
+
+        with ExitStack() as stack:
+            if options['sign_processes']:
+                pipeline = stack.enter_context(SigningPipeline(
+                    writer, processes=options['sign_processes'], limiter=limiter))
+                anchor = pipeline.run
+            else:
+                pipeline = None
+                pool = stack.enter_context(ThreadPoolExecutor(max_workers=options['workers']))
+                anchor = partial(self._anchor_with_pool, pool, writer, limiter)
+
+            while anchored + failed + duplicates < total:
+                size = min(options['batch_size'], total - anchored - failed - duplicates)
+                batch = list(pending.filter(id__gt=cursor).order_by('id')[:size])
+                if not batch:
+                    break
+
+                to_send, duplicated = self._deduplicate(batch)
+                if duplicated:
+                    Report.objects.filter(pk__in=[report.pk for report, _ in duplicated]).delete()
+                    duplicates += len(duplicated)
+                for report, original in duplicated:
+                    self.stdout.write(f"Report {report.pk} duplicates report {original}, deleted.")
+                for report, result in zip(to_send, anchor([report.hash for report in to_send])):
+                    if isinstance(result, Exception):
+                        failed += 1
+                        consecutive_failures += 1
+                        failed_ids.append(report.pk)
+                        self.stderr.write(f"Report {report.pk} not anchored: {result}")
+                        continue
+                    report.txId = result
+                    # update_fields keeps the original date of the report.
+                    report.save(update_fields=['hash', 'txId'])
+                    anchored += 1
+                    consecutive_failures = 0
+
+                cursor = batch[-1].pk
+                checkpoint = max(cursor, last_id)
+                self._save_checkpoint(options['checkpoint'], checkpoint, sorted(
+                    failed_ids + [report_id for report_id in retry if report_id > cursor]))
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{anchored + failed + duplicates}/{total} processed, {anchored} anchored, "
+                    f"{failed} failed, {duplicates} duplicates ({anchored / elapsed:.1f} tx/s).")
+
+                if consecutive_failures >= options['max_failures']:
+                    raise CommandError(
+                        f"{consecutive_failures} consecutive failures, aborting. "
+                        f"Run again with --resume to retry the failed reports and continue "
+                        f"after report {checkpoint}.")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Anchored {anchored} reports ({failed} failed, {duplicates} duplicates deleted) "
+            f"in {elapsed:.1f}s "
+            f"({anchored / elapsed if elapsed else 0:.1f} tx/s)."))
+        if pipeline is not None:
+            for stage, throughput in pipeline.throughput().items():
+                self.stdout.write(f"  {stage}: {pipeline.stats[stage]['items']} items, "
+                                  f"{throughput:.1f}/s")
+
+    @staticmethod
+    def _deduplicate(batch):
+        """
+        Compute the missing hashes and separate the reports that duplicate another report.
+
+        A duplicate is the same report submitted twice: the unique index on the hash would
+        reject its transaction, so it is never sent and the caller deletes it.
+
+        Args:
+            batch (list): The un-anchored reports.
+
+        Returns:
+            tuple: The reports to send to the blockchain, and the duplicate reports with the
+                id of the report they duplicate.
+
+        """
+        fresh = [report for report in batch if report.hash is None]
+        for report in fresh:
+            report.hash = report.compute_hash()
+        fresh_ids = {report.pk for report in fresh}
+        taken = dict(Report.objects.filter(
+            hash__in=[report.hash for report in fresh]).values_list('hash', 'id'))
+
+        to_send, duplicated = [], []
+        for report in batch:
+            if report.pk in fresh_ids and report.hash in taken:
+                duplicated.append((report, taken[report.hash]))
+                continue
+            taken[report.hash] = report.pk
+            to_send.append(report)
+        return to_send, duplicated
+
+    @staticmethod
+    def _anchor_with_pool(pool, writer, limiter, messages):
+        """
+        Send a transaction for each message from a pool of threads, respecting the rate limit.
+
+        Args:
+            pool (ThreadPoolExecutor): The pool of threads.
+            writer (BlockchainWriter): The writer shared by the threads.
+            limiter (RateLimiter): The rate limiter shared by the threads.
+            messages (list): The messages of the transactions.
+
+        Returns:
+            list: For each message, the transaction ID or the exception that prevented sending it.
+
+        """
+        def send(message):
+            limiter.acquire()
+            return writer.send_transaction(message)
+
+        futures = [pool.submit(send, message) for message in messages]
+        return [future.exception() or future.result() for future in futures]
+
+    @staticmethod
+    def _load_checkpoint(path):
+        """
+        Load the id of the last processed report and the ids of the failed reports.
+
+        Args:
+            path (Path): The checkpoint file.
+
+        Returns:
+            tuple: The id of the last processed report, 0 if there is no checkpoint, and the
+                list of the failed report ids.
+
+        """
+        try:
+            with open(path, encoding='utf-8', mode='r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return 0, []
+        return checkpoint['last_id'], checkpoint.get('failed', [])
+
+    @staticmethod
+    def _save_checkpoint(path, last_id, failed):
+        """
+        Store the id of the last processed report and the ids of the failed reports.
+
+        Args:
+            path (Path): The checkpoint file.
+            last_id (int): The id of the last processed report.
+            failed (list): The ids of the failed reports.
+
+        """
+        with open(path, encoding='utf-8', mode='w') as checkpoint_file:
+            json.dump({'last_id': last_id, 'failed': failed}, checkpoint_file)
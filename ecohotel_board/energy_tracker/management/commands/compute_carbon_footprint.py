@@ -0,0 +1,57 @@
+"""
+Management command that recomputes the carbon footprint of every hotel.
+
+Run it after updating the table of the emission factors (`energy_tracker/res/
+emission_factors.csv`): the whole fleet is recomputed in one vectorized pass and cached, so
+the next dashboard does not pay for it.
+
+Classes:
+    - Command: The `compute_carbon_footprint` management command.
+
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from energy_tracker.carbon import EmissionFactors, hotel_footprints
+from energy_tracker.models import EcoHotel
+from energy_tracker.utils import CarbonFootprintCache, DataVersion
+
+
+class Command(BaseCommand):
+    """
+    The `compute_carbon_footprint` management command.
+
+    Attributes:
+        help (str): The description of the command.
+
+    """
+
+    help = "Recompute and cache the CO2 emitted and avoided by every hotel."
+
+    def handle(self, *args, **options):
+        """
+        Recompute the footprints.
+
+        Args:
+            *args: Additional positional arguments.
+            **options: The parsed command line options.
+
+        """
+        started = time.perf_counter()
+        factors = EmissionFactors.load()
+        computed = hotel_footprints(factors=factors)
+        empty = {'co2_emitted': 0.0, 'co2_avoided': 0.0}
+        footprints = {ecohotel_id: computed.get(ecohotel_id, empty)
+                      for ecohotel_id in EcoHotel.objects.values_list('pk', flat=True)}
+        CarbonFootprintCache().set_many(factors.version, footprints)
+        # The pages that show the footprints must not be served from the HTTP caches.
+        DataVersion().bump()
+
+        emitted = sum(footprint['co2_emitted'] for footprint in footprints.values())
+        avoided = sum(footprint['co2_avoided'] for footprint in footprints.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Computed the footprint of {len(footprints)} hotels with the factors "
+            f"{factors.version} in {time.perf_counter() - started:.1f}s: "
+            f"{emitted:.1f} kg CO2 emitted, {avoided:.1f} kg avoided."))
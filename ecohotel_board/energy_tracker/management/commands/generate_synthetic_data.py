@@ -0,0 +1,209 @@
+"""
+Management command that generates synthetic EcoHotel and Report datasets.
+
+The generated data follows a plausible yearly pattern: the production of the photovoltaic
+panels follows the seasons and the weather, while the consumption follows the occupancy of
+the hotel. It is meant to exercise the application at a realistic scale
+(e.g. 500 hotels x 5 years of reports).
+
+Classes:
+    - Command: The `generate_synthetic_data` management command.
+
+"""
+
+import hashlib
+import math
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ecohotel_board.db_routers import shard_aliases, shard_for_hotel
+from energy_tracker.aggregates import rebuild_leaderboards
+from energy_tracker.models import EcoHotel, Report
+from energy_tracker.sharding import allocate_ids, disabled_auto_now, fan_out, sync_hotels
+from energy_tracker.utils import DataVersion
+
+
+class Command(BaseCommand):
+    """
+    The `generate_synthetic_data` management command.
+
+    Attributes:
+        help (str): The description of the command.
+
+    """
+
+    help = "Generate synthetic EcoHotels and energy Reports at a configurable scale."
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The parser of the command.
+
+        """
+        parser.add_argument('--hotels', type=int, default=10,
+                            help="Number of hotels to generate.")
+        parser.add_argument('--years', type=float, default=1,
+                            help="Years of history to generate for each hotel.")
+        parser.add_argument('--reports-per-day', type=int, default=1,
+                            help="Number of reports per hotel per day.")
+        parser.add_argument('--end-date', type=date.fromisoformat, default=None,
+                            help="Last day of the history (YYYY-MM-DD), today by default.")
+        parser.add_argument('--unanchored', type=float, default=0.0,
+                            help="Fraction of reports left without hash and txId.")
+        parser.add_argument('--prefix', default='Synthetic',
+                            help="Prefix of the names of the generated hotels.")
+        parser.add_argument('--seed', type=int, default=42,
+                            help="Seed of the random generator, for reproducible datasets.")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Number of reports inserted per query.")
+        parser.add_argument('--clear', action='store_true',
+                            help="Delete the hotels with the same prefix before generating.")
+
+    def handle(self, *args, **options):
+        """
+        Generate the dataset.
+
+        Args:
+            *args: Additional positional arguments.
+            **options: The parsed command line options.
+
+        """
+        if options['hotels'] < 1 or options['reports_per_day'] < 1 or options['years'] <= 0:
+            raise CommandError("--hotels, --years and --reports-per-day must be positive.")
+        if not 0 <= options['unanchored'] <= 1:
+            raise CommandError("--unanchored must be between 0 and 1.")
+
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+        days = max(1, int(round(options['years'] * 365)))
+        end_date = options['end_date'] or date.today()
+        start_date = end_date - timedelta(days=days - 1)
+
+        started = time.perf_counter()
+        if options['clear']:
+            EcoHotel.objects.filter(name__startswith=f"{prefix} ").delete()
+
+        hotels = EcoHotel.objects.bulk_create(
+            [EcoHotel(name=f"{prefix} {index:04d}") for index in range(options['hotels'])])
+        # bulk_create does not return primary keys on every backend.
+        hotels = list(EcoHotel.objects.filter(
+            name__in=[hotel.name for hotel in hotels]).order_by('-id')[:len(hotels)])
+        # bulk_create does not send the post_save signal that copies the hotels to the shards.
+        sync_hotels([hotel.pk for hotel in hotels])
+
+        built = 0
+        batch = []
+        with disabled_auto_now():
+            for hotel in hotels:
+                profile = self._hotel_profile(rng)
+                for offset in range(days):
+                    day = start_date + timedelta(days=offset)
+                    for _ in range(options['reports_per_day']):
+                        batch.append(self._report(
+                            rng, hotel, day, profile, options['reports_per_day'],
+                            options['unanchored']))
+                    if len(batch) >= options['batch_size']:
+                        built += self._flush(batch)
+                built += self._flush(batch)
+        # Identical readings are dropped by the unique hash: count what was actually stored.
+        total = sum(fan_out(lambda ids: Report.objects.filter(ecohotel_id__in=ids).count(),
+                            [hotel.pk for hotel in hotels]))
+        # bulk_create does not send the post_save signal.
+        DataVersion().bump()
+        rebuild_leaderboards()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {len(hotels)} hotels and {total} reports "
+            f"({built - total} identical readings dropped) "
+            f"({start_date} - {end_date}) in {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else total:.0f} reports/s)."))
+
+    @staticmethod
+    def _hotel_profile(rng):
+        """
+        Draw the static characteristics of a hotel.
+
+        Args:
+            rng (Random): The random generator.
+
+        Returns:
+            dict: The peak power of the panels (kW), the number of rooms and the daily
+                consumption of an occupied room (kWh).
+
+        """
+        return {
+            'panels_kw': rng.uniform(20, 200),
+            'rooms': rng.randint(20, 300),
+            'room_kwh': rng.uniform(8, 25),
+        }
+
+    @staticmethod
+    def _report(rng, hotel, day, profile, reports_per_day, unanchored):
+        """
+        Build a single synthetic report.
+
+        Args:
+            rng (Random): The random generator.
+            hotel (EcoHotel): The hotel of the report.
+            day (date): The date of the report.
+            profile (dict): The characteristics of the hotel.
+            reports_per_day (int): The number of reports of the hotel in the same day.
+            unanchored (float): The probability of leaving the report without hash and txId.
+
+        Returns:
+            Report: The unsaved report.
+
+        """
+        season = math.cos(2 * math.pi * (day.timetuple().tm_yday - 172) / 365.25)
+        sun_hours = 3.5 + 2.5 * season
+        weather = rng.uniform(0.1, 0.5) if rng.random() < 0.25 else rng.uniform(0.7, 1.0)
+        occupancy = min(1.0, max(0.1, 0.6 + 0.3 * season + (0.1 if day.weekday() >= 5 else 0)
+                                 + rng.gauss(0, 0.05)))
+
+        energy_produced = int(profile['panels_kw'] * sun_hours * weather * 1000 / reports_per_day)
+        energy_consumed = int(profile['rooms'] * occupancy * profile['room_kwh'] * 1000
+                              / reports_per_day)
+
+        report = Report(ecohotel=hotel, energy_produced=energy_produced,
+                        energy_consumed=energy_consumed, date=day)
+        if rng.random() >= unanchored:
+            report.hash = report.compute_hash()
+            report.txId = '0x' + hashlib.sha256(report.hash.encode('utf-8')).hexdigest()
+        return report
+
+    @staticmethod
+    def _flush(batch):
+        """
+        Insert and empty the pending batch of reports.
+
+        Args:
+            batch (list): The pending reports.
+
+        Returns:
+            int: The number of reports of the batch, some of which may have been dropped as
+                duplicates.
+
+        """
+        size = len(batch)
+        if size:
+            if shard_aliases():
+                # bulk_create neither routes by hotel nor sends the pre_save signal that
+                # assigns the ids of the partitioned reports.
+                for report, report_id in zip(batch, allocate_ids(Report, size)):
+                    report.pk = report_id
+            shards = {}
+            for report in batch:
+                shards.setdefault(shard_for_hotel(report.ecohotel_id), []).append(report)
+            for alias, reports in shards.items():
+                with transaction.atomic(using=alias):
+                    # Identical readings of the same day collapse into one report.
+                    Report.objects.using(alias).bulk_create(reports, ignore_conflicts=True)
+            batch.clear()
+        return size
@@ -0,0 +1,93 @@
+"""
+Management command that moves the hotels to their shard.
+
+The shard of a hotel is a function of its id and of `REPORT_SHARDS` (see
+`ecohotel_board.db_routers.shard_for_hotel`). After a shard is added to the end of the list,
+or removed from it while its database stays configured, or when the partitioning is first
+enabled, some hotels have their reports on another database: this command copies the hotels
+to every shard, then moves the reports and the archived segments of those hotels. A move
+is copied and deleted batch by batch, so an interrupted run can simply run again.
+
+Classes:
+    - Command: The `rebalance_shards` management command.
+
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ecohotel_board.db_routers import shard_aliases
+from energy_tracker.sharding import misplaced_hotels, move_hotel, sync_hotels
+from energy_tracker.utils import DataVersion
+
+
+class Command(BaseCommand):
+    """
+    The `rebalance_shards` management command.
+
+    Attributes:
+        help (str): The description of the command.
+
+    """
+
+    help = "Move the reports of every hotel to the shard of the hotel."
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The parser of the command.
+
+        """
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Reports copied and deleted together.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only list the hotels to move.")
+
+    def handle(self, *args, **options):
+        """
+        Move the hotels.
+
+        Args:
+            *args: Additional positional arguments.
+            **options: The parsed command line options.
+
+        Raises:
+            CommandError: If the batch size is not positive.
+
+        """
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive.")
+        if not shard_aliases():
+            self.stdout.write("The reports are not partitioned: every hotel belongs to the "
+                              "primary database.")
+
+        started = time.perf_counter()
+        if not options['dry_run']:
+            copied = sync_hotels()
+            self.stdout.write(f"{copied} hotel copies written to the shards.")
+        moves = misplaced_hotels()
+        self.stdout.write(f"{len(moves)} hotels to move.")
+
+        moved = {'reports': 0, 'segments': 0}
+        for ecohotel_id, source, target in moves:
+            if options['dry_run']:
+                self.stdout.write(f"  hotel {ecohotel_id}: {source} -> {target}")
+                continue
+            result = move_hotel(ecohotel_id, source, target, options['batch_size'])
+            moved['reports'] += result['reports']
+            moved['segments'] += result['segments']
+            self.stdout.write(f"  hotel {ecohotel_id}: {source} -> {target}, "
+                              f"{result['reports']} reports, {result['segments']} segments")
+
+        if options['dry_run']:
+            return
+        if moves:
+            # The moved reports are unchanged, but the pages must not be served from the
+            # HTTP caches while the shards were inconsistent.
+            DataVersion().bump()
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {len(moves)} hotels ({moved['reports']} reports, {moved['segments']} "
+            f"segments) in {time.perf_counter() - started:.1f}s."))
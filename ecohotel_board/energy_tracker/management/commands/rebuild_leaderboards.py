@@ -0,0 +1,43 @@
+"""
+Management command that rebuilds the hotel leaderboards.
+
+The leaderboards are kept up to date by the signals of the Report model, but the changes
+that bypass the signals (bulk inserts, raw SQL, a flushed Redis) leave them stale. This
+command recomputes them from the database, archived segments included.
+
+Classes:
+    - Command: The `rebuild_leaderboards` management command.
+
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from energy_tracker.aggregates import rebuild_leaderboards
+
+
+class Command(BaseCommand):
+    """
+    The `rebuild_leaderboards` management command.
+
+    Attributes:
+        help (str): The description of the command.
+
+    """
+
+    help = "Recompute the hotel leaderboards stored in Redis from the database."
+
+    def handle(self, *args, **options):
+        """
+        Rebuild the leaderboards.
+
+        Args:
+            *args: Additional positional arguments.
+            **options: The parsed command line options.
+
+        """
+        started = time.perf_counter()
+        ranked = rebuild_leaderboards()
+        self.stdout.write(self.style.SUCCESS(
+            f"Ranked {ranked} hotels in {time.perf_counter() - started:.1f}s."))
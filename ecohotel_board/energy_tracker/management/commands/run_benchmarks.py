@@ -0,0 +1,141 @@
+"""
+Management command that runs the end-to-end load benchmarks.
+
+The benchmarks run against throw-away test databases filled with synthetic data, with Redis
+and the blockchain replaced by local stand-ins. The command fails when a metric regresses
+past the stored baseline.
+
+Classes:
+    - Command: The `run_benchmarks` management command.
+
+"""
+
+import json
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+
+from benchmarks.runner import (BASELINE_PATH, SCENARIOS, BenchmarkRunner,
+                               compare_with_baseline, load_baseline, save_baseline)
+from benchmarks.stubs import stubbed_services
+
+
+class Command(BaseCommand):
+    """
+    The `run_benchmarks` management command.
+
+    Attributes:
+        help (str): The description of the command.
+
+    """
+
+    help = "Run the end-to-end load benchmarks and compare them with the stored baseline."
+
+    def add_arguments(self, parser):
+        """
+        Add the command line arguments.
+
+        Args:
+            parser (ArgumentParser): The parser of the command.
+
+        """
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS,
+                            help="Scenarios to run.")
+        parser.add_argument('--iterations', type=int, default=20,
+                            help="Measured requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=2,
+                            help="Unmeasured requests made before each scenario.")
+        parser.add_argument('--hotels', type=int, default=5,
+                            help="Hotels of the synthetic dataset.")
+        parser.add_argument('--years', type=float, default=1,
+                            help="Years of reports of the synthetic dataset.")
+        parser.add_argument('--chain-latency', type=float, default=0.0,
+                            help="Seconds taken by each stubbed blockchain transaction.")
+        parser.add_argument('--baseline', type=Path, default=BASELINE_PATH,
+                            help="Path of the stored baseline.")
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help="Allowed relative growth of latency and memory.")
+        parser.add_argument('--update-baseline', action='store_true',
+                            help="Store the results as the new baseline.")
+        parser.add_argument('--output', type=Path, default=None,
+                            help="Also write the results as JSON to this path.")
+
+    def handle(self, *args, **options):
+        """
+        Run the benchmarks.
+
+        Args:
+            *args: Additional positional arguments.
+            **options: The parsed command line options.
+
+        Raises:
+            CommandError: If a metric regressed past the baseline.
+
+        """
+        scale = {'hotels': options['hotels'], 'years': options['years'],
+                 'iterations': options['iterations']}
+
+        # Like the test runner: every database, shards included, gets a test database, and
+        # the replica mirrors the primary, so no configured database is ever written.
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            with stubbed_services(chain_latency=options['chain_latency']):
+                call_command('generate_synthetic_data', hotels=options['hotels'],
+                             years=options['years'], stdout=StringIO())
+                results = BenchmarkRunner(
+                    iterations=options['iterations'], warmup=options['warmup'],
+                ).run(options['scenarios'])
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        self._print(results)
+        if options['output']:
+            with open(options['output'], encoding='utf-8', mode='w') as output_file:
+                json.dump({'scale': scale, 'scenarios': results}, output_file, indent=2)
+
+        baseline = load_baseline(options['baseline'])
+        if options['update_baseline']:
+            # Scenarios that were not run keep their stored metrics.
+            stored = baseline['scenarios'] if baseline and baseline.get('scale') == scale else {}
+            save_baseline({'scale': scale, 'scenarios': {**stored, **results}},
+                          options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Baseline stored in {options['baseline']}."))
+            return
+
+        if baseline is None:
+            self.stdout.write(self.style.WARNING("No baseline found, nothing to compare."))
+            return
+        if baseline.get('scale') != scale:
+            self.stdout.write(self.style.WARNING(
+                f"The baseline was recorded at scale {baseline.get('scale')}, "
+                f"not comparable with {scale}."))
+            return
+
+        regressions = compare_with_baseline(
+            results, baseline['scenarios'], options['tolerance'])
+        if regressions:
+            raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def _print(self, results):
+        """
+        Print the results as a table.
+
+        Args:
+            results (dict): The metrics of each scenario.
+
+        """
+        self.stdout.write(
+            f"{'scenario':<15}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'p99 ms':>10}{'queries':>10}{'peak KiB':>12}")
+        for scenario, metrics in results.items():
+            self.stdout.write(
+                f"{scenario:<15}{metrics['throughput_rps']:>10.1f}{metrics['p50_ms']:>10.1f}"
+                f"{metrics['p95_ms']:>10.1f}{metrics['p99_ms']:>10.1f}"
+                f"{metrics['queries']:>10}{metrics['peak_memory_kb']:>12.1f}")
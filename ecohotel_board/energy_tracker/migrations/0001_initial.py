@@ -0,0 +1,35 @@
+# The schema of the first release, so the databases created before the migrations were
+# shipped can be adopted with `migrate --fake-initial`.
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EcoHotel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField(default='Pomelia', max_length=20, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Report',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('energy_produced', models.BigIntegerField(default=0)),
+                ('energy_consumed', models.BigIntegerField(default=0)),
+                ('date', models.DateField(auto_now=True)),
+                ('hash', models.CharField(default=None, max_length=32, null=True)),
+                ('txId', models.CharField(default=None, max_length=66, null=True)),
+                ('ecohotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='energy_tracker.ecohotel')),
+            ],
+        ),
+    ]
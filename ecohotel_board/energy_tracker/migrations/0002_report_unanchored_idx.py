@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(condition=models.Q(('hash__isnull', True), ('txId__isnull', True), _connector='OR'), fields=['id'], name='report_unanchored_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# The first release hashed a constant string, so every anchored report has the same hash
+# and the unique index cannot be created. The hashes are recomputed with the canonical
+# formula of `Report.compute_hash` first; a report whose canonical hash is taken by an
+# earlier one is a duplicate, and loses its hash so that backfill_anchors deletes it.
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def recompute_hashes(apps, schema_editor):
+    Report = apps.get_model('energy_tracker', 'Report')
+    reports = Report.objects.using(schema_editor.connection.alias)
+    taken = set()
+    for report in reports.filter(hash__isnull=False).order_by('pk').iterator():
+        # Copy of Report.compute_hash: the historical model has no methods.
+        note = (f"{report.ecohotel_id}|{report.date.isoformat()}|"
+                f"{report.energy_produced}|{report.energy_consumed}")
+        report_hash = hashlib.sha256(note.encode('utf-8')).hexdigest()
+        if report_hash in taken:
+            report_hash = None
+        else:
+            taken.add(report_hash)
+        reports.filter(pk=report.pk).update(hash=report_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_tracker', '0002_report_unanchored_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='report',
+            name='hash',
+            field=models.CharField(default=None, max_length=64, null=True),
+        ),
+        migrations.RunPython(recompute_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='report',
+            name='hash',
+            field=models.CharField(default=None, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_tracker', '0004_report_hotel_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('report_count', models.IntegerField(default=0)),
+                ('total_produced', models.BigIntegerField(default=0)),
+                ('total_consumed', models.BigIntegerField(default=0)),
+                ('best_day', models.DateField(null=True)),
+                ('best_day_produced', models.BigIntegerField(null=True)),
+                ('lowest_day', models.DateField(null=True)),
+                ('lowest_day_consumed', models.BigIntegerField(null=True)),
+                ('payload', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+                ('ecohotel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='energy_tracker.ecohotel')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='reportsegment',
+            constraint=models.UniqueConstraint(fields=('ecohotel', 'month'), name='segment_hotel_month_unique'),
+        ),
+    ]
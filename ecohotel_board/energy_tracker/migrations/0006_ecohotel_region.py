@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_tracker', '0005_reportsegment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ecohotel',
+            name='region',
+            field=models.CharField(default='IT', max_length=16),
+        ),
+    ]
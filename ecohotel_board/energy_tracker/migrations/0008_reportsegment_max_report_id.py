@@ -0,0 +1,31 @@
+# The highest report id of each existing segment is read from its payload once, so the id
+# counter of the sharded reports is initialized without decompressing every segment.
+
+import json
+import zlib
+
+from django.db import migrations, models
+
+
+def fill_max_report_id(apps, schema_editor):
+    ReportSegment = apps.get_model('energy_tracker', 'ReportSegment')
+    segments = ReportSegment.objects.using(schema_editor.connection.alias)
+    for segment in segments.iterator():
+        ids = json.loads(zlib.decompress(bytes(segment.payload)).decode('utf-8'))['id']
+        segments.filter(pk=segment.pk).update(max_report_id=max(ids, default=0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('energy_tracker', '0007_idsequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportsegment',
+            name='max_report_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_max_report_id, migrations.RunPython.noop),
+    ]
@@ -5,14 +5,29 @@ This module defines the models used in the EcoHotel energy report application.
 The models represent the entities in the application, such as EcoHotels and Reports.
 
 Models:
-    - EcoHotel: Represents an EcoHotel entity with a name field.
+    - EcoHotel: Represents an EcoHotel entity with a name and a grid region.
     - Report: Represents an energy report entity with fields for an associated EcoHotel,
               energy produced, energy consumed, date, hash, and transaction ID.
+    - ReportSegment: Represents the archived reports of an EcoHotel in a month, compressed,
+              with the monthly rollups kept queryable.
+    - IdSequence: Represents a counter that hands out the ids of the partitioned reports.
+
+QuerySets:
+    - ReportQuerySet: Provides the common filters of the Report model.
+
+Functions:
+    - moving_reports: Context manager that marks the deleted reports as moved, not removed.
+    - reports_are_moving: Tells whether the deleted reports are being moved.
 """
 
+import datetime
 import hashlib
+import json
+import zlib
+from contextlib import contextmanager
+from asgiref.local import Local
 from django import forms
-from django.db import models
+from django.db import models, transaction
 from blockchain.blockchain_writer import BlockchainWriter
 from django.forms import ModelForm
 from django.contrib.auth.models import User
@@ -25,10 +40,85 @@ class EcoHotel(models.Model):
 
     Attributes:
         name (TextField): The name of the EcoHotel.
+        region (CharField): The grid region of the EcoHotel, for its emission factors.
 
     """
 
     name = models.TextField(default='Pomelia', max_length=20, null=True)
+    region = models.CharField(default='IT', max_length=16)
+
+
+# Whether the reports deleted by the current thread or task are being moved elsewhere, by
+# the archival into segments or by a shard rebalance, rather than removed.
+_moves = Local()
+
+
+@contextmanager
+def moving_reports():
+    """
+    Mark the reports deleted in the block, in the current thread, as moved, not removed.
+
+    The archival and the moves between shards delete the reports from the table that held
+    them once they are stored elsewhere. The deletion signals are still sent, but their
+    receivers leave the derived data (versions, leaderboards, footprints, cards, hashes)
+    untouched, since the reports still exist.
+    """
+    previous = reports_are_moving()
+    _moves.active = True
+    try:
+        yield
+    finally:
+        _moves.active = previous
+
+
+def reports_are_moving():
+    """
+    Tell whether the reports deleted now are being moved.
+
+    Returns:
+        bool: True inside `moving_reports()`.
+    """
+    return getattr(_moves, 'active', False)
+
+
+# Reports whose transaction never reached the blockchain.
+UNANCHORED = models.Q(hash__isnull=True) | models.Q(txId__isnull=True)
+
+
+class ReportQuerySet(models.QuerySet):
+    """
+    QuerySet of the Report model.
+
+    Methods:
+        unanchored(): Filters the reports that are not written on the blockchain.
+        create(**kwargs): Creates a report, on the shard of its hotel.
+
+    """
+
+    def unanchored(self):
+        """
+        Filter the reports that are not written on the blockchain.
+
+        Returns:
+            ReportQuerySet: The reports without hash or transaction ID.
+
+        """
+        return self.filter(UNANCHORED)
+
+    def create(self, **kwargs):
+        """
+        Create a report.
+
+        Unless a database was chosen with `using()`, the save is routed with the report as
+        hint, so the report is written to the shard of its hotel.
+
+        Returns:
+            Report: The saved report.
+
+        """
+        report = self.model(**kwargs)
+        report.save(force_insert=True, using=self._db)
+        return report
 
 
 class Report(models.Model):
@@ -40,12 +130,13 @@ class Report(models.Model):
         energy_produced (BigIntegerField): The amount of energy produced.
         energy_consumed (BigIntegerField): The amount of energy consumed.
         date (DateField): The date of the report.
-        hash (CharField): The hash of the report.
+        hash (CharField): The canonical hash of the report, unique across all the reports.
         txId (CharField): The transaction ID of the report.
-        _note (str): A string representation of the report note.
 
     Methods:
+        compute_hash(): Computes the hash of the report.
         write_on_chain(): Writes the report on the blockchain.
+        anchor(): Sends the hash of a stored report to the blockchain.
 
     """
 
@@ -53,18 +144,220 @@ class Report(models.Model):
     energy_produced = models.BigIntegerField(default=0)
     energy_consumed = models.BigIntegerField(default=0)
     date = models.DateField(auto_now=True)
-    hash = models.CharField(max_length=32, default=None, null=True)
+    hash = models.CharField(max_length=64, default=None, null=True, unique=True)
     txId = models.CharField(max_length=66, default=None, null=True)
-    _note = f"Energy Produced: {energy_produced}\t Energy Consumed: {energy_consumed}"
+
+    objects = ReportQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Partial index that keeps the lookup of the un-anchored reports cheap
+            # regardless of the size of the table.
+            models.Index(fields=['id'], name='report_unanchored_idx', condition=UNANCHORED),
+            models.Index(fields=['ecohotel', 'date'], name='report_hotel_date_idx'),
+        ]
+
+    def compute_hash(self):
+        """
+        Compute the canonical hash of the report.
+
+        The hash covers the hotel, the period (the day of the report) and the energy produced
+        and consumed, so two submissions of the same report always have the same hash.
+
+        Returns:
+            str: The hexadecimal SHA-256 digest of the report.
+
+        """
+        period = self.date or datetime.date.today()
+        note = (f"{self.ecohotel_id}|{period.isoformat()}|"
+                f"{self.energy_produced}|{self.energy_consumed}")
+        return hashlib.sha256(note.encode('utf-8')).hexdigest()
 
     def write_on_chain(self):
         """
         Write the report on the blockchain.
 
-        This method calculates the hash of the report and sends it as a transaction to the blockchain network.
+        This method calculates the hash of the report, stores the report and then sends the hash
+        as a transaction to the blockchain network. The unique index on the hash rejects a
+        duplicate report before any transaction is sent.
+
+        Raises:
+            IntegrityError: If a report with the same hash already exists.
 
         """
 
-        self.hash = hashlib.sha256(self._note.encode('utf-8')).hexdigest()
+        self.hash = self.compute_hash()
+        with transaction.atomic():
+            self.save()
+        self.anchor()
+
+    def anchor(self):
+        """
+        Send the hash of the stored report as a transaction and record its ID.
+
+        A report whose transaction failed stays stored without ID, so it can be anchored again.
+
+        """
         self.txId = BlockchainWriter().send_transaction(self.hash)
-        self.save()
+        self.save(update_fields=['txId'])
+
+
+class ReportSegment(models.Model):
+    """
+    Model representing the archived reports of an EcoHotel in a month.
+
+    The reports are stored column by column (one list per field) in a compressed payload,
+    keeping their hashes and transaction IDs for verification. The monthly rollups are
+    regular fields, so the statistics can be computed without decompressing the payload.
+
+    Attributes:
+        ecohotel (ForeignKey): The EcoHotel of the archived reports.
+        month (DateField): The first day of the month of the archived reports.
+        report_count (IntegerField): The number of archived reports.
+        max_report_id (BigIntegerField): The highest id of the archived reports.
+        total_produced (BigIntegerField): The energy produced in the month.
+        total_consumed (BigIntegerField): The energy consumed in the month.
+        best_day (DateField): The day with the highest energy production.
+        best_day_produced (BigIntegerField): The energy produced in the best day.
+        lowest_day (DateField): The day with the lowest energy consumption.
+        lowest_day_consumed (BigIntegerField): The energy consumed in the lowest day.
+        payload (BinaryField): The compressed columns of the archived reports.
+        archived_at (DateTimeField): The date of the last archival into the segment.
+
+    Methods:
+        build(ecohotel_id, month, reports): Builds a segment from a list of reports.
+        reports(): Reads back the archived reports.
+        daily_totals(): Computes the energy produced and consumed in each day.
+        verify(): Finds the archived reports whose hash does not match their data.
+
+    """
+
+    COLUMNS = ('id', 'day', 'energy_produced', 'energy_consumed', 'hash', 'txId')
+
+    ecohotel = models.ForeignKey(EcoHotel, on_delete=models.CASCADE)
+    month = models.DateField()
+    report_count = models.IntegerField(default=0)
+    max_report_id = models.BigIntegerField(default=0)
+    total_produced = models.BigIntegerField(default=0)
+    total_consumed = models.BigIntegerField(default=0)
+    best_day = models.DateField(null=True)
+    best_day_produced = models.BigIntegerField(null=True)
+    lowest_day = models.DateField(null=True)
+    lowest_day_consumed = models.BigIntegerField(null=True)
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ecohotel', 'month'],
+                                    name='segment_hotel_month_unique'),
+        ]
+
+    @classmethod
+    def build(cls, ecohotel_id, month, reports):
+        """
+        Build a segment from the reports of an EcoHotel in a month.
+
+        Args:
+            ecohotel_id (int): The id of the EcoHotel.
+            month (date): The first day of the month.
+            reports (list): The reports, all of the same EcoHotel and month.
+
+        Returns:
+            ReportSegment: The unsaved segment.
+
+        """
+        reports = sorted(reports, key=lambda report: report.pk)
+        columns = {
+            'id': [report.pk for report in reports],
+            'day': [report.date.day for report in reports],
+            'energy_produced': [report.energy_produced for report in reports],
+            'energy_consumed': [report.energy_consumed for report in reports],
+            'hash': [report.hash for report in reports],
+            'txId': [report.txId for report in reports],
+        }
+        segment = cls(
+            ecohotel_id=ecohotel_id, month=month, report_count=len(reports),
+            max_report_id=columns['id'][-1] if reports else 0,
+            total_produced=sum(columns['energy_produced']),
+            total_consumed=sum(columns['energy_consumed']),
+            payload=zlib.compress(json.dumps(columns, separators=(',', ':')).encode('utf-8'), 9))
+        daily = segment.daily_totals()
+        if daily:
+            segment.best_day, (segment.best_day_produced, _) = max(
+                daily.items(), key=lambda item: item[1][0])
+            segment.lowest_day, (_, segment.lowest_day_consumed) = min(
+                daily.items(), key=lambda item: item[1][1])
+        return segment
+
+    def _columns(self):
+        """
+        Decompress the columns of the archived reports.
+
+        Returns:
+            dict: A list of values for each column.
+
+        """
+        return json.loads(zlib.decompress(bytes(self.payload)).decode('utf-8'))
+
+    def reports(self):
+        """
+        Read back the archived reports.
+
+        Returns:
+            list: The archived reports, as unsaved Report instances.
+
+        """
+        columns = self._columns()
+        return [
+            Report(id=report_id, ecohotel_id=self.ecohotel_id, date=self.month.replace(day=day),
+                   energy_produced=produced, energy_consumed=consumed,
+                   hash=report_hash, txId=tx_id)
+            for report_id, day, produced, consumed, report_hash, tx_id
+            in zip(*(columns[column] for column in self.COLUMNS))
+        ]
+
+    def daily_totals(self):
+        """
+        Compute the energy produced and consumed in each day of the segment.
+
+        Returns:
+            dict: The (produced, consumed) tuple of each day.
+
+        """
+        columns = self._columns()
+        daily = {}
+        for day, produced, consumed in zip(
+                columns['day'], columns['energy_produced'], columns['energy_consumed']):
+            total_produced, total_consumed = daily.get(day, (0, 0))
+            daily[day] = (total_produced + produced, total_consumed + consumed)
+        return {self.month.replace(day=day): totals for day, totals in sorted(daily.items())}
+
+    def verify(self):
+        """
+        Find the archived reports whose hash does not match their data.
+
+        Returns:
+            list: The ids of the altered reports.
+
+        """
+        return [report.pk for report in self.reports() if report.hash != report.compute_hash()]
+
+
+class IdSequence(models.Model):
+    """
+    Model representing a counter that hands out the ids of a partitioned model.
+
+    When the reports are partitioned across shards, the auto-increment of each shard would
+    repeat the ids of the others, and a hotel moved to another shard could not keep the ids
+    of its reports. The ids are instead reserved in blocks from this counter, which always
+    lives on the primary database.
+
+    Attributes:
+        name (CharField): The label of the model that the ids belong to.
+        next_id (BigIntegerField): The first id that was never reserved.
+
+    """
+
+    name = models.CharField(max_length=64, primary_key=True)
+    next_id = models.BigIntegerField(default=1)
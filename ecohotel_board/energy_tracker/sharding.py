@@ -0,0 +1,300 @@
+"""
+Partitioning of the energy data across shards.
+
+When `REPORT_SHARDS` is set, the reports and the archived segments of each hotel live on the
+shard chosen by `ecohotel_board.db_routers.shard_for_hotel`, and every shard keeps a copy of
+the hotels. The aggregations over the fleet run once per shard, in parallel, and their
+results are merged by the caller. Without shards everything runs on the primary, in the
+calling thread, exactly as before.
+
+Functions:
+    - fan_out: Runs a function on every shard of some hotels, in parallel.
+    - allocate_ids: Reserves globally unique ids for the reports of the shards.
+    - disabled_auto_now: Context manager that keeps the dates of the inserted reports.
+    - sync_hotels: Copies the hotels from the primary to every shard.
+    - drop_hotel: Deletes the copies of a hotel, with its reports, from every shard.
+    - misplaced_hotels: Finds the hotels whose data is not on their shard.
+    - move_hotel: Moves the data of a hotel from a database to another.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F, Max
+
+from ecohotel_board.db_routers import shard_aliases, shard_for_hotel, use_shard
+from .models import EcoHotel, IdSequence, Report, ReportSegment, moving_reports
+
+# The blocks of ids reserved by this process: (next id, end of the block) of each model.
+_id_blocks = {}
+_id_lock = threading.Lock()
+
+
+def _holders():
+    """
+    List the databases that may still hold reports: the primary and every configured shard.
+
+    Returns:
+        list: The aliases, without the read replica.
+    """
+    replica = getattr(settings, 'REPLICA_DATABASE', None)
+    return [alias for alias in settings.DATABASES if alias != replica]
+
+
+def _run_on_shard(function, alias, ecohotel_ids):
+    """
+    Run a function on a shard, in a worker thread of `fan_out`.
+
+    Args:
+        function (callable): The function.
+        alias (str): The alias of the shard.
+        ecohotel_ids (list): The hotels of the shard, None for every hotel.
+
+    Returns:
+        object: The result of the function.
+    """
+    try:
+        with use_shard(alias):
+            return function(ecohotel_ids)
+    finally:
+        # The connections of a worker thread are not reused.
+        connections.close_all()
+
+
+def fan_out(function, ecohotel_ids=None):
+    """
+    Run a function on every shard that holds some hotels, in parallel.
+
+    The function receives the ids of the hotels of its shard and runs inside `use_shard()`,
+    so its queries on the energy data reach that shard only.
+
+    Args:
+        function (callable): The function, called with a list of hotel ids or None.
+        ecohotel_ids (list): The ids of the hotels, None for every hotel.
+
+    Returns:
+        list: The result of the function on each shard. Without shards, the single result
+            of the function called in this thread on the primary.
+    """
+    if not shard_aliases():
+        return [function(ecohotel_ids)]
+    if ecohotel_ids is None:
+        groups = {alias: None for alias in shard_aliases()}
+    else:
+        groups = {}
+        for ecohotel_id in ecohotel_ids:
+            groups.setdefault(shard_for_hotel(ecohotel_id), []).append(ecohotel_id)
+    if len(groups) == 1:
+        (alias, ids), = groups.items()
+        with use_shard(alias):
+            return [function(ids)]
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        futures = [pool.submit(_run_on_shard, function, alias, ids)
+                   for alias, ids in groups.items()]
+        return [future.result() for future in futures]
+
+
+def _first_free_id(model):
+    """
+    Find the first id of a model that is not used by any database.
+
+    For the reports, the ids kept in the archived segments count too, read from their
+    `max_report_id` without decompressing them. This runs once, when the counter is created.
+
+    Args:
+        model (Model): The model.
+
+    Returns:
+        int: The highest id of the model plus one.
+    """
+    highest = 0
+    for alias in _holders():
+        highest = max(highest, model._base_manager.using(alias).aggregate(
+            highest=Max('pk'))['highest'] or 0)
+        if model is Report:
+            highest = max(highest, ReportSegment.objects.using(alias).aggregate(
+                highest=Max('max_report_id'))['highest'] or 0)
+    return highest + 1
+
+
+def _reserve_ids(model, size):
+    """
+    Reserve a block of ids from the counter of a model, on the primary.
+
+    Args:
+        model (Model): The model.
+        size (int): The number of ids.
+
+    Returns:
+        tuple: The first id of the block and the end of the block.
+    """
+    label = model._meta.label_lower
+    sequences = IdSequence.objects.using(DEFAULT_DB_ALIAS)
+    sequences.get_or_create(name=label, defaults={'next_id': _first_free_id(model)})
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        # The update locks the counter until the block is read back.
+        sequences.filter(name=label).update(next_id=F('next_id') + size)
+        end = sequences.values_list('next_id', flat=True).get(name=label)
+    return end - size, end
+
+
+def allocate_ids(model, count):
+    """
+    Reserve globally unique ids for new objects of a partitioned model.
+
+    The ids come from a block reserved by this process, so the counter on the primary is
+    only written once every `SHARD_ID_BLOCK_SIZE` objects.
+
+    Args:
+        model (Model): The model.
+        count (int): The number of ids.
+
+    Returns:
+        list: The ids.
+    """
+    label = model._meta.label_lower
+    ids = []
+    with _id_lock:
+        while len(ids) < count:
+            next_id, end = _id_blocks.get(label, (0, 0))
+            if next_id >= end:
+                next_id, end = _reserve_ids(
+                    model, max(settings.SHARD_ID_BLOCK_SIZE, count - len(ids)))
+            taken = min(end - next_id, count - len(ids))
+            ids.extend(range(next_id, next_id + taken))
+            _id_blocks[label] = (next_id + taken, end)
+    return ids
+
+
+@contextmanager
+def disabled_auto_now():
+    """
+    Temporarily disable the `auto_now` behaviour of `Report.date`.
+
+    `auto_now` overwrites the date with the current day on every insert, which would make
+    every historical or moved report look like it was created today.
+
+    """
+    field = Report._meta.get_field('date')
+    previous = field.auto_now
+    field.auto_now = False
+    try:
+        yield
+    finally:
+        field.auto_now = previous
+
+
+def sync_hotels(ecohotel_ids=None):
+    """
+    Copy the hotels from the primary to every shard, inserting or updating the copies.
+
+    Args:
+        ecohotel_ids (list): The ids of the hotels, every hotel by default.
+
+    Returns:
+        int: The number of copies written.
+    """
+    if not shard_aliases():
+        return 0
+    hotels = EcoHotel.objects.using(DEFAULT_DB_ALIAS).order_by('pk')
+    if ecohotel_ids is not None:
+        hotels = hotels.filter(pk__in=ecohotel_ids)
+    hotels = list(hotels)
+    written = 0
+    for alias in shard_aliases():
+        copies = EcoHotel.objects.using(alias)
+        if ecohotel_ids is not None:
+            copies = copies.filter(pk__in=ecohotel_ids)
+        copies = {pk: (name, region) for pk, name, region in
+                  copies.values_list('pk', 'name', 'region')}
+        missing = [hotel for hotel in hotels if hotel.pk not in copies]
+        changed = [hotel for hotel in hotels
+                   if hotel.pk in copies and copies[hotel.pk] != (hotel.name, hotel.region)]
+        # Bulk queries: the copies must not send the signals of the hotels again.
+        EcoHotel.objects.using(alias).bulk_create(missing)
+        EcoHotel.objects.using(alias).bulk_update(changed, ['name', 'region'])
+        written += len(missing) + len(changed)
+    return written
+
+
+def drop_hotel(ecohotel_id):
+    """
+    Delete the copies of a hotel from every shard, with its reports and segments.
+
+    Args:
+        ecohotel_id (int): The id of the hotel.
+    """
+    for alias in shard_aliases():
+        EcoHotel.objects.using(alias).filter(pk=ecohotel_id).delete()
+
+
+def misplaced_hotels():
+    """
+    Find the hotels whose reports or segments are not on their shard.
+
+    The primary and the databases that are configured but no longer in `REPORT_SHARDS` are
+    searched too, so the data is moved when the partitioning is enabled or a shard retired.
+
+    Returns:
+        list: The (hotel id, database holding its data, shard of the hotel) of each move.
+    """
+    moves = []
+    for alias in _holders():
+        held = set(Report.objects.using(alias).order_by().values_list(
+            'ecohotel_id', flat=True).distinct())
+        held.update(ReportSegment.objects.using(alias).order_by().values_list(
+            'ecohotel_id', flat=True).distinct())
+        moves.extend((ecohotel_id, alias, shard_for_hotel(ecohotel_id)) for ecohotel_id
+                     in sorted(held) if shard_for_hotel(ecohotel_id) != alias)
+    return moves
+
+
+def move_hotel(ecohotel_id, source, target, batch_size=1000):
+    """
+    Move the reports and the segments of a hotel from a database to another.
+
+    Each batch is copied, keeping the ids, then deleted from the source, so an interrupted
+    move can simply run again. The reports are moved, not removed: they are deleted inside
+    `moving_reports()`, so the derived data (leaderboards, cards, footprints) stays valid.
+
+    Args:
+        ecohotel_id (int): The id of the hotel.
+        source (str): The alias of the database that holds the data.
+        target (str): The alias of the shard of the hotel.
+        batch_size (int): The reports copied together.
+
+    Returns:
+        dict: The number of moved reports and segments.
+    """
+    sync_hotels([ecohotel_id])
+    reports = Report.objects.using(source).filter(ecohotel_id=ecohotel_id)
+    result = {'reports': 0, 'segments': 0}
+    with disabled_auto_now():
+        while True:
+            batch = list(reports.order_by('pk')[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic(using=target):
+                Report.objects.using(target).bulk_create(batch, ignore_conflicts=True)
+            with transaction.atomic(using=source), moving_reports():
+                reports.filter(pk__in=[report.pk for report in batch]).delete()
+            result['reports'] += len(batch)
+
+    for segment in ReportSegment.objects.using(source).filter(ecohotel_id=ecohotel_id):
+        with transaction.atomic(using=target):
+            existing = ReportSegment.objects.using(target).select_for_update().filter(
+                ecohotel_id=ecohotel_id, month=segment.month).first()
+            # Keyed by id, so a segment copied by an interrupted move is not doubled.
+            archived = {report.pk: report for report in segment.reports()}
+            if existing:
+                archived.update((report.pk, report) for report in existing.reports())
+            merged = ReportSegment.build(ecohotel_id, segment.month, list(archived.values()))
+            if existing:
+                merged.pk = existing.pk
+            merged.save(using=target)
+        ReportSegment.objects.using(source).filter(pk=segment.pk).delete()
+        result['segments'] += 1
+    return result
@@ -0,0 +1,355 @@
+"""
+Signal receivers of the energy report application.
+
+This module keeps the derived data in sync with the EcoHotel and Report models. The reports
+deleted inside `models.moving_reports()` are moved, not removed, and leave it untouched. The
+other deleted reports are collected per transaction, so deleting the many reports of a hotel
+updates the derived data once.
+
+Functions:
+    - bump_data_version: Records a change of the energy data.
+    - publish_dashboard_delta: Records a saved report and broadcasts it to the live dashboards.
+    - update_leaderboards: Applies a new report to the leaderboards.
+    - mark_leaderboards_dirty: Schedules the recomputation of a changed hotel in the leaderboards.
+    - invalidate_carbon_footprint: Drops the cached carbon footprint of a changed hotel.
+    - render_report_card: Renders and caches the card of a saved report.
+    - collect_deleted_report: Collects a deleted report, for its transaction to forget it.
+    - forget_deleted_reports: Updates the derived data of the reports deleted by a transaction.
+    - track_hotel_rename: Notes whether a saved hotel changes its name.
+    - drop_renamed_hotel_cards: Drops the cached cards of the reports of a renamed hotel.
+    - assign_report_id: Gives a new report a globally unique id when the reports are sharded.
+    - copy_hotel_to_shards: Copies a saved hotel to every shard.
+    - drop_hotel_from_shards: Deletes a deleted hotel from every shard.
+"""
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from ecohotel_board.db_routers import shard_aliases
+from .aggregates import refresh_dirty_leaderboards
+from .carbon import footprint_change
+from .cards import cache_card, drop_cards, drop_hotel_cards
+from .models import EcoHotel, Report, reports_are_moving
+from .sharding import allocate_ids, drop_hotel, sync_hotels
+from .utils import (CarbonFootprintCache, DashboardChannel, DataVersion, HotelLeaderboard,
+                    ReportDeduplicator)
+
+# The fields written when a report is anchored, which do not change its energy.
+ANCHOR_FIELDS = {'hash', 'txId'}
+
+
+def _day_totals(report):
+    """
+    Aggregate the energy of the hotel of a report in the day of the report, once per save.
+
+    Args:
+        report (Report): The saved report.
+
+    Returns:
+        dict: The energy produced and consumed in the day.
+    """
+    if not hasattr(report, '_day_totals'):
+        report._day_totals = Report.objects.using(report._state.db).filter(
+            ecohotel_id=report.ecohotel_id, date=report.date).aggregate(
+            day_produced=Sum('energy_produced'), day_consumed=Sum('energy_consumed'))
+    return report._day_totals
+
+
+def _collect_until_commit(using, kind, item, flush):
+    """
+    Collect an item in the current transaction, to flush it with the others of its kind.
+
+    A single commit hook is registered per kind and transaction, so the receivers that run
+    once per row update the derived data once per transaction.
+
+    Args:
+        using (str): The alias of the database of the change.
+        kind (str): The kind of the items.
+        item (object): The item.
+        flush (callable): Called with the list of the items once the transaction is committed.
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        flush([item])
+        return
+    # Committing or rolling back the transaction replaces its list of commit hooks.
+    pending = getattr(connection, '_collected_until_commit', None)
+    if pending is None or pending[0] is not connection.run_on_commit:
+        pending = connection._collected_until_commit = (connection.run_on_commit, {})
+    batches = pending[1]
+    if kind not in batches:
+        batches[kind] = []
+        transaction.on_commit(lambda: flush(batches.pop(kind)), using=using)
+    batches[kind].append(item)
+
+
+@receiver(post_save, sender=EcoHotel)
+@receiver(post_delete, sender=EcoHotel)
+def bump_data_version(sender, **kwargs):
+    """
+    Record a change of the energy data, invalidating the validators of the pages that show it.
+
+    The version is bumped once the change is committed, so a request served in the meantime
+    cannot store the old data under the new version. A saved report bumps it in
+    `publish_dashboard_delta`, which sends the new version to the dashboards, and the deleted
+    reports in `forget_deleted_reports`.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        **kwargs: The arguments of the signal.
+    """
+    if reports_are_moving():
+        return
+    transaction.on_commit(lambda: DataVersion().bump())
+
+
+@receiver(post_save, sender=Report)
+def publish_dashboard_delta(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """
+    Record a saved report in the version of the data, and broadcast it to the live dashboards
+    when it is new or anchored.
+
+    The totals and the CO2 of the day of a new report are computed once here, so the dashboards
+    only apply the delta instead of recomputing their statistics. Each delta carries the version
+    it leads to: a dashboard that finds a gap missed a change, or a change that is not
+    broadcast, and reloads.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (Report): The saved report.
+        created (bool): True if the report was created.
+        update_fields (frozenset): The updated fields, None if every field was saved.
+        raw (bool): True if the report was loaded from a fixture.
+        **kwargs: The other arguments of the signal.
+    """
+    if reports_are_moving():
+        return
+    delta = None
+    if created and not raw:
+        day = _day_totals(instance)
+        delta = {
+            'event': 'created',
+            'hotel': instance.ecohotel_id,
+            'report': instance.pk,
+            'date': instance.date,
+            'energy_produced': instance.energy_produced,
+            'energy_consumed': instance.energy_consumed,
+            **day,
+            **footprint_change(instance.ecohotel.region, instance.date, day,
+                               instance.energy_produced, instance.energy_consumed),
+        }
+    elif not raw and update_fields and 'txId' in update_fields and instance.txId:
+        delta = {
+            'event': 'anchored',
+            'hotel': instance.ecohotel_id,
+            'report': instance.pk,
+            'txId': instance.txId,
+        }
+
+    def bump_and_publish():
+        version = DataVersion().bump()
+        if delta is not None and version is not None:
+            DashboardChannel().publish({**delta, 'version': version})
+
+    transaction.on_commit(bump_and_publish)
+
+
+@receiver(post_save, sender=Report)
+def update_leaderboards(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """
+    Apply a new report to the leaderboards, or schedule the recomputation of a changed one.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (Report): The saved report.
+        created (bool): True if the report was created.
+        update_fields (frozenset): The updated fields, None if every field was saved.
+        raw (bool): True if the report was loaded from a fixture.
+        **kwargs: The other arguments of the signal.
+    """
+    if raw or (update_fields and set(update_fields) <= ANCHOR_FIELDS):
+        return
+    if not created:
+        mark_leaderboards_dirty(sender, instance)
+        return
+    day = _day_totals(instance)
+    transaction.on_commit(lambda: HotelLeaderboard().add_report(
+        instance.ecohotel_id, instance.energy_produced, instance.energy_consumed,
+        day['day_produced']))
+
+
+@receiver(post_delete, sender=EcoHotel)
+def mark_leaderboards_dirty(sender, instance, **kwargs):
+    """
+    Schedule the recomputation of a deleted hotel, or of the hotel of an edited report, in
+    the leaderboards.
+
+    The hotel is marked immediately, and recomputed from the database after the commit.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (EcoHotel or Report): The changed hotel or report.
+        **kwargs: The other arguments of the signal.
+    """
+    if reports_are_moving():
+        return
+    HotelLeaderboard().mark_dirty(instance.pk if sender is EcoHotel else instance.ecohotel_id)
+    transaction.on_commit(refresh_dirty_leaderboards)
+
+
+@receiver(post_save, sender=EcoHotel)
+@receiver(post_delete, sender=EcoHotel)
+@receiver(post_save, sender=Report)
+def invalidate_carbon_footprint(sender, instance, update_fields=None, raw=False, **kwargs):
+    """
+    Drop the cached carbon footprint of the hotel of a changed report, or of a changed hotel.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (EcoHotel or Report): The changed hotel or report.
+        update_fields (frozenset): The updated fields, None if every field was saved.
+        raw (bool): True if the object was loaded from a fixture.
+        **kwargs: The other arguments of the signal.
+    """
+    if raw or (update_fields and set(update_fields) <= ANCHOR_FIELDS) or reports_are_moving():
+        return
+    ecohotel_id = instance.pk if sender is EcoHotel else instance.ecohotel_id
+    transaction.on_commit(lambda: CarbonFootprintCache().invalidate(ecohotel_id))
+
+
+@receiver(post_save, sender=Report)
+def render_report_card(sender, instance, raw=False, **kwargs):
+    """
+    Render and cache the card of a saved report, once it is committed.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (Report): The saved report.
+        raw (bool): True if the report was loaded from a fixture.
+        **kwargs: The other arguments of the signal.
+    """
+    if raw:
+        return
+    transaction.on_commit(lambda: cache_card(instance))
+
+
+@receiver(post_delete, sender=Report)
+def collect_deleted_report(sender, instance, using, **kwargs):
+    """
+    Collect a deleted report, whose derived data is updated once its transaction is committed.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (Report): The deleted report.
+        using (str): The alias of the database of the deletion.
+        **kwargs: The other arguments of the signal.
+    """
+    if reports_are_moving():
+        return
+    _collect_until_commit(using, 'deleted_reports', (
+        instance.pk, instance.ecohotel_id, instance.hash, instance.date), forget_deleted_reports)
+
+
+def forget_deleted_reports(reports):
+    """
+    Update the derived data of the reports deleted by a transaction, all together.
+
+    The data version is bumped, the hotels are recomputed in the leaderboards and lose their
+    cached carbon footprint, the cards are dropped, and the hashes are removed from the
+    deduplication sets so the reports can be submitted again.
+
+    Args:
+        reports (list): The id, hotel id, hash and day of each deleted report.
+    """
+    ecohotel_ids = {ecohotel_id for _, ecohotel_id, _, _ in reports}
+    DataVersion().bump()
+    HotelLeaderboard().mark_dirty(*ecohotel_ids)
+    refresh_dirty_leaderboards()
+    CarbonFootprintCache().invalidate(*ecohotel_ids)
+    drop_cards([report_id for report_id, _, _, _ in reports])
+    ReportDeduplicator().forget_many([(report_hash, day) for _, _, report_hash, day in reports
+                                      if report_hash])
+
+
+@receiver(pre_save, sender=EcoHotel)
+def track_hotel_rename(sender, instance, using, raw=False, **kwargs):
+    """
+    Note whether a saved hotel changes its name, which the cards of its reports show.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (EcoHotel): The hotel about to be saved.
+        using (str): The alias of the database of the save.
+        raw (bool): True if the hotel was loaded from a fixture.
+        **kwargs: The other arguments of the signal.
+    """
+    instance._renamed = False
+    if raw or instance.pk is None:
+        return
+    previous = EcoHotel.objects.using(using).filter(pk=instance.pk).values_list(
+        'name', flat=True).first()
+    instance._renamed = previous is not None and previous != instance.name
+
+
+@receiver(post_save, sender=EcoHotel)
+def drop_renamed_hotel_cards(sender, instance, **kwargs):
+    """
+    Drop the cached cards of the reports of a renamed hotel, once the rename is committed.
+
+    The cards are rendered again, with the new name, by the next homepage.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (EcoHotel): The saved hotel.
+        **kwargs: The other arguments of the signal.
+    """
+    if getattr(instance, '_renamed', False):
+        ecohotel_id = instance.pk
+        transaction.on_commit(lambda: drop_hotel_cards(ecohotel_id))
+
+
+@receiver(pre_save, sender=Report)
+def assign_report_id(sender, instance, raw=False, **kwargs):
+    """
+    Give a new report a globally unique id when the reports are partitioned across shards.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (Report): The report about to be saved.
+        raw (bool): True if the report was loaded from a fixture.
+        **kwargs: The other arguments of the signal.
+    """
+    if not raw and instance.pk is None and shard_aliases():
+        instance.pk, = allocate_ids(Report, 1)
+
+
+@receiver(post_save, sender=EcoHotel)
+def copy_hotel_to_shards(sender, instance, using, **kwargs):
+    """
+    Copy a hotel saved on the primary to every shard, where its reports are joined with it.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (EcoHotel): The saved hotel.
+        using (str): The alias of the database of the save.
+        **kwargs: The other arguments of the signal.
+    """
+    if using == DEFAULT_DB_ALIAS and shard_aliases():
+        sync_hotels([instance.pk])
+
+
+@receiver(post_delete, sender=EcoHotel)
+def drop_hotel_from_shards(sender, instance, using, **kwargs):
+    """
+    Delete a hotel deleted from the primary from every shard, with its reports.
+
+    Args:
+        sender (Model): The model class that sent the signal.
+        instance (EcoHotel): The deleted hotel.
+        using (str): The alias of the database of the deletion.
+        **kwargs: The other arguments of the signal.
+    """
+    if using == DEFAULT_DB_ALIAS and shard_aliases():
+        drop_hotel(instance.pk)
@@ -1,3 +1,993 @@
-from django.test import TestCase
+import gzip
+import json
+import tempfile
+import threading
+from datetime import date
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+import redis
+import rlp
+
+from benchmarks.runner import compare_with_baseline, percentile
+from benchmarks.stubs import FakeBlockchainWriter, FakeRedis, stubbed_services
+from blockchain.blockchain_writer import BlockchainWriter
+from blockchain.signing_pipeline import SigningPipeline
+from ecohotel_board import db_routers
+from .aggregates import comparison_range, energy_series, hotel_statistics, rebuild_leaderboards
+from .archive import archive_reports, monthly_reports
+from .cards import card_template_version
+from .carbon import EmissionFactors, cached_hotel_footprints, hotel_footprints
+from .models import EcoHotel, Report, ReportSegment
+from . import cards, sharding, views
+from .utils import (DashboardChannel, DataVersion, HotelLeaderboard, ReportCardCache,
+                    ReportDeduplicator)
+
+
+class StubbedServicesMixin:
+
+    # The shards, when ECOHOTEL_SHARD_DBS configures some, get a test database too. Only the
+    # sharded tests route the energy data to them; the others run on the primary.
+    databases = '__all__'
+    sharded = False
+
+    def setUp(self):
+        services = stubbed_services()
+        services.__enter__()
+        self.addCleanup(services.__exit__, None, None, None)
+        if not self.sharded:
+            unsharded = override_settings(REPORT_SHARDS=[])
+            unsharded.enable()
+            self.addCleanup(unsharded.disable)
+        # On Django 3.2 a SQLite test mirror does not share the transaction of the test,
+        # so the suite always reads from the primary.
+        replica = mock.patch('ecohotel_board.db_routers._replica_alias', return_value=None)
+        replica.start()
+        self.addCleanup(replica.stop)
+
+
+class StubbedServicesTestCase(StubbedServicesMixin, TestCase):
+    pass
+
+
+class GenerateSyntheticDataTest(StubbedServicesTestCase):
+
+    def test_generates_history(self):
+        call_command('generate_synthetic_data', hotels=3, years=0.1,
+                     reports_per_day=2, unanchored=0.5, stdout=StringIO())
+        self.assertEqual(EcoHotel.objects.count(), 3)
+        self.assertEqual(Report.objects.count(), 3 * 36 * 2)
+        self.assertEqual(Report.objects.values('date').distinct().count(), 36)
+        self.assertTrue(Report.objects.filter(txId__isnull=True).exists())
+        self.assertTrue(Report.objects.filter(txId__isnull=False).exists())
+
+    def test_reports_the_stored_reports(self):
+        stdout = StringIO()
+        with mock.patch('random.Random.uniform', return_value=1.0), \
+                mock.patch('random.Random.gauss', return_value=0.0):
+            call_command('generate_synthetic_data', hotels=1, years=0.01, reports_per_day=2,
+                         stdout=stdout)
+        # Both readings of each day are identical, and only one is kept.
+        self.assertEqual(Report.objects.count(), 4)
+        self.assertIn("4 reports (4 identical readings dropped)", stdout.getvalue())
+
+    def test_clear_replaces_previous_dataset(self):
+        call_command('generate_synthetic_data', hotels=2, years=0.01, stdout=StringIO())
+        call_command('generate_synthetic_data', hotels=1, years=0.01, clear=True,
+                     stdout=StringIO())
+        self.assertEqual(EcoHotel.objects.count(), 1)
+
+
+class BackfillAnchorsTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = Path(directory.name) / 'checkpoint.json'
+        call_command('generate_synthetic_data', hotels=2, years=0.05, unanchored=0.5,
+                     end_date=date(2023, 6, 30), stdout=StringIO())
+
+    def _backfill(self, **options):
+        call_command('backfill_anchors', checkpoint=self.checkpoint, rate=1000,
+                     batch_size=5, stdout=StringIO(), stderr=StringIO(), **options)
+
+    def test_anchors_every_report_keeping_its_date(self):
+        dates = dict(Report.objects.values_list('id', 'date'))
+        last_id = Report.objects.unanchored().order_by('id').last().pk
+        self._backfill()
+        self.assertFalse(Report.objects.unanchored().exists())
+        self.assertEqual(dict(Report.objects.values_list('id', 'date')), dates)
+        self.assertEqual(json.loads(self.checkpoint.read_text())['last_id'], last_id)
+
+    def test_resume_skips_processed_reports(self):
+        self._backfill(limit=5)
+        remaining = Report.objects.unanchored().count()
+        self.assertGreater(remaining, 0)
+        self._backfill(resume=True)
+        self.assertFalse(Report.objects.unanchored().exists())
+
+    def test_deletes_duplicate_reports(self):
+        report = Report.objects.unanchored().first()
+        duplicate = Report.objects.create(
+            ecohotel=report.ecohotel, energy_produced=report.energy_produced,
+            energy_consumed=report.energy_consumed)
+        Report.objects.filter(pk=duplicate.pk).update(date=report.date)
+        stdout = StringIO()
+        call_command('backfill_anchors', checkpoint=self.checkpoint, rate=1000,
+                     batch_size=5, stdout=stdout, stderr=StringIO())
+        self.assertFalse(Report.objects.unanchored().exists())
+        self.assertFalse(Report.objects.filter(pk=duplicate.pk).exists())
+        self.assertIn(f"Report {duplicate.pk} duplicates report {report.pk}, deleted.",
+                      stdout.getvalue())
+
+    def test_anchors_through_the_signing_pipeline(self):
+        self._backfill(sign_processes=2)
+        self.assertFalse(Report.objects.unanchored().exists())
+        self.assertEqual(Report.objects.values('txId').distinct().count(),
+                         Report.objects.count())
+
+    def test_aborts_after_consecutive_failures(self):
+        with mock.patch.object(FakeBlockchainWriter, 'send_transaction',
+                               side_effect=ConnectionError('endpoint down')):
+            with self.assertRaises(CommandError):
+                self._backfill(max_failures=5)
+        self.assertTrue(Report.objects.unanchored().exists())
+
+    def test_resume_after_an_abort_retries_the_failed_reports(self):
+        with mock.patch.object(FakeBlockchainWriter, 'send_transaction',
+                               side_effect=ConnectionError('endpoint down')):
+            with self.assertRaises(CommandError):
+                self._backfill(max_failures=5)
+        failed = list(Report.objects.unanchored().order_by('id').values_list('id', flat=True)[:5])
+        checkpoint = json.loads(self.checkpoint.read_text())
+        self.assertEqual(checkpoint, {'last_id': failed[-1], 'failed': failed})
+        self._backfill(resume=True)
+        self.assertFalse(Report.objects.unanchored().exists())
+
+
+class BlockchainWriterTest(TestCase):
+
+    def setUp(self):
+        for name in ('LoadConfiguration', 'Web3'):
+            patcher = mock.patch(f'blockchain.blockchain_writer.{name}')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.writer = BlockchainWriter()
+        self.get_transaction_count = self.writer.w3.eth.get_transaction_count
+        self.get_transaction_count.return_value = 5
+
+    def test_reuses_a_released_nonce_while_others_are_reserved(self):
+        self.assertEqual(self.writer.next_nonce(), 5)
+        self.assertEqual(self.writer.next_nonce(), 6)
+        self.writer.release_nonces([5])
+        self.assertEqual(self.writer.next_nonce(), 5)
+        self.assertEqual(self.writer.next_nonce(), 7)
+        self.assertEqual(self.get_transaction_count.call_count, 1)
+
+    def test_reads_the_nonce_again_once_nothing_is_reserved(self):
+        self.writer.next_nonce()
+        self.writer.consume_nonces([5])
+        self.assertEqual(self.writer.next_nonce(), 6)
+        self.get_transaction_count.return_value = 6
+        self.writer.release_nonces([6])
+        self.assertEqual(self.writer.next_nonce(), 6)
+        self.assertEqual(self.get_transaction_count.call_count, 2)
+
+
+class SigningPipelineTest(TestCase):
+
+    def test_signs_in_nonce_order_and_stops_at_the_first_failure(self):
+        writer = FakeBlockchainWriter()
+        sent = []
+        failure = ConnectionError('endpoint down')
+
+        def send(raw_transaction):
+            if len(sent) == 3:
+                raise failure
+            sent.append(raw_transaction)
+            return f"0x{len(sent)}"
+
+        with mock.patch.object(writer, 'send_raw_transaction', side_effect=send), \
+                SigningPipeline(writer, processes=2, chunk_size=2) as pipeline:
+            results = pipeline.run([f"message {index}" for index in range(6)])
+
+        self.assertEqual(results, ['0x1', '0x2', '0x3', failure, failure, failure])
+        self.assertEqual([rlp.decode(raw)[0] for raw in sent], [b'', b'\x01', b'\x02'])
+        self.assertEqual(pipeline.stats['signing']['items'], 6)
+        self.assertEqual(pipeline.stats['sending']['items'], 3)
+
+
+class BenchmarkHelpersTest(TestCase):
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 95), 95)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_compare_with_baseline(self):
+        baseline = {'homepage': {'queries': 5, 'p95_ms': 10.0, 'peak_memory_kb': 100.0}}
+        within = {'homepage': {'queries': 5, 'p95_ms': 14.0, 'peak_memory_kb': 100.0}}
+        beyond = {'homepage': {'queries': 6, 'p95_ms': 16.0, 'peak_memory_kb': 100.0}}
+        self.assertEqual(compare_with_baseline(within, baseline, 0.5), [])
+        self.assertEqual(len(compare_with_baseline(beyond, baseline, 0.5)), 2)
+
+    def test_compare_with_baseline_scales_the_latency_by_the_calibration(self):
+        baseline = {'homepage': {'queries': 5, 'p95_ms': 10.0, 'peak_memory_kb': 100.0,
+                                 'calibration_ms': 50.0}}
+        slower = {'homepage': {'queries': 5, 'p95_ms': 25.0, 'peak_memory_kb': 100.0,
+                               'calibration_ms': 100.0}}
+        self.assertEqual(compare_with_baseline(slower, baseline, 0.5), [])
+        slower['homepage']['calibration_ms'] = 50.0
+        self.assertEqual(len(compare_with_baseline(slower, baseline, 0.5)), 1)
+
+
+class ViewsTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.hotel = EcoHotel.objects.create(name='Pomelia')
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+
+    def test_create_report_anchors_it(self):
+        response = self.client.post('/create/', {
+            'name': 0, 'energy_produced': 10, 'energy_consumed': 5})
+        self.assertRedirects(response, '/')
+        report = Report.objects.get()
+        self.assertEqual(report.ecohotel, self.hotel)
+        self.assertIsNotNone(report.txId)
+
+    def test_duplicate_report_is_collapsed_before_the_chain(self):
+        data = {'name': 0, 'energy_produced': 10, 'energy_consumed': 5}
+        self.client.post('/create/', data)
+        with mock.patch.object(FakeBlockchainWriter, 'send_transaction') as send:
+            response = self.client.post('/create/', data, follow=True)
+            FakeRedis.flushall()
+            self.client.post('/create/', data)
+        send.assert_not_called()
+        self.assertContains(response, 'already submitted')
+        self.assertEqual(Report.objects.count(), 1)
+
+    def test_failed_transaction_can_be_retried(self):
+        data = {'name': 0, 'energy_produced': 10, 'energy_consumed': 5}
+        with mock.patch.object(FakeBlockchainWriter, 'send_transaction',
+                               side_effect=ConnectionError('endpoint down')):
+            with self.assertRaises(ConnectionError):
+                self.client.post('/create/', data)
+        self.assertIsNone(Report.objects.get().txId)
+        response = self.client.post('/create/', data, follow=True)
+        self.assertNotContains(response, 'already submitted')
+        self.assertIsNotNone(Report.objects.get().txId)
+
+    def test_deleted_report_can_be_submitted_again(self):
+        data = {'name': 0, 'energy_produced': 10, 'energy_consumed': 5}
+        self.client.post('/create/', data)
+        key = f'report_hashes:{date.today().isoformat()}'
+        self.assertEqual(FakeRedis().ttl(key), ReportDeduplicator.TTL)
+        with self.captureOnCommitCallbacks(execute=True):
+            Report.objects.get().delete()
+        self.client.post('/create/', data)
+        self.assertEqual(Report.objects.count(), 1)
+
+    def test_homepage_and_dashboard(self):
+        Report.objects.create(ecohotel=self.hotel, energy_produced=10, energy_consumed=5)
+        self.assertContains(self.client.get('/'), 'Pomelia')
+        self.assertContains(self.client.get('/dashboard/'), '10 Watt')
+
+
+class ArchiveReportsTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        call_command('generate_synthetic_data', hotels=2, years=0.2,
+                     end_date=date(2023, 3, 15), stdout=StringIO())
+        self.statistics = hotel_statistics()
+        self.january = {
+            hotel: [(report.pk, report.date, report.hash, report.txId)
+                    for report in Report.objects.filter(
+                        ecohotel_id=hotel, date__year=2023, date__month=1).order_by('date')]
+            for hotel in self.statistics}
+
+    def test_moves_complete_months_into_segments(self):
+        result = archive_reports(date(2023, 2, 1))
+        self.assertFalse(Report.objects.filter(date__lt=date(2023, 2, 1)).exists())
+        self.assertTrue(Report.objects.filter(date__gte=date(2023, 2, 1)).exists())
+        self.assertEqual(ReportSegment.objects.count(), result['segments'])
+        self.assertEqual(hotel_statistics(), self.statistics)
+
+        for hotel, expected in self.january.items():
+            reports = monthly_reports(hotel, date(2023, 1, 20))
+            self.assertEqual([(report.pk, report.date, report.hash, report.txId)
+                              for report in reports], expected)
+        for segment in ReportSegment.objects.all():
+            self.assertEqual(segment.verify(), [])
+            self.assertEqual(segment.max_report_id, max(report.pk for report in segment.reports()))
+
+    def test_archived_reports_keep_their_derived_data(self):
+        with mock.patch.object(HotelLeaderboard, 'mark_dirty') as mark_dirty, \
+                mock.patch('energy_tracker.signals.drop_cards') as drop_cards, \
+                self.captureOnCommitCallbacks(execute=True):
+            archive_reports(date(2023, 2, 1))
+        mark_dirty.assert_not_called()
+        drop_cards.assert_not_called()
+
+    def test_archive_pages(self):
+        archive_reports(date(2023, 2, 1))
+        User.objects.create_user(username='guest', password='password')
+        self.client.login(username='guest', password='password')
+        self.assertContains(self.client.get('/archive/'), 'January 2023')
+        hotel, reports = next(iter(self.january.items()))
+        response = self.client.get(f'/archive/{hotel}/2023/1/')
+        self.assertEqual(len(response.context['reports']), len(reports))
+        self.assertContains(response, reports[0][3])
+        self.assertEqual(self.client.get(f'/archive/{hotel}/2023/13/').status_code, 404)
+
+    def test_skips_months_with_unanchored_reports(self):
+        Report.objects.filter(date=date(2023, 1, 10)).update(hash=None, txId=None)
+        result = archive_reports(date(2023, 2, 1))
+        self.assertEqual(result['skipped'], 2)
+        self.assertEqual(Report.objects.filter(date__month=1).count(),
+                         sum(len(reports) for reports in self.january.values()))
+        self.assertFalse(ReportSegment.objects.filter(month=date(2023, 1, 1)).exists())
+
+    def test_verify_detects_altered_reports(self):
+        archive_reports(date(2023, 2, 1))
+        segment = ReportSegment.objects.filter(month=date(2023, 1, 1)).first()
+        reports = segment.reports()
+        reports[0].energy_produced += 1
+        altered = ReportSegment.build(segment.ecohotel_id, segment.month, reports)
+        self.assertEqual(altered.verify(), [reports[0].pk])
+
+
+class LeaderboardTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sunny = EcoHotel.objects.create(name='Sunny')
+        self.cloudy = EcoHotel.objects.create(name='Cloudy')
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+
+    def _scores(self, board):
+        return HotelLeaderboard().page(board, 0, 10)[0]
+
+    def test_reports_update_the_boards_incrementally(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Report.objects.create(ecohotel=self.sunny, energy_produced=30, energy_consumed=10)
+            Report.objects.create(ecohotel=self.sunny, energy_produced=20, energy_consumed=10)
+            Report.objects.create(ecohotel=self.cloudy, energy_produced=5, energy_consumed=20)
+        self.assertEqual(self._scores('net_energy'), [(self.sunny.pk, 30), (self.cloudy.pk, -15)])
+        self.assertEqual(self._scores('self_sufficiency'),
+                         [(self.sunny.pk, 2.5), (self.cloudy.pk, 0.25)])
+        self.assertEqual(self._scores('best_day'), [(self.sunny.pk, 50), (self.cloudy.pk, 5)])
+
+        statistics = hotel_statistics()
+        FakeRedis.flushall()
+        rebuild_leaderboards()
+        self.assertEqual(self._scores('best_day'), [(self.sunny.pk, 50), (self.cloudy.pk, 5)])
+        sunny = statistics[self.sunny.pk]
+        self.assertEqual(self._scores('net_energy')[0], (
+            self.sunny.pk, sunny['total_produced'] - sunny['total_consumed']))
+
+    def test_deletions_recompute_the_hotel(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            report = Report.objects.create(
+                ecohotel=self.sunny, energy_produced=30, energy_consumed=10)
+            Report.objects.create(ecohotel=self.cloudy, energy_produced=5, energy_consumed=20)
+        with self.captureOnCommitCallbacks(execute=True):
+            report.delete()
+        self.assertEqual(self._scores('net_energy'), [(self.cloudy.pk, -15)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cloudy.delete()
+        self.assertEqual(self._scores('best_day'), [])
+
+    def test_deleted_reports_are_forgotten_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for energy in (10, 20, 30):
+                Report.objects.create(ecohotel=self.sunny, energy_produced=energy,
+                                      energy_consumed=5)
+        with mock.patch.object(HotelLeaderboard, 'mark_dirty') as mark_dirty, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Report.objects.filter(ecohotel=self.sunny).delete()
+        self.assertEqual(len(callbacks), 1)
+        mark_dirty.assert_called_once_with(self.sunny.pk)
+
+    def test_paginated_view_and_api(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(5):
+                hotel = EcoHotel.objects.create(name=f'Hotel {index}')
+                Report.objects.create(ecohotel=hotel, energy_produced=index, energy_consumed=1)
+        response = self.client.get('/api/leaderboard/', {
+            'board': 'net_energy', 'page': 2, 'per_page': 2, 'hotel': self.sunny.pk})
+        data = response.json()
+        self.assertEqual((data['count'], data['pages']), (5, 3))
+        self.assertEqual([entry['rank'] for entry in data['results']], [3, 4])
+        self.assertEqual([entry['name'] for entry in data['results']], ['Hotel 2', 'Hotel 1'])
+        self.assertIsNone(data['hotel']['rank'])
+        self.assertEqual(self.client.get('/api/leaderboard/', {'board': 'nope'}).status_code, 404)
+        self.assertContains(self.client.get('/leaderboard/'), 'Hotel 4')
+
+
+class CarbonFootprintTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factors = EmissionFactors([
+            ('IT', '2023-01-01', 300.0), ('IT', '2023-02-01', 200.0),
+            ('IT-SARD', '2023-01-01', 500.0),
+        ], version='test')
+        self.north = EcoHotel.objects.create(name='North')
+        self.island = EcoHotel.objects.create(name='Island', region='IT-SARD')
+        for hotel, day, produced, consumed in [
+                (self.north, date(2023, 1, 31), 4000, 10000),
+                (self.north, date(2023, 2, 1), 12000, 10000),
+                (self.island, date(2023, 1, 15), 1000, 3000)]:
+            report = Report.objects.create(
+                ecohotel=hotel, energy_produced=produced, energy_consumed=consumed)
+            # update() bypasses auto_now.
+            Report.objects.filter(pk=report.pk).update(date=day)
+
+    def test_applies_the_factor_of_the_region_and_day(self):
+        footprints = hotel_footprints(factors=self.factors)
+        # 6 kWh drawn at 300 g/kWh; 4 kWh at 300 g/kWh and 12 kWh at 200 g/kWh produced.
+        self.assertEqual(footprints[self.north.pk], {'co2_emitted': 1.8, 'co2_avoided': 3.6})
+        self.assertEqual(footprints[self.island.pk], {'co2_emitted': 1.0, 'co2_avoided': 0.5})
+
+    def test_footprints_are_cached_until_the_reports_change(self):
+        ids = [self.north.pk, self.island.pk]
+        first = cached_hotel_footprints(ids)
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_hotel_footprints(ids), first)
+        with self.captureOnCommitCallbacks(execute=True):
+            Report.objects.create(ecohotel=self.island, energy_produced=1000, energy_consumed=0)
+        with self.assertNumQueries(3):
+            second = cached_hotel_footprints(ids)
+        self.assertEqual(second[self.north.pk], first[self.north.pk])
+        self.assertGreater(second[self.island.pk]['co2_avoided'],
+                           first[self.island.pk]['co2_avoided'])
+
+    def test_table_is_read_again_only_when_the_file_changes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'factors.csv'
+        path.write_text("region,valid_from,g_co2_per_kwh\nIT,2023-01-01,300\n")
+        first = EmissionFactors.load(path)
+        with mock.patch.object(Path, 'read_bytes') as read_bytes:
+            self.assertIs(EmissionFactors.load(path), first)
+        read_bytes.assert_not_called()
+        path.write_text("region,valid_from,g_co2_per_kwh\nIT,2023-01-01,25\n")
+        self.assertNotEqual(EmissionFactors.load(path).version, first.version)
+
+    def test_region_is_edited_in_the_admin(self):
+        User.objects.create_superuser(username='admin', password='password')
+        self.client.login(username='admin', password='password')
+        url = f'/admin/energy_tracker/ecohotel/{self.north.pk}/change/'
+        self.assertEqual(self.client.post(url, {'name': 'North', 'region': 'XX'}).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'name': 'North', 'region': 'IT-NORD'})
+        self.assertEqual(response.status_code, 302)
+        self.north.refresh_from_db()
+        self.assertEqual(self.north.region, 'IT-NORD')
+
+    def test_dashboard_shows_the_footprint(self):
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        self.assertContains(self.client.get('/dashboard/'), 'CO2 Avoided')
+
+
+class ComparisonTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        call_command('generate_synthetic_data', hotels=2, years=1.2,
+                     end_date=date(2023, 3, 31), stdout=StringIO())
+        self.hotels = list(EcoHotel.objects.values_list('pk', flat=True))
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+
+    def test_comparison_ranges(self):
+        self.assertEqual(comparison_range(date(2023, 3, 1), date(2023, 3, 31), 'previous'),
+                         (date(2023, 2, 1), date(2023, 2, 28)))
+        self.assertEqual(comparison_range(date(2023, 3, 10), date(2023, 3, 16), 'previous'),
+                         (date(2023, 3, 3), date(2023, 3, 9)))
+        self.assertEqual(comparison_range(date(2024, 2, 29), date(2024, 3, 1), 'year'),
+                         (date(2023, 2, 28), date(2023, 3, 1)))
+
+    def test_series_match_across_granularities_and_archive(self):
+        start, end = date(2022, 11, 15), date(2023, 2, 20)
+        daily = energy_series(None, start, end, 'day')
+        self.assertEqual(len(daily), (end - start).days + 1)
+        totals = (sum(point[1] for point in daily), sum(point[2] for point in daily))
+        for granularity in ('week', 'month'):
+            series = energy_series(None, start, end, granularity)
+            self.assertEqual((sum(point[1] for point in series),
+                              sum(point[2] for point in series)), totals)
+        monthly = energy_series(None, start, end, 'month')
+        archive_reports(date(2023, 2, 1))
+        self.assertEqual(energy_series(None, start, end, 'month'), monthly)
+        self.assertEqual(energy_series(None, start, end, 'day'), daily)
+
+    def test_api_returns_series_and_deltas_from_bounded_queries(self):
+        params = {'hotels': self.hotels[:1], 'start': '2023-03-01', 'end': '2023-03-31',
+                  'granularity': 'week', 'compare': 'previous'}
+        with self.assertNumQueries(7):
+            data = self.client.get('/api/comparison/', params).json()
+        self.assertEqual(data['previous_start'], '2023-02-01')
+        self.assertEqual(len(data['series']), 5)
+        self.assertEqual(data['deltas']['produced']['absolute'],
+                         data['totals']['produced'] - data['previous_totals']['produced'])
+
+        cached = self.client.get('/api/comparison/', params)
+        self.assertEqual(cached.json(), data)
+        with self.captureOnCommitCallbacks(execute=True):
+            report = Report.objects.create(
+                ecohotel_id=self.hotels[0], energy_produced=1, energy_consumed=1)
+        Report.objects.filter(pk=report.pk).update(date=date(2023, 3, 15))
+        self.assertNotEqual(self.client.get('/api/comparison/', params).json()['totals'],
+                            data['totals'])
+
+        invalid = self.client.get('/api/comparison/', {**params, 'end': '2023-02-01'})
+        self.assertEqual(invalid.status_code, 400)
+        self.assertContains(self.client.get('/comparison/', params), 'Energy Produced')
+
+
+class ReportCardTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.hotel = EcoHotel.objects.create(name='Pomelia')
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+
+    def _cached(self, report):
+        return ReportCardCache().get_many(card_template_version(), [report.pk])
+
+    def test_card_is_rendered_when_the_report_is_saved(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            report = Report.objects.create(
+                ecohotel=self.hotel, energy_produced=10, energy_consumed=5)
+        self.assertIn('10 Watt', self._cached(report)[report.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            report.hash = 'f' * 64
+            report.save(update_fields=['hash'])
+        self.assertIn('f' * 64, self._cached(report)[report.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            report.delete()
+        self.assertEqual(self._cached(report), {})
+
+    def test_renaming_the_hotel_renders_its_cards_again(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            report = Report.objects.create(
+                ecohotel=self.hotel, energy_produced=10, energy_consumed=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hotel.region = 'IT-NORD'
+            self.hotel.save()
+        self.assertIn('Pomelia', self._cached(report)[report.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hotel.name = 'Pomelia Resort'
+            self.hotel.save()
+        self.assertEqual(self._cached(report), {})
+        self.assertContains(self.client.get('/'), 'Pomelia Resort')
+
+    def test_homepage_stitches_the_cached_cards(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for produced in (10, 20, 30):
+                Report.objects.create(ecohotel=self.hotel, energy_produced=produced,
+                                      energy_consumed=15)
+        with mock.patch('energy_tracker.cards.render_card') as render_card:
+            response = self.client.get('/')
+        render_card.assert_not_called()
+        self.assertContains(response, 'class="card"', count=3)
+
+        FakeRedis.flushall()
+        self.assertContains(self.client.get('/'), 'class="card"', count=3)
+        self.assertEqual(len(ReportCardCache().get_many(
+            card_template_version(), list(Report.objects.values_list('pk', flat=True)))), 3)
+
+    def test_homepage_shows_a_page_of_cards(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for produced in (10, 20, 30):
+                Report.objects.create(ecohotel=self.hotel, energy_produced=produced,
+                                      energy_consumed=15)
+        with mock.patch.object(views.EnergyReportListView, 'cards_per_page', 2):
+            first = self.client.get('/')
+            second = self.client.get('/', {'page': 2})
+            self.assertEqual(self.client.get('/', {'page': 0}).status_code, 404)
+        self.assertContains(first, 'class="card"', count=2)
+        self.assertContains(first, '30 Watt')
+        self.assertContains(first, 'href="?page=2"')
+        self.assertContains(second, 'class="card"', count=1)
+        self.assertContains(second, '10 Watt')
+        self.assertNotContains(second, 'href="?page=3"')
+
+    def test_card_template_version_follows_the_template_with_debug(self):
+        self.addCleanup(cards._card_template_version.cache_clear)
+        version = card_template_version()
+        with mock.patch('energy_tracker.cards.get_template') as get_template:
+            get_template.return_value.template.source = 'changed'
+            self.assertEqual(card_template_version(), version)
+            with override_settings(DEBUG=True):
+                self.assertNotEqual(card_template_version(), version)
+
+
+class ConditionalGetTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hotel = EcoHotel.objects.create(name='Pomelia')
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in ('/', '/dashboard/'):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(2):  # session and user of the request
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_new_report_changes_the_etag(self):
+        etag = self.client.get('/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Report.objects.create(ecohotel=self.hotel, energy_produced=10, energy_consumed=5)
+            self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertTrue(callbacks)
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_the_user(self):
+        etag = self.client.get('/')['ETag']
+        User.objects.create_user(username='guest', password='password')
+        self.client.login(username='guest', password='password')
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_the_templates(self):
+        etag = self.client.get('/')['ETag']
+        self.addCleanup(views._release_version.cache_clear)
+        views._release_version.cache_clear()
+        with mock.patch('energy_tracker.views.card_template_version', return_value='changed'):
+            response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class DashboardStreamTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.hotel = EcoHotel.objects.create(name='Pomelia')
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+
+    def test_report_publishes_deltas(self):
+        subscription = DashboardChannel().subscribe()
+        self.addCleanup(subscription.close)
+        Report.objects.create(ecohotel=self.hotel, energy_produced=10, energy_consumed=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            report = Report.objects.create(
+                ecohotel=self.hotel, energy_produced=7, energy_consumed=3)
+            report.txId = '0x1'
+            report.save(update_fields=['txId'])
+
+        created = json.loads(subscription.get_message()['data'])
+        self.assertEqual(created['event'], 'created')
+        self.assertEqual(created['energy_produced'], 7)
+        self.assertEqual(created['day_produced'], 17)
+        self.assertEqual(created['co2_emitted'], 0.0)
+        self.assertGreater(created['co2_avoided'], 0)
+        anchored = json.loads(subscription.get_message()['data'])
+        self.assertEqual(anchored, {'event': 'anchored', 'hotel': self.hotel.pk,
+                                    'report': report.pk, 'txId': '0x1',
+                                    'version': created['version'] + 1})
+
+    def test_page_and_deltas_carry_the_data_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Report.objects.create(ecohotel=self.hotel, energy_produced=10, energy_consumed=5)
+        version, _ = DataVersion().current()
+        self.assertContains(self.client.get('/dashboard/'), f"let version = {version};")
+
+        subscription = DashboardChannel().subscribe()
+        self.addCleanup(subscription.close)
+        with self.captureOnCommitCallbacks(execute=True):
+            report = Report.objects.create(
+                ecohotel=self.hotel, energy_produced=7, energy_consumed=3)
+            # An edit is not broadcast, but still takes a version: the dashboards see the gap.
+            report.energy_produced = 8
+            report.save()
+            Report.objects.create(ecohotel=self.hotel, energy_produced=1, energy_consumed=1)
+        versions = [json.loads(subscription.get_message()['data'])['version'] for _ in range(2)]
+        self.assertEqual(versions, [version + 1, version + 3])
+
+    def test_stream_pushes_events(self):
+        response = self.client.get('/dashboard/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = iter(response.streaming_content)
+        self.assertTrue(next(events).startswith(b'retry:'))
+        DashboardChannel().publish({'event': 'created', 'hotel': self.hotel.pk})
+        self.assertIn(b'"hotel": %d' % self.hotel.pk, next(events))
+        response.close()
+
+    def test_stream_asks_to_retry_without_redis(self):
+        with mock.patch.object(FakeRedis, 'pubsub', side_effect=redis.exceptions.ConnectionError):
+            response = self.client.get('/dashboard/stream/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '15')
+
+    def test_stream_is_reserved_to_staff(self):
+        User.objects.create_user(username='guest', password='password')
+        self.client.login(username='guest', password='password')
+        self.assertEqual(self.client.get('/dashboard/stream/').status_code, 403)
+
+
+@mock.patch('ecohotel_board.db_routers._replica_alias', return_value='replica')
+class ReplicaRouterTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.router = db_routers.ReplicaRouter()
+        db_routers._state.pinned = False
+
+    def test_only_marked_energy_reads_go_to_the_replica(self, _):
+        self.assertIsNone(self.router.db_for_read(Report))
+        with db_routers.read_from_replica():
+            self.assertEqual(self.router.db_for_read(Report), 'replica')
+            self.assertIsNone(self.router.db_for_read(User))
+
+    def test_write_pins_to_the_primary(self, _):
+        self.assertEqual(self.router.db_for_write(Report), 'default')
+        with db_routers.read_from_replica():
+            self.assertIsNone(self.router.db_for_read(Report))
+
+    def test_session_and_login_writes_do_not_pin(self, _):
+        self.assertEqual(self.router.db_for_write(User), 'default')
+        self.assertFalse(db_routers._state.pinned)
+        User.objects.create_user(username='guest', password='password')
+        response = self.client.post('/accounts/login/', {
+            'username': 'guest', 'password': 'password'})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(db_routers.PIN_COOKIE, response.cookies)
+
+    def test_validators_wait_for_the_replica_to_catch_up(self, _):
+        DataVersion().bump()
+        with db_routers.read_from_replica():
+            self.assertEqual(views._data_version(RequestFactory().get('/')), (None, None))
+            with override_settings(REPLICA_STICKY_SECONDS=0):
+                self.assertIsNotNone(views._data_version(RequestFactory().get('/'))[0])
+            db_routers._state.pinned = True
+            self.assertIsNotNone(views._data_version(RequestFactory().get('/'))[0])
+
+    def test_client_stays_on_the_primary_after_a_write(self, _):
+        EcoHotel.objects.create(name='Pomelia')
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        response = self.client.post('/create/', {
+            'name': 0, 'energy_produced': 10, 'energy_consumed': 5})
+        self.assertIn(db_routers.PIN_COOKIE, response.cookies)
+
+        pinned = []
+
+        def db_for_read(router, model, **hints):
+            pinned.append(db_routers._state.pinned)
+
+        with mock.patch.object(db_routers.ReplicaRouter, 'db_for_read', db_for_read):
+            self.client.get('/dashboard/')
+            self.assertTrue(pinned and all(pinned))
+            pinned.clear()
+            self.client.cookies.pop(db_routers.PIN_COOKIE)
+            self.client.get('/dashboard/')
+            self.assertFalse(any(pinned))
+
+
+class StaticFilesTest(StubbedServicesTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.static_root = override_settings(STATIC_ROOT=cls.directory.name)
+        cls.static_root.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.original = (Path(__file__).resolve().parent.parent
+                        / 'static-storage' / 'css' / 'style.css').read_bytes()
+        cls.url = staticfiles_storage.url('css/style.css')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.static_root.disable()
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def test_pages_link_the_fingerprinted_files(self):
+        self.assertRegex(self.url, r'^/static/css/style\.[0-9a-f]{12}\.css$')
+        self.assertContains(self.client.get('/accounts/login/'), self.url)
+
+    def test_serves_the_precompressed_variant(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Content-Type'], 'text/css')
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.original)
+
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), self.original)
+
+    def test_fingerprinted_names_are_read_once_per_manifest(self):
+        names = staticfiles_storage.fingerprinted_names
+        self.assertIn(self.url[len(settings.STATIC_URL):], names)
+        self.client.get(self.url)
+        self.assertIs(staticfiles_storage.fingerprinted_names, names)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.assertIsNot(staticfiles_storage.fingerprinted_names, names)
+
+    def test_plain_names_are_revalidated(self):
+        response = self.client.get('/static/css/style.css')
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+        revalidated = self.client.get('/static/css/style.css',
+                                      HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(self.client.get('/static/../manage.py').status_code, 400)
+        self.assertEqual(self.client.get('/static/css/missing.css').status_code, 404)
+
+
+@mock.patch('energy_tracker.sharding.shard_aliases', return_value=['shard_0', 'shard_1'])
+@mock.patch('ecohotel_board.db_routers.shard_aliases', return_value=['shard_0', 'shard_1'])
+class ShardRouterTest(StubbedServicesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.router = db_routers.ShardRouter()
+
+    def test_adding_a_shard_only_moves_hotels_to_it(self, *_):
+        before = {pk: db_routers.shard_for_hotel(pk, ['shard_0', 'shard_1', 'shard_2'])
+                  for pk in range(1, 1001)}
+        after = {pk: db_routers.shard_for_hotel(pk, ['shard_0', 'shard_1', 'shard_2', 'shard_3'])
+                 for pk in range(1, 1001)}
+        moved = [pk for pk in before if before[pk] != after[pk]]
+        self.assertTrue(all(after[pk] == 'shard_3' for pk in moved))
+        self.assertTrue(150 < len(moved) < 350)
+
+    def test_routes_the_reports_by_hotel(self, *_):
+        report = Report(ecohotel_id=7)
+        home = db_routers.shard_for_hotel(7)
+        self.assertEqual(self.router.db_for_write(Report, instance=report), home)
+        self.assertEqual(self.router.db_for_read(Report, instance=EcoHotel(pk=7)), home)
+        with self.assertRaises(RuntimeError):
+            self.router.db_for_read(Report)
+        with self.assertRaises(RuntimeError):
+            self.router.db_for_read(ReportSegment, instance=EcoHotel())
+        self.assertIsNone(self.router.db_for_write(EcoHotel, instance=EcoHotel(pk=7)))
+        self.assertIsNone(self.router.db_for_read(User))
+        with db_routers.use_shard('shard_1'):
+            self.assertEqual(self.router.db_for_read(Report), 'shard_1')
+            self.assertEqual(self.router.db_for_read(EcoHotel), 'shard_1')
+            self.assertIsNone(self.router.db_for_write(EcoHotel))
+
+    def test_writes_to_a_shard_pin_to_the_primary(self, *_):
+        db_routers._state.pinned = False
+        self.addCleanup(setattr, db_routers._state, 'pinned', False)
+        self.addCleanup(setattr, db_routers._state, 'wrote', False)
+        self.router.db_for_write(Report, instance=Report(ecohotel_id=7))
+        self.assertTrue(db_routers._state.pinned)
+
+    def test_shards_only_hold_the_energy_data(self, *_):
+        self.assertTrue(self.router.allow_migrate('shard_0', 'energy_tracker', 'report'))
+        self.assertTrue(self.router.allow_migrate('shard_0', 'energy_tracker', 'ecohotel'))
+        self.assertFalse(self.router.allow_migrate('shard_0', 'energy_tracker', 'idsequence'))
+        self.assertFalse(self.router.allow_migrate('shard_0', 'auth', 'user'))
+        self.assertIsNone(self.router.allow_migrate('default', 'auth', 'user'))
+
+    def test_fan_out_runs_each_shard_with_its_hotels(self, *_):
+        results = sharding.fan_out(
+            lambda ids: (db_routers.current_shard(), threading.current_thread(), ids),
+            range(1, 21))
+        self.assertEqual(len(results), 2)
+        self.assertEqual(sorted(pk for _, _, ids in results for pk in ids), list(range(1, 21)))
+        for shard, thread, ids in results:
+            self.assertTrue(all(db_routers.shard_for_hotel(pk) == shard for pk in ids))
+            self.assertIsNot(thread, threading.current_thread())
+        self.assertIsNone(db_routers.current_shard())
+
+    def test_router_is_inactive_without_shards(self, routers_aliases, sharding_aliases):
+        routers_aliases.return_value = sharding_aliases.return_value = []
+        self.assertIsNone(self.router.db_for_write(Report, instance=Report(ecohotel_id=7)))
+        self.assertEqual(db_routers.shard_for_hotel(7), 'default')
+        self.assertEqual(sharding.fan_out(lambda ids: (db_routers.current_shard(), ids), [7]),
+                         [(None, [7])])
+
+
+@skipUnless(len(settings.REPORT_SHARDS) > 1,
+            "Set ECOHOTEL_SHARD_DBS to at least two databases to run the sharded tests.")
+class ShardedDatabaseTest(StubbedServicesMixin, TransactionTestCase):
+
+    sharded = True
+
+    def setUp(self):
+        super().setUp()
+        # The ids reserved by the previous tests were flushed with their counter.
+        sharding._id_blocks.clear()
+        self.hotels = [EcoHotel.objects.create(name=f'Hotel {index}') for index in range(8)]
+        self.shards = {hotel.pk: db_routers.shard_for_hotel(hotel.pk) for hotel in self.hotels}
+        self.assertEqual(len(set(self.shards.values())), len(settings.REPORT_SHARDS))
+
+    def test_reports_live_on_the_shard_of_their_hotel(self):
+        for hotel in self.hotels:
+            Report.objects.create(ecohotel=hotel, energy_produced=hotel.pk, energy_consumed=1)
+        self.assertFalse(Report.objects.using('default').exists())
+        report_ids = set()
+        for alias in settings.REPORT_SHARDS:
+            self.assertEqual(EcoHotel.objects.using(alias).count(), len(self.hotels))
+            reports = Report.objects.using(alias)
+            self.assertEqual(set(reports.values_list('ecohotel_id', flat=True)),
+                             {pk for pk, shard in self.shards.items() if shard == alias})
+            report_ids.update(reports.values_list('pk', flat=True))
+        self.assertEqual(len(report_ids), len(self.hotels))
+
+        ecohotel_id = self.hotels[0].pk
+        self.hotels[0].delete()
+        self.assertFalse(Report.objects.using(self.shards[ecohotel_id]).filter(
+            ecohotel_id=ecohotel_id).exists())
+        self.assertFalse(any(EcoHotel.objects.using(alias).filter(pk=ecohotel_id).exists()
+                             for alias in settings.REPORT_SHARDS))
+
+    def test_pages_merge_the_shards(self):
+        for hotel in self.hotels:
+            Report.objects.create(ecohotel=hotel, energy_produced=10, energy_consumed=4)
+        statistics = hotel_statistics()
+        self.assertEqual(set(statistics), set(self.shards))
+        self.assertTrue(all(hotel['total_produced'] == 10 for hotel in statistics.values()))
+        self.assertEqual(energy_series(None, date.today(), date.today(), 'day'),
+                         [(date.today(), 80, 32)])
+        self.assertEqual(set(hotel_footprints()), set(self.shards))
+
+        User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        dashboard = self.client.get('/dashboard/')
+        self.assertContains(dashboard, 'data-field="total_produced" data-value="10"',
+                            count=len(self.hotels))
+        homepage = self.client.get('/')
+        for hotel in self.hotels:
+            self.assertContains(dashboard, hotel.name)
+            self.assertContains(homepage, hotel.name)
+
+    def test_rebalance_moves_the_data_to_the_shard_of_each_hotel(self):
+        with sharding.disabled_auto_now():
+            Report.objects.using('default').bulk_create([
+                Report(pk=index + 1, ecohotel=hotel, date=date(2023, 1, 2),
+                       energy_produced=5, energy_consumed=2)
+                for index, hotel in enumerate(self.hotels)])
+        archived = Report(pk=100, ecohotel=self.hotels[0], date=date(2022, 1, 3),
+                          energy_produced=7, energy_consumed=1, hash='h', txId='t')
+        ReportSegment.build(self.hotels[0].pk, date(2022, 1, 1), [archived]).save(using='default')
+
+        output = StringIO()
+        call_command('rebalance_shards', dry_run=True, stdout=output)
+        self.assertIn(f"{len(self.hotels)} hotels to move", output.getvalue())
+        self.assertEqual(Report.objects.using('default').count(), len(self.hotels))
+
+        call_command('rebalance_shards', batch_size=3, stdout=StringIO())
+        self.assertFalse(Report.objects.using('default').exists())
+        self.assertFalse(ReportSegment.objects.using('default').exists())
+        self.assertEqual(sharding.misplaced_hotels(), [])
+        for index, hotel in enumerate(self.hotels):
+            report = Report.objects.using(self.shards[hotel.pk]).get(ecohotel=hotel)
+            self.assertEqual((report.pk, report.date), (index + 1, date(2023, 1, 2)))
+        segment = ReportSegment.objects.using(self.shards[self.hotels[0].pk]).get()
+        self.assertEqual([report.pk for report in segment.reports()], [100])
+        self.assertEqual(hotel_statistics()[self.hotels[0].pk]['total_produced'], 12)
+
+        # The counter of the ids starts after the moved reports.
+        self.assertGreater(Report.objects.create(ecohotel=self.hotels[1]).pk, 100)
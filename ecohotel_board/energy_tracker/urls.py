@@ -7,13 +7,30 @@ URL Patterns:
     - '' (empty string): Maps to the EnergyReportListView view, displaying the home page.
     - 'create/': Maps to the CreateReportView view, allowing users to create new energy reports.
     - 'dashboard/': Maps to the DashboardView view, providing a dashboard for energy report statistics.
+    - 'dashboard/stream/': Maps to the DashboardStreamView view, pushing live updates to the dashboard.
+    - 'leaderboard/': Maps to the LeaderboardView view, ranking the hotels.
+    - 'api/leaderboard/': Maps to the LeaderboardApiView view, serving the rankings as JSON.
+    - 'comparison/': Maps to the ComparisonView view, comparing the energy of two periods.
+    - 'api/comparison/': Maps to the ComparisonApiView view, serving the comparisons as JSON.
+    - 'archive/': Maps to the ArchiveView view, listing the archived months.
+    - 'archive/<hotel>/<year>/<month>/': Maps to the ArchiveView view, showing the reports of a month.
 """
 
 from django.urls import path
-from .views import EnergyReportListView, CreateReportView, DashboardView
+from .views import (EnergyReportListView, CreateReportView, DashboardView, DashboardStreamView,
+                    LeaderboardView, LeaderboardApiView, ComparisonView, ComparisonApiView,
+                    ArchiveView)
 
 urlpatterns = [
     path('', EnergyReportListView.as_view(), name='home'),
     path('create/', CreateReportView.as_view(), name='create_report'),
-    path('dashboard/', DashboardView.as_view(), name='dashboard_view')
+    path('dashboard/', DashboardView.as_view(), name='dashboard_view'),
+    path('dashboard/stream/', DashboardStreamView.as_view(), name='dashboard_stream'),
+    path('leaderboard/', LeaderboardView.as_view(), name='leaderboard_view'),
+    path('api/leaderboard/', LeaderboardApiView.as_view(), name='leaderboard_api'),
+    path('comparison/', ComparisonView.as_view(), name='comparison_view'),
+    path('api/comparison/', ComparisonApiView.as_view(), name='comparison_api'),
+    path('archive/', ArchiveView.as_view(), name='archive_view'),
+    path('archive/<int:ecohotel_id>/<int:year>/<int:month>/', ArchiveView.as_view(),
+         name='archive_month'),
 ]
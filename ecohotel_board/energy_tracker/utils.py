@@ -0,0 +1,666 @@
+"""
+Module: utils
+
+This module contains utility functionality to the application that manages the energy reports.
+
+Classes:
+- ReportDeduplicator: Class for detecting the reports that were already submitted.
+- DataVersion: Class for tracking the version of the energy data.
+- DashboardChannel: Class for broadcasting the changes of the energy data to the dashboards.
+- HotelLeaderboard: Class for ranking the hotels in Redis sorted sets.
+- CarbonFootprintCache: Class for caching the carbon footprint of the hotels.
+- ComparisonCache: Class for caching the responses of the period comparisons.
+- ReportCardCache: Class for caching the rendered cards of the reports.
+
+"""
+import datetime
+import hashlib
+import json
+import time
+from django.conf import settings
+import redis
+
+
+class ReportDeduplicator:
+    """ReportDeduplicator class.
+
+    This class keeps the hashes of the submitted reports in Redis, so a repeated
+    submission (a double click or a retry of the form) is detected before touching the database
+    or the blockchain. The hash of a report covers its day, so the hashes are kept in one set
+    per day that expires after `TTL` seconds, and a deleted report is forgotten. The sets are
+    only a fast path: the unique index on `Report.hash` remains the authoritative check.
+
+    Attributes:
+        KEY_PREFIX (str): The prefix of the Redis keys of the daily sets of hashes.
+        TTL (int): Seconds during which the hashes of a day are kept.
+        redis_conn (redis.Redis): Redis connection object.
+    """
+
+    KEY_PREFIX = 'report_hashes:'
+    TTL = 2 * 24 * 60 * 60
+
+    def __init__(self) -> None:
+        """
+        Initialize the ReportDeduplicator instance.
+
+        It establishes a connection to the Redis server using the provided host and port settings.
+
+        """
+        self.redis_conn = redis.Redis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+
+    def _key(self, day):
+        """
+        Build the key of the set of a day.
+
+        Args:
+            day (date): The day of the reports, today if None.
+
+        Returns:
+            str: The Redis key.
+
+        """
+        return f"{self.KEY_PREFIX}{(day or datetime.date.today()).isoformat()}"
+
+    def seen(self, report_hash, day=None):
+        """
+        Check if a report with the given hash was already submitted.
+
+        Args:
+            report_hash (str): The canonical hash of the report.
+            day (date): The day of the report, today by default.
+
+        Returns:
+            bool: True if the hash is known, False if it is unknown or Redis is unreachable.
+
+        """
+        try:
+            return bool(self.redis_conn.sismember(self._key(day), report_hash))
+        except redis.exceptions.RedisError:
+            return False
+
+    def remember(self, report_hash, day=None):
+        """
+        Record the hash of a submitted report.
+
+        Args:
+            report_hash (str): The canonical hash of the report.
+            day (date): The day of the report, today by default.
+
+        """
+        key = self._key(day)
+        try:
+            pipeline = self.redis_conn.pipeline()
+            pipeline.sadd(key, report_hash)
+            pipeline.expire(key, self.TTL)
+            pipeline.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+    def forget_many(self, hashes):
+        """
+        Forget the hashes of deleted reports, so the reports can be submitted again.
+
+        Args:
+            hashes (list): The canonical hash and the day of each report.
+
+        """
+        try:
+            pipeline = self.redis_conn.pipeline()
+            for report_hash, day in hashes:
+                pipeline.srem(self._key(day), report_hash)
+            pipeline.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+
+class DataVersion:
+    """DataVersion class.
+
+    This class tracks a global version of the energy data in Redis. The version is bumped every
+    time a hotel or a report changes, so the pages that show the data can be validated with a
+    single Redis lookup instead of running their queries.
+
+    Attributes:
+        VERSION_KEY (str): The Redis key of the version counter.
+        MODIFIED_KEY (str): The Redis key of the timestamp of the last change.
+        redis_conn (redis.Redis): Redis connection object.
+    """
+
+    VERSION_KEY = 'reports:version'
+    MODIFIED_KEY = 'reports:last_modified'
+
+    def __init__(self) -> None:
+        """
+        Initialize the DataVersion instance.
+
+        It establishes a connection to the Redis server using the provided host and port settings.
+
+        """
+        self.redis_conn = redis.Redis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+
+    def bump(self):
+        """
+        Record a change of the energy data.
+
+        Returns:
+            int: The new version, None if Redis is unreachable.
+
+        """
+        try:
+            version = self.redis_conn.incr(self.VERSION_KEY)
+            self.redis_conn.set(self.MODIFIED_KEY, time.time())
+        except redis.exceptions.RedisError:
+            return None
+        return version
+
+    def current(self):
+        """
+        Get the current version of the energy data.
+
+        Returns:
+            tuple: The version counter and the timestamp of the last change,
+                (None, None) if they are unknown or Redis is unreachable.
+
+        """
+        try:
+            version, modified = self.redis_conn.mget(self.VERSION_KEY, self.MODIFIED_KEY)
+        except redis.exceptions.RedisError:
+            return None, None
+        if version is None or modified is None:
+            return None, None
+        return int(version), float(modified)
+
+
+class DashboardChannel:
+    """DashboardChannel class.
+
+    This class broadcasts the incremental changes of the energy data through Redis pub/sub,
+    so every worker process can push them to the dashboards it serves.
+
+    Attributes:
+        CHANNEL (str): The Redis pub/sub channel.
+        redis_conn (redis.Redis): Redis connection object.
+    """
+
+    CHANNEL = 'dashboard:updates'
+
+    def __init__(self) -> None:
+        """
+        Initialize the DashboardChannel instance.
+
+        It establishes a connection to the Redis server using the provided host and port settings.
+
+        """
+        self.redis_conn = redis.Redis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+
+    def publish(self, delta):
+        """
+        Broadcast a change to the dashboards.
+
+        Args:
+            delta (dict): The change, serializable to JSON.
+
+        """
+        try:
+            self.redis_conn.publish(self.CHANNEL, json.dumps(delta, default=str))
+        except redis.exceptions.RedisError:
+            pass
+
+    def subscribe(self):
+        """
+        Subscribe to the changes.
+
+        Returns:
+            redis.client.PubSub: The subscription, to be closed by the caller.
+
+        """
+        pubsub = self.redis_conn.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.CHANNEL)
+        return pubsub
+
+
+class HotelLeaderboard:
+    """HotelLeaderboard class.
+
+    This class ranks the hotels in Redis sorted sets, one for each board, so the top hotels
+    and the rank of a hotel are read in O(log n) without touching the reports. A new report
+    updates the boards incrementally; any other change marks its hotel as dirty, and the
+    dirty hotels are recomputed from the database.
+
+    Attributes:
+        BOARDS (dict): The title of each board.
+        TOTALS_KEY (str): The Redis key of the hash of the energy totals of each hotel.
+        DIRTY_KEY (str): The Redis key of the set of the hotels to recompute.
+        redis_conn (redis.Redis): Redis connection object.
+    """
+
+    BOARDS = {
+        'net_energy': 'Net energy (produced - consumed)',
+        'self_sufficiency': 'Self-sufficiency (produced / consumed)',
+        'best_day': 'Best day output',
+    }
+    TOTALS_KEY = 'leaderboard:totals'
+    DIRTY_KEY = 'leaderboard:dirty'
+
+    def __init__(self) -> None:
+        """
+        Initialize the HotelLeaderboard instance.
+
+        It establishes a connection to the Redis server using the provided host and port settings.
+
+        """
+        self.redis_conn = redis.Redis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+
+    @staticmethod
+    def key(board):
+        """
+        Get the Redis key of a board.
+
+        Args:
+            board (str): The name of the board.
+
+        Returns:
+            str: The key of the sorted set.
+
+        """
+        return f"leaderboard:{board}"
+
+    def add_report(self, ecohotel_id, energy_produced, energy_consumed, day_produced):
+        """
+        Update the boards with a new report.
+
+        Args:
+            ecohotel_id (int): The id of the hotel of the report.
+            energy_produced (int): The energy produced in the report.
+            energy_consumed (int): The energy consumed in the report.
+            day_produced (int): The energy produced by the hotel in the day of the report.
+
+        """
+        try:
+            pipe = self.redis_conn.pipeline()
+            pipe.zincrby(self.key('net_energy'), energy_produced - energy_consumed, ecohotel_id)
+            pipe.hincrby(self.TOTALS_KEY, f"{ecohotel_id}:produced", energy_produced)
+            pipe.hincrby(self.TOTALS_KEY, f"{ecohotel_id}:consumed", energy_consumed)
+            pipe.zadd(self.key('best_day'), {ecohotel_id: day_produced}, gt=True)
+            _, produced, consumed, _ = pipe.execute()
+            if consumed:
+                self.redis_conn.zadd(self.key('self_sufficiency'),
+                                     {ecohotel_id: produced / consumed})
+        except redis.exceptions.RedisError:
+            pass
+
+    def mark_dirty(self, *ecohotel_ids):
+        """
+        Mark hotels to be recomputed from the database.
+
+        Args:
+            *ecohotel_ids (int): The ids of the hotels.
+
+        """
+        try:
+            self.redis_conn.sadd(self.DIRTY_KEY, *ecohotel_ids)
+        except redis.exceptions.RedisError:
+            pass
+
+    def pop_dirty(self, count=100):
+        """
+        Take the hotels marked to be recomputed.
+
+        Args:
+            count (int): The maximum number of hotels to take.
+
+        Returns:
+            list: The ids of the hotels, empty if there are none or Redis is unreachable.
+
+        """
+        try:
+            return [int(hotel_id) for hotel_id in self.redis_conn.spop(self.DIRTY_KEY, count)]
+        except redis.exceptions.RedisError:
+            return []
+
+    def set_statistics(self, statistics, ecohotel_ids=None, reset=False):
+        """
+        Store the statistics of some hotels, replacing their scores.
+
+        Args:
+            statistics (dict): The statistics of each hotel id, see `hotel_statistics`.
+            ecohotel_ids (list): The hotels to store, the ones missing from the statistics
+                are removed from the boards. The keys of the statistics by default.
+            reset (bool): True to remove every other hotel from the boards.
+
+        """
+        ecohotel_ids = list(statistics) if ecohotel_ids is None else ecohotel_ids
+        try:
+            pipe = self.redis_conn.pipeline()
+            if reset:
+                pipe.delete(self.TOTALS_KEY, *(self.key(board) for board in self.BOARDS))
+            for ecohotel_id in ecohotel_ids:
+                hotel = statistics.get(ecohotel_id)
+                if hotel is None:
+                    pipe.hdel(self.TOTALS_KEY, f"{ecohotel_id}:produced", f"{ecohotel_id}:consumed")
+                    for board in self.BOARDS:
+                        pipe.zrem(self.key(board), ecohotel_id)
+                    continue
+                produced, consumed = hotel['total_produced'], hotel['total_consumed']
+                pipe.hset(self.TOTALS_KEY, mapping={f"{ecohotel_id}:produced": produced,
+                                                    f"{ecohotel_id}:consumed": consumed})
+                pipe.zadd(self.key('net_energy'), {ecohotel_id: produced - consumed})
+                if consumed:
+                    pipe.zadd(self.key('self_sufficiency'), {ecohotel_id: produced / consumed})
+                else:
+                    pipe.zrem(self.key('self_sufficiency'), ecohotel_id)
+                if hotel['max_energy_prod'] is not None:
+                    pipe.zadd(self.key('best_day'), {ecohotel_id: hotel['max_energy_prod']})
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+    def page(self, board, start, count):
+        """
+        Read a page of a board, from the highest score.
+
+        Args:
+            board (str): The name of the board.
+            start (int): The 0-based rank of the first hotel.
+            count (int): The number of hotels.
+
+        Returns:
+            tuple: The (hotel id, score) pairs of the page and the number of ranked hotels,
+                ([], 0) if Redis is unreachable.
+
+        """
+        try:
+            pipe = self.redis_conn.pipeline()
+            pipe.zrevrange(self.key(board), start, start + count - 1, withscores=True)
+            pipe.zcard(self.key(board))
+            entries, size = pipe.execute()
+        except redis.exceptions.RedisError:
+            return [], 0
+        return [(int(hotel_id), score) for hotel_id, score in entries], size
+
+    def rank(self, board, ecohotel_id):
+        """
+        Get the rank and the score of a hotel in a board.
+
+        Args:
+            board (str): The name of the board.
+            ecohotel_id (int): The id of the hotel.
+
+        Returns:
+            tuple: The 0-based rank and the score, (None, None) if the hotel is not ranked
+                or Redis is unreachable.
+
+        """
+        try:
+            pipe = self.redis_conn.pipeline()
+            pipe.zrevrank(self.key(board), ecohotel_id)
+            pipe.zscore(self.key(board), ecohotel_id)
+            position, score = pipe.execute()
+        except redis.exceptions.RedisError:
+            return None, None
+        return position, score
+
+
+class CarbonFootprintCache:
+    """CarbonFootprintCache class.
+
+    This class caches the carbon footprint of each hotel in a Redis hash, together with the
+    version of the emission factors it was computed with. A change of the factors invalidates
+    every hotel at once; a change of the reports of a hotel invalidates that hotel only.
+
+    Attributes:
+        KEY (str): The Redis key of the hash of the footprints.
+        VERSION_FIELD (str): The field of the hash that holds the version of the factors.
+        redis_conn (redis.Redis): Redis connection object.
+    """
+
+    KEY = 'carbon:footprints'
+    VERSION_FIELD = 'version'
+
+    def __init__(self) -> None:
+        """
+        Initialize the CarbonFootprintCache instance.
+
+        It establishes a connection to the Redis server using the provided host and port settings.
+
+        """
+        self.redis_conn = redis.Redis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+
+    def get_many(self, version, ecohotel_ids):
+        """
+        Get the cached footprints of some hotels.
+
+        Args:
+            version (str): The version of the emission factors.
+            ecohotel_ids (list): The ids of the hotels.
+
+        Returns:
+            dict: The footprint of each cached hotel id, empty if the cache holds another
+                version or Redis is unreachable.
+
+        """
+        if not ecohotel_ids:
+            return {}
+        try:
+            stored_version, *values = self.redis_conn.hmget(
+                self.KEY, self.VERSION_FIELD, *ecohotel_ids)
+        except redis.exceptions.RedisError:
+            return {}
+        if stored_version is None or stored_version.decode('utf-8') != version:
+            return {}
+        return {ecohotel_id: json.loads(value)
+                for ecohotel_id, value in zip(ecohotel_ids, values) if value is not None}
+
+    def set_many(self, version, footprints):
+        """
+        Cache the footprints of some hotels, dropping the ones of other versions.
+
+        Args:
+            version (str): The version of the emission factors.
+            footprints (dict): The footprint of each hotel id.
+
+        """
+        if not footprints:
+            return
+        try:
+            stored_version = self.redis_conn.hget(self.KEY, self.VERSION_FIELD)
+            pipe = self.redis_conn.pipeline()
+            if stored_version is None or stored_version.decode('utf-8') != version:
+                pipe.delete(self.KEY)
+            pipe.hset(self.KEY, mapping={
+                self.VERSION_FIELD: version,
+                **{ecohotel_id: json.dumps(footprint)
+                   for ecohotel_id, footprint in footprints.items()}})
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+    def invalidate(self, *ecohotel_ids):
+        """
+        Drop the cached footprints of hotels.
+
+        Args:
+            *ecohotel_ids (int): The ids of the hotels.
+
+        """
+        try:
+            self.redis_conn.hdel(self.KEY, *ecohotel_ids)
+        except redis.exceptions.RedisError:
+            pass
+
+
+class ComparisonCache:
+    """ComparisonCache class.
+
+    This class caches the serialized responses of the period comparisons in Redis, keyed by
+    their normalized parameters and by the version of the energy data, so any change of the
+    data invalidates every cached comparison at once.
+
+    Attributes:
+        KEY_PREFIX (str): The prefix of the Redis keys of the responses.
+        TIMEOUT (int): Seconds after which an unused response expires.
+        redis_conn (redis.Redis): Redis connection object.
+    """
+
+    KEY_PREFIX = 'comparison'
+    TIMEOUT = 3600
+
+    def __init__(self) -> None:
+        """
+        Initialize the ComparisonCache instance.
+
+        It establishes a connection to the Redis server using the provided host and port settings.
+
+        """
+        self.redis_conn = redis.Redis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+
+    def key(self, version, params):
+        """
+        Build the Redis key of a response.
+
+        Args:
+            version (int): The version of the energy data.
+            params (dict): The normalized parameters of the comparison.
+
+        Returns:
+            str: The key.
+
+        """
+        digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"{self.KEY_PREFIX}:{version}:{digest[:32]}"
+
+    def get(self, version, params):
+        """
+        Get a cached response.
+
+        Args:
+            version (int): The version of the energy data.
+            params (dict): The normalized parameters of the comparison.
+
+        Returns:
+            str or None: The serialized response, None if it is not cached or Redis is unreachable.
+
+        """
+        try:
+            payload = self.redis_conn.get(self.key(version, params))
+        except redis.exceptions.RedisError:
+            return None
+        return payload.decode('utf-8') if payload is not None else None
+
+    def set(self, version, params, payload):
+        """
+        Cache a response.
+
+        Args:
+            version (int): The version of the energy data.
+            params (dict): The normalized parameters of the comparison.
+            payload (str): The serialized response.
+
+        """
+        try:
+            self.redis_conn.set(self.key(version, params), payload, ex=self.TIMEOUT)
+        except redis.exceptions.RedisError:
+            pass
+
+
+class ReportCardCache:
+    """ReportCardCache class.
+
+    This class caches the rendered HTML card of each report in Redis, keyed by the id of the
+    report and by the version of the card template, so a change of the template invalidates
+    every card at once.
+
+    Attributes:
+        KEY_PREFIX (str): The prefix of the Redis keys of the cards.
+        TIMEOUT (int): Seconds after which an unused card expires.
+        redis_conn (redis.Redis): Redis connection object.
+    """
+
+    KEY_PREFIX = 'report_card'
+    TIMEOUT = 30 * 24 * 3600
+
+    def __init__(self) -> None:
+        """
+        Initialize the ReportCardCache instance.
+
+        It establishes a connection to the Redis server using the provided host and port settings.
+
+        """
+        self.redis_conn = redis.Redis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+
+    def key(self, version, report_id):
+        """
+        Build the Redis key of a card.
+
+        Args:
+            version (str): The version of the card template.
+            report_id (int): The id of the report.
+
+        Returns:
+            str: The key.
+
+        """
+        return f"{self.KEY_PREFIX}:{version}:{report_id}"
+
+    def get_many(self, version, report_ids):
+        """
+        Get the cached cards of some reports.
+
+        Args:
+            version (str): The version of the card template.
+            report_ids (list): The ids of the reports.
+
+        Returns:
+            dict: The card of each cached report id, empty if Redis is unreachable.
+
+        """
+        if not report_ids:
+            return {}
+        try:
+            cards = self.redis_conn.mget([self.key(version, report_id) for report_id in report_ids])
+        except redis.exceptions.RedisError:
+            return {}
+        return {report_id: card.decode('utf-8')
+                for report_id, card in zip(report_ids, cards) if card is not None}
+
+    def set_many(self, version, cards):
+        """
+        Cache the cards of some reports.
+
+        Args:
+            version (str): The version of the card template.
+            cards (dict): The card of each report id.
+
+        """
+        if not cards:
+            return
+        try:
+            pipe = self.redis_conn.pipeline(transaction=False)
+            for report_id, card in cards.items():
+                pipe.set(self.key(version, report_id), card, ex=self.TIMEOUT)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            pass
+
+    def delete_many(self, version, report_ids):
+        """
+        Drop the cached cards of some reports.
+
+        Args:
+            version (str): The version of the card template.
+            report_ids (list): The ids of the reports.
+
+        """
+        if not report_ids:
+            return
+        try:
+            self.redis_conn.delete(*(self.key(version, report_id) for report_id in report_ids))
+        except redis.exceptions.RedisError:
+            pass
@@ -4,34 +4,200 @@ List of classes:
 - EnergyReportListView: View for the main page of the site.
 - CreateReportView: View for the "Add Report" page.
 - DashboardView: View for the "Dashboard" page.
+- DashboardStreamView: View for the live updates of the "Dashboard" page.
+- LeaderboardView: View for the "Leaderboard" page.
+- LeaderboardApiView: JSON API of the leaderboards.
+- ComparisonView: View for the "Comparison" page.
+- ComparisonApiView: JSON API of the period comparisons.
+- ArchiveView: View for the "Archive" page.
+
+List of functions:
+- code_version: Version of the templates and static files of the pages that show the energy data.
+- data_etag: ETag of the pages that show the energy data.
+- data_last_modified: Last-Modified date of the pages that show the energy data.
+- leaderboard_page: Page of a leaderboard requested by the query string.
+- comparison_data: Period comparison requested by the query string.
 """
+import hashlib
+import heapq
+import itertools
+import json
+import time
+from datetime import date, datetime, timezone
+from functools import lru_cache
 from typing import Any, Dict
-from django.http import JsonResponse
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError
+from django.http import (Http404, HttpResponse, HttpResponseForbidden, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import redirect, render
+from django.template.loader import get_template
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic import ListView, View
+import redis
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .models import EcoHotel, Report
-from .forms import ReportForm, ECOHOTELS_CHOICES
-from django.db.models import Sum
+from ecohotel_board.db_routers import ReplicaReadMixin, reads_from_replica
+from .aggregates import compare_periods, empty_statistics, hotel_statistics
+from .archive import monthly_reports
+from .cards import cached_cards, card_template_version
+from .carbon import cached_hotel_footprints
+from .models import EcoHotel, Report, ReportSegment
+from .forms import ComparisonForm, ReportForm, ecohotels_choices
+from .sharding import fan_out
+from .utils import (ComparisonCache, DashboardChannel, DataVersion, HotelLeaderboard,
+                    ReportDeduplicator)
+
+
+def _data_version(request):
+    """Gets the version of the energy data, reading it from Redis once per request.
+
+    Pending messages must be rendered, so no version is returned while there are any. The
+    version follows the primary: when the data is read from the replica, no version is
+    returned either until `REPLICA_STICKY_SECONDS` have passed since the last change, the lag
+    the replica is allowed. Otherwise a page read from a lagging replica would be validated
+    and cached as the current version.
+
+    Args:
+        request (HttpRequest): The HttpRequest object of the request.
+
+    Returns:
+        tuple: The version counter and the timestamp of the last change, or (None, None).
+    """
+    if not hasattr(request, '_data_version'):
+        if len(messages.get_messages(request)):
+            request._data_version = (None, None)
+        else:
+            version, modified = DataVersion().current()
+            if (modified is not None and reads_from_replica()
+                    and time.time() - modified < settings.REPLICA_STICKY_SECONDS):
+                version, modified = None, None
+            request._data_version = (version, modified)
+    return request._data_version
+
+
+# The templates of the pages validated by `data_etag`, with the templates they extend or include.
+DATA_PAGE_TEMPLATES = ('base.html', 'messages.html', 'access_denied.html', 'homepage.html',
+                       'dashboard.html', 'archive.html')
+
+
+@lru_cache(maxsize=None)
+def _release_version():
+    """Fingerprints the templates, the card template and the fingerprinted static files.
+
+    Returns:
+        str: The fingerprint.
+    """
+    fingerprint = hashlib.sha256()
+    for name in DATA_PAGE_TEMPLATES:
+        fingerprint.update(get_template(name).template.source.encode('utf-8'))
+    fingerprint.update(card_template_version().encode('utf-8'))
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+    fingerprint.update(json.dumps(sorted(hashed_files.items())).encode('utf-8'))
+    return fingerprint.hexdigest()[:12]
+
+
+def code_version():
+    """Gets the version of the templates and static files of the pages that show the energy data.
+
+    It is computed once per process, since they only change with a deploy, which restarts the
+    process. With `DEBUG` they change while the server runs, so it is computed on each call.
+
+    Returns:
+        str: The version.
+    """
+    if settings.DEBUG:
+        _release_version.cache_clear()
+    return _release_version()
+
+
+def data_etag(request, *args, **kwargs):
+    """Computes the ETag of a page that shows the energy data.
 
-class EnergyReportListView(LoginRequiredMixin,ListView):
+    The page also depends on the user, whose name and permissions appear in the navigation bar,
+    and on the templates and static files that render it.
+
+    Args:
+        request (HttpRequest): The HttpRequest object of the request.
+
+    Returns:
+        str or None: The ETag, None if the data version is unknown.
+    """
+    version, modified = _data_version(request)
+    if version is None:
+        return None
+    return (f"{version}-{modified}-{request.user.pk}-{int(request.user.is_staff)}-"
+            f"{code_version()}")
+
+
+def data_last_modified(request, *args, **kwargs):
+    """Computes the Last-Modified date of a page that shows the energy data.
+
+    Args:
+        request (HttpRequest): The HttpRequest object of the request.
+
+    Returns:
+        datetime or None: The date of the last change, None if the data version is unknown.
+    """
+    _, modified = _data_version(request)
+    if modified is None:
+        return None
+    return datetime.fromtimestamp(modified, tz=timezone.utc)
+
+
+# Answers 304 Not Modified, without running the queries of the view, when the data is unchanged.
+_conditional_data_page = [
+    cache_control(private=True, no_cache=True),
+    condition(etag_func=data_etag, last_modified_func=data_last_modified),
+]
+
+@method_decorator(_conditional_data_page, name='get')
+class EnergyReportListView(ReplicaReadMixin, LoginRequiredMixin,ListView):
     """Class that manages the homepage view.
 
+    The reports are shown newest first, a page of cards at a time, selected by the `page` of
+    the query string.
+
         Attributes:
             model (Report): instance of the model Report.
             template_name (str): name of the template of homepage.
+            cards_per_page (int): number of report cards of a page.
     """
     model = Report
     template_name = 'homepage.html'
+    cards_per_page = 50
 
     def get_context_data(self, **kwargs: Any) -> Dict[str, Any]:
         """Gets the context data for the template.
 
+        Raises:
+            Http404: If the page is not a positive number.
+
         Returns:
             Dict[str, Any]: the context data for template.
         """
         context = super().get_context_data(**kwargs)
-        context['reports'] = Report.objects.all().order_by('-date').distinct()
+        try:
+            page = int(self.request.GET.get('page', 1))
+        except ValueError:
+            raise Http404("Invalid page.")
+        if page < 1:
+            raise Http404("Invalid page.")
+        start = (page - 1) * self.cards_per_page
+        # One more report than the page tells whether there is a next page.
+        end = start + self.cards_per_page + 1
+        # The reports of each shard come sorted, so they are merged without sorting again.
+        report_ids = [report_id for _, report_id in itertools.islice(heapq.merge(
+            *fan_out(lambda _: list(Report.objects.order_by('-date', '-pk')
+                                    .values_list('date', 'pk')[:end])),
+            reverse=True), start, end)]
+        context['cards'] = cached_cards(report_ids[:self.cards_per_page])
+        context['page'] = page
+        context['has_next'] = len(report_ids) > self.cards_per_page
 
         return context
 
@@ -54,6 +220,9 @@ class CreateReportView(View):
     def post(self, request):
         """Handles the POST request.
 
+        A report that was already submitted is collapsed into the existing one, so it is
+        neither stored nor sent to the blockchain again.
+
         Args:
             request (HttpRequest): The HttpRequest object of the request.
 
@@ -69,17 +238,35 @@ class CreateReportView(View):
             energy_produced = form.cleaned_data['energy_produced']
             energy_consumed = form.cleaned_data['energy_consumed']
             ecohotel = EcoHotel.objects.filter(
-                name=ECOHOTELS_CHOICES[int(name)][1]).first()
+                name=ecohotels_choices()[int(name)][1]).first()
             report = Report(
                 ecohotel=ecohotel, energy_produced=energy_produced, energy_consumed=energy_consumed)
-            report.write_on_chain()
+            report_hash = report.compute_hash()
+            deduplicator = ReportDeduplicator()
+            if deduplicator.seen(report_hash):
+                messages.info(request, "This report was already submitted.")
+                return redirect('/')
+            try:
+                report.write_on_chain()
+            except IntegrityError:
+                # A previous submission was stored, but its transaction may have failed.
+                stored, = fan_out(lambda _: Report.objects.filter(
+                    ecohotel=ecohotel, hash=report_hash).first(), [ecohotel.pk])
+                if stored is None or stored.txId:
+                    messages.info(request, "This report was already submitted.")
+                else:
+                    stored.anchor()
+            # Only a report written on the blockchain is remembered, so a submission whose
+            # transaction failed can be retried.
+            deduplicator.remember(report_hash)
             return redirect('/')
         else:
             response_data = {'result': 'failure', 'errors': form.errors}
             return JsonResponse(response_data, status=400)
 
 
-class DashboardView(LoginRequiredMixin, View):
+@method_decorator(_conditional_data_page, name='get')
+class DashboardView(ReplicaReadMixin, LoginRequiredMixin, View):
     """Class that manages the dashboard view for the admin.  
         Attributes:
             login_url (str): url of the login page.
@@ -96,34 +283,341 @@ class DashboardView(LoginRequiredMixin, View):
         Returns:
             HttpResponse: the redirect to dashboard or access_denied page.
         """
-        hotel_infos = []
         if request.user.is_staff:
-            for hotel in EcoHotel.objects.all():
-                total_consumed = sum(Report.objects.filter(ecohotel=hotel).values_list(
-                    'energy_consumed', flat=True))
-                total_produced = sum(Report.objects.filter(ecohotel=hotel).values_list(
-                    'energy_produced', flat=True))
-                total_prod_daily = Report.objects.filter(ecohotel=hotel).values('date').annotate(
-                    total_energy=Sum('energy_produced')).order_by('-total_energy').first()
-                total_consum_daily = Report.objects.filter(ecohotel=hotel).values('date').annotate(
-                    total_energy=Sum('energy_consumed')).order_by('-total_energy').last()
-
-                hotel_infos.append(
-                    (hotel, {
-                            'total_consumed': total_consumed,
-                            'total_produced': total_produced,
-                            'max_energy_prod_day': total_prod_daily.get('date', None),
-                            'max_energy_prod': total_prod_daily.get('total_energy', None),
-                            'max_energy_cons_day': total_consum_daily.get('date', None),
-                            'max_energy_cons': total_consum_daily.get('total_energy', None)
-                            }
-                    )
-                )
+            # Read before the data, so a change committed meanwhile shows up as a newer version.
+            data_version, _ = DataVersion().current()
+            statistics = hotel_statistics()
+            hotels = list(EcoHotel.objects.all())
+            footprints = cached_hotel_footprints([hotel.pk for hotel in hotels])
+            hotel_infos = [(hotel, {**(statistics.get(hotel.pk) or empty_statistics()),
+                                    **footprints[hotel.pk]})
+                           for hotel in hotels]
 
             context = {
-                'hotels': hotel_infos
+                'hotels': hotel_infos,
+                'data_version': data_version or 0,
+                'stream_retry_ms': DashboardStreamView.keepalive * 1000,
             }
                 
             return render(request, 'dashboard.html', context)
         else:
             return render(request, 'access_denied.html')
+
+
+class DashboardStreamView(LoginRequiredMixin, View):
+    """Class that pushes the changes of the energy data to the dashboard as Server-Sent Events.
+
+    The changes are received from Redis pub/sub, so a report created by any worker process
+    reaches every open dashboard. Each event carries a per-hotel delta that the page applies
+    to the numbers it shows, without recomputing them, and the version of the data it leads
+    to; the page reloads when a version is missing. The stream is a synchronous generator, so
+    each open dashboard holds a worker thread, a Redis connection and a database connection.
+
+        Attributes:
+            login_url (str): url of the login page.
+            keepalive (int): seconds between two keep-alive comments on an idle stream.
+    """
+    login_url = 'login'
+    keepalive = 15
+
+    def get(self, request, *args, **kwargs):
+        """Handles the GET request.
+        Args:
+            request (HttpRequest): The HttpRequest object of the request.
+            args (tuple): Tuples of the positional arguments.
+            kwargs (dict): Dictionary of named arguments.
+
+        Returns:
+            StreamingHttpResponse: the stream of events, HttpResponseForbidden for non-staff users,
+                or HttpResponse with 503 status code while Redis is unreachable.
+        """
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+        # Subscribe before answering, so no change is lost while the client connects.
+        try:
+            subscription = DashboardChannel().subscribe()
+        except redis.exceptions.RedisError:
+            # Without Redis there is nothing to push: the page keeps the numbers it rendered.
+            response = HttpResponse("The live updates are unavailable.", status=503,
+                                    content_type='text/plain')
+            response['Retry-After'] = self.keepalive
+            return response
+        response = StreamingHttpResponse(
+            self._events(subscription), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def _events(self, subscription):
+        """Generates the events of the stream.
+
+        Args:
+            subscription (PubSub): The subscription to the changes.
+
+        Yields:
+            str: The events, and a keep-alive comment when no change arrives. The stream ends
+                if Redis becomes unreachable, and the browser reconnects after the retry delay.
+        """
+        try:
+            yield f"retry: {self.keepalive * 1000}\n\n"
+            while True:
+                try:
+                    message = subscription.get_message(timeout=self.keepalive)
+                except redis.exceptions.RedisError:
+                    return
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                data = message['data']
+                if isinstance(data, bytes):
+                    data = data.decode('utf-8')
+                yield f"data: {data}\n\n"
+        finally:
+            subscription.close()
+
+
+def leaderboard_page(request, per_page=20, max_per_page=100):
+    """Reads the page of a leaderboard requested by the query string.
+
+    The query string selects the `board`, the 1-based `page` and the `per_page` size; with
+    `hotel`, the rank of that hotel is included.
+
+    Args:
+        request (HttpRequest): The HttpRequest object of the request.
+        per_page (int): The default number of hotels per page.
+        max_per_page (int): The highest number of hotels per page.
+
+    Raises:
+        Http404: If the board does not exist or the parameters are not numbers.
+
+    Returns:
+        dict: The board, the pagination and the ranked hotels of the page.
+    """
+    board = request.GET.get('board', 'net_energy')
+    if board not in HotelLeaderboard.BOARDS:
+        raise Http404("Unknown leaderboard.")
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+        per_page = min(max_per_page, max(1, int(request.GET.get('per_page', per_page))))
+        hotel = int(request.GET['hotel']) if request.GET.get('hotel') else None
+    except ValueError:
+        raise Http404("Invalid page.")
+
+    leaderboard = HotelLeaderboard()
+    start = (page - 1) * per_page
+    entries, size = leaderboard.page(board, start, per_page)
+    names = EcoHotel.objects.in_bulk([hotel_id for hotel_id, _ in entries])
+    data = {
+        'board': board,
+        'title': HotelLeaderboard.BOARDS[board],
+        'page': page,
+        'per_page': per_page,
+        'pages': max(1, -(-size // per_page)),
+        'count': size,
+        'results': [
+            {'rank': start + position + 1, 'hotel': hotel_id,
+             'name': names[hotel_id].name if hotel_id in names else None, 'score': score}
+            for position, (hotel_id, score) in enumerate(entries)
+        ],
+    }
+    if hotel is not None:
+        position, score = leaderboard.rank(board, hotel)
+        data['hotel'] = {'hotel': hotel, 'score': score,
+                         'rank': position + 1 if position is not None else None}
+    return data
+
+
+class LeaderboardView(LoginRequiredMixin, View):
+    """Class that manages the leaderboard view for the admin.
+
+    The rankings are read from the Redis sorted sets, never from the reports.
+
+        Attributes:
+            login_url (str): url of the login page.
+    """
+    login_url = 'login'
+
+    def get(self, request, *args, **kwargs):
+        """Handles the GET request.
+        Args:
+            request (HttpRequest): The HttpRequest object of the request.
+            args (tuple): Tuples of the positional arguments.
+            kwargs (dict): Dictionary of named arguments.
+
+        Returns:
+            HttpResponse: the leaderboard or access_denied page.
+        """
+        if not request.user.is_staff:
+            return render(request, 'access_denied.html')
+        context = {
+            'leaderboard': leaderboard_page(request),
+            'boards': HotelLeaderboard.BOARDS,
+        }
+        return render(request, 'leaderboard.html', context)
+
+
+class LeaderboardApiView(LoginRequiredMixin, View):
+    """Class that serves the pages of the leaderboards as JSON.
+
+        Attributes:
+            login_url (str): url of the login page.
+    """
+    login_url = 'login'
+
+    def get(self, request, *args, **kwargs):
+        """Handles the GET request.
+        Args:
+            request (HttpRequest): The HttpRequest object of the request.
+            args (tuple): Tuples of the positional arguments.
+            kwargs (dict): Dictionary of named arguments.
+
+        Returns:
+            JsonResponse: the page of the leaderboard, or HttpResponseForbidden for non-staff users.
+        """
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+        return JsonResponse(leaderboard_page(request))
+
+
+def comparison_data(request):
+    """Computes the period comparison requested by the query string, or reads it from the cache.
+
+    The parameters are normalized (sorted hotels, ISO dates) before building the cache key,
+    so equivalent requests share the cached response.
+
+    Args:
+        request (HttpRequest): The HttpRequest object of the request.
+
+    Returns:
+        tuple: The bound ComparisonForm and the serialized comparison, None if the form is invalid.
+    """
+    form = ComparisonForm(request.GET)
+    if not form.is_valid():
+        return form, None
+    hotels = sorted(hotel.pk for hotel in form.cleaned_data['hotels']) or None
+    params = {
+        'hotels': hotels,
+        'start': form.cleaned_data['start'].isoformat(),
+        'end': form.cleaned_data['end'].isoformat(),
+        'granularity': form.cleaned_data['granularity'],
+        'compare': form.cleaned_data['compare'],
+    }
+    version, _ = _data_version(request)
+    cache = ComparisonCache()
+    payload = cache.get(version, params) if version is not None else None
+    if payload is None:
+        payload = json.dumps(compare_periods(
+            hotels, form.cleaned_data['start'], form.cleaned_data['end'],
+            params['granularity'], params['compare']), cls=DjangoJSONEncoder)
+        if version is not None:
+            cache.set(version, params, payload)
+    return form, payload
+
+
+class ComparisonView(ReplicaReadMixin, LoginRequiredMixin, View):
+    """Class that manages the comparison view for the admin.
+
+        Attributes:
+            login_url (str): url of the login page.
+    """
+    login_url = 'login'
+
+    def get(self, request, *args, **kwargs):
+        """Handles the GET request.
+        Args:
+            request (HttpRequest): The HttpRequest object of the request.
+            args (tuple): Tuples of the positional arguments.
+            kwargs (dict): Dictionary of named arguments.
+
+        Returns:
+            HttpResponse: the comparison or access_denied page.
+        """
+        if not request.user.is_staff:
+            return render(request, 'access_denied.html')
+        if not request.GET:
+            return render(request, 'comparison.html', {'form': ComparisonForm()})
+        form, payload = comparison_data(request)
+        context = {
+            'form': form,
+            'comparison': json.loads(payload) if payload is not None else None,
+        }
+        return render(request, 'comparison.html', context)
+
+
+class ComparisonApiView(ReplicaReadMixin, LoginRequiredMixin, View):
+    """Class that serves the period comparisons as JSON.
+
+        Attributes:
+            login_url (str): url of the login page.
+    """
+    login_url = 'login'
+
+    def get(self, request, *args, **kwargs):
+        """Handles the GET request.
+        Args:
+            request (HttpRequest): The HttpRequest object of the request.
+            args (tuple): Tuples of the positional arguments.
+            kwargs (dict): Dictionary of named arguments.
+
+        Returns:
+            HttpResponse: the comparison as JSON, the errors of the parameters with status 400,
+                or HttpResponseForbidden for non-staff users.
+        """
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+        form, payload = comparison_data(request)
+        if payload is None:
+            return JsonResponse({'result': 'failure', 'errors': form.errors}, status=400)
+        return HttpResponse(payload, content_type='application/json')
+
+
+@method_decorator(_conditional_data_page, name='get')
+class ArchiveView(ReplicaReadMixin, LoginRequiredMixin, View):
+    """Class that manages the view of the archived reports.
+
+    The reports moved into the monthly segments no longer appear on the homepage. This page
+    lists the archived months of every hotel, from the rollups of the segments, and shows the
+    reports of a month, read back from its segment.
+
+        Attributes:
+            login_url (str): url of the login page.
+    """
+    login_url = 'login'
+
+    def get(self, request, ecohotel_id=None, year=None, month=None, *args, **kwargs):
+        """Handles the GET request.
+        Args:
+            request (HttpRequest): The HttpRequest object of the request.
+            ecohotel_id (int): The id of the hotel of the month to show, None for the list.
+            year (int): The year of the month to show.
+            month (int): The month to show.
+            args (tuple): Tuples of the positional arguments.
+            kwargs (dict): Dictionary of named arguments.
+
+        Returns:
+            HttpResponse: the list of the archived months, or the reports of a month.
+
+        Raises:
+            Http404: If the hotel or the month does not exist.
+        """
+        if ecohotel_id is None:
+            names = dict(EcoHotel.objects.values_list('pk', 'name'))
+            months = [entry for entries in fan_out(lambda _: list(ReportSegment.objects.values(
+                'ecohotel_id', 'month', 'report_count', 'total_produced', 'total_consumed')))
+                for entry in entries]
+            months.sort(key=lambda entry: (entry['month'], names.get(entry['ecohotel_id'])),
+                        reverse=True)
+            for entry in months:
+                entry['name'] = names.get(entry['ecohotel_id'])
+            return render(request, 'archive.html', {'months': months})
+
+        hotel = EcoHotel.objects.filter(pk=ecohotel_id).first()
+        try:
+            first_day = date(year, month, 1)
+        except ValueError:
+            first_day = None
+        if hotel is None or first_day is None:
+            raise Http404("No such archived month.")
+        reports, = fan_out(lambda _: monthly_reports(ecohotel_id, first_day), [ecohotel_id])
+        context = {'hotel': hotel, 'month': first_day, 'reports': reports}
+        return render(request, 'archive.html', context)